@@ -0,0 +1,150 @@
+"""
+Event-loop lag under mixed large and small bodies, with body windows scanned
+inline vs offloaded to the BodyScanPool.
+
+A probe task sleeps 1ms in a loop and records how late it wakes up, while
+clients send a mix of small bodies and a few multi-MB ones through the full
+WAFMiddleware. Each body arrives the way uvicorn delivers it: in
+``--chunk-size`` receive() messages with a Content-Length header, so the
+pool is engaged (or not) exactly as it is when serving. Lag is what every
+other connection on the worker would wait.
+
+Run from the repository root:
+    python -m benchmarks.bench_body_offload
+    python -m benchmarks.bench_body_offload --large-size 4194304 --large-ratio 0.1
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from typing import List
+
+import fakeredis
+
+from src import middleware
+from src.config import settings
+
+PROBE_INTERVAL = 0.001
+
+
+def build_bodies(count: int, small_size: int, large_size: int, large_ratio: float, seed: int = 7) -> List[bytes]:
+    rng = random.Random(seed)
+    filler = "lorem ipsum dolor sit amet order=1234 page=2 "
+    bodies = []
+    for _ in range(count):
+        size = large_size if rng.random() < large_ratio else small_size
+        bodies.append((filler * (size // len(filler) + 1))[:size].encode())
+    return bodies
+
+
+async def app(scope, receive, send):
+    """Reads the whole body, like a handler parsing it, then answers 200"""
+    more_body = True
+    while more_body:
+        message = await receive()
+        more_body = message.get("more_body", False)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def post(waf: middleware.WAFMiddleware, body: bytes, chunk_size: int) -> int:
+    scope = {
+        "type": "http", "method": "POST", "path": "/upload", "raw_path": b"/upload", "query_string": b"",
+        "root_path": "", "scheme": "http", "server": ("waf", 80), "client": ("198.51.100.7", 40000),
+        "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())],
+    }
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    status = []
+
+    async def receive():
+        if not chunks:
+            return {"type": "http.disconnect"}
+        await asyncio.sleep(0)  # a real connection yields to the loop between socket reads
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await waf(scope, receive, send)
+    return status[0]
+
+
+async def probe(lags: List[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def run(waf: middleware.WAFMiddleware, bodies: List[bytes], concurrency: int, chunk_size: int):
+    lags: List[float] = []
+    stop = asyncio.Event()
+    probe_task = asyncio.ensure_future(probe(lags, stop))
+    queue = list(bodies)
+
+    async def client():
+        while queue:
+            status = await post(waf, queue.pop(), chunk_size)
+            assert status == 200, status
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    return elapsed, sorted(lags)
+
+
+def report(label: str, bodies: int, elapsed: float, lags: List[float]):
+    def percentile(p: float) -> float:
+        return lags[max(0, int(round(p / 100 * len(lags))) - 1)] * 1000
+
+    print(
+        f"{label:<8} {bodies / elapsed:8.1f} bodies/s  loop lag p50 {percentile(50):7.2f}ms  "
+        f"p99 {percentile(99):7.2f}ms  max {lags[-1] * 1000:7.2f}ms"
+    )
+
+
+async def main_async(args):
+    bodies = build_bodies(args.bodies, args.small_size, args.large_size, args.large_ratio)
+
+    settings.BODY_SCAN_POOL_WORKERS = 0
+    waf = middleware.WAFMiddleware(app)
+    elapsed, lags = await run(waf, bodies, args.concurrency, args.chunk_size)
+    report("inline", len(bodies), elapsed, lags)
+
+    settings.BODY_SCAN_POOL_WORKERS = args.workers
+    waf = middleware.WAFMiddleware(app)
+    await asyncio.sleep(args.warmup)  # let the workers start and compile their rules
+    elapsed, lags = await run(waf, bodies, args.concurrency, args.chunk_size)
+    report("pool", len(bodies), elapsed, lags)
+    waf.scan_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bodies", type=int, default=400)
+    parser.add_argument("--small-size", type=int, default=2048)
+    parser.add_argument("--large-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--large-ratio", type=float, default=0.05)
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024, help="bytes per receive() message")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    args = parser.parse_args()
+
+    settings.LOG_DIR = tempfile.mkdtemp(prefix="waf-bench-logs-")
+    settings.ENABLE_ACCESS_LOG = settings.ENABLE_ERROR_LOG = False
+    settings.ENABLE_ML_DETECTION = False
+    settings.ENABLE_VERDICT_CACHE = False
+    settings.MAX_REQUEST_SIZE = max(settings.MAX_REQUEST_SIZE, args.large_size)
+    settings.RATE_LIMIT_BURST = args.bodies * 2
+    middleware.redis_client = fakeredis.aioredis.FakeRedis()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Featurization cost per request: the old Keras-style word tokenizer path vs
+the hashed n-gram HashingFeaturizer.
+
+The old path JSON-serializes each request, splits it into words, looks them
+up in a fitted word index and pads the sequence, one request at a time (as
+TokenizerLite and pad_sequences did, matching Keras texts_to_sequences).
+The hashed path featurizes whole batches with NumPy. Both start from the
+same request dicts, so request_text is included in both costs.
+
+Run from the repository root:
+    python -m benchmarks.bench_featurizer
+    python -m benchmarks.bench_featurizer --count 5000 --batch-sizes 1 32 256
+"""
+import argparse
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks import corpus as corpus_module
+from src.featurizer import HashingFeaturizer, request_text
+
+KERAS_FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+
+class WordIndexPath:
+    """The previous per-request tokenizer path"""
+
+    def __init__(self, requests: List[Dict], num_words: int = 10000, maxlen: int = 1000):
+        self.num_words = num_words
+        self.maxlen = maxlen
+        self.translate = str.maketrans({c: " " for c in KERAS_FILTERS})
+        counts = {}
+        for request in requests:
+            for word in self._words(request_text(request)):
+                counts[word] = counts.get(word, 0) + 1
+        vocabulary = ["<OOV>"] + sorted(counts, key=counts.get, reverse=True)
+        self.word_index = {word: index for index, word in enumerate(vocabulary, start=1)}
+
+    def _words(self, text: str) -> List[str]:
+        return [word for word in text.lower().translate(self.translate).split(" ") if word]
+
+    def transform_request(self, request: Dict) -> np.ndarray:
+        sequence = []
+        for word in self._words(request_text(request)):
+            index = self.word_index.get(word)
+            sequence.append(index if index is not None and index < self.num_words else 1)
+        padded = np.zeros((1, self.maxlen), dtype=np.int32)
+        sequence = sequence[:self.maxlen]
+        padded[0, :len(sequence)] = sequence
+        return padded
+
+
+def per_request_us(call, requests: List[Dict], batch_size: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for offset in range(0, len(requests), batch_size):
+            call(requests[offset:offset + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return best / len(requests) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL corpus (default: generated with benchmarks.corpus)")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 256])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    requests = corpus_module.load(args.corpus) if args.corpus else list(corpus_module.generate(args.count))
+    old = WordIndexPath(requests)
+    featurizer = HashingFeaturizer()
+
+    print(f"{'path':<16} {'batch':>6} {'per request':>12}")
+    for batch_size in args.batch_sizes:
+        old_us = per_request_us(
+            lambda batch: np.vstack([old.transform_request(request) for request in batch]),
+            requests, batch_size, args.repeat
+        )
+        hashed_us = per_request_us(featurizer.transform_requests, requests, batch_size, args.repeat)
+        print(f"{'word index':<16} {batch_size:>6} {old_us:>10.1f}us")
+        print(f"{'hashed n-grams':<16} {batch_size:>6} {hashed_us:>10.1f}us  ({old_us / hashed_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+WAFMiddleware under overload with load shedding off and on.
+
+``--clients`` concurrent clients each send ``--requests`` requests through
+the full middleware in-process (httpx ASGI transport), with an in-process
+fakeredis and inline ML on the numpy runtime, so the model's forward passes
+are what the worker cannot keep up with. Reports latency percentiles, the
+responses by status and, with shedding on, the stages shed.
+
+Export the artifact first (python -m src.ml_runtime ...), then:
+    python -m benchmarks.bench_load_shedding --artifact models/waf_model.npz --clients 64 --budget-ms 20
+"""
+import argparse
+import asyncio
+import collections
+import statistics
+import tempfile
+import time
+
+import fakeredis
+import httpx
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+
+from src import middleware
+from src.config import settings
+
+
+def build_app(shedding: bool) -> FastAPI:
+    settings.ENABLE_LOAD_SHEDDING = shedding
+    app = FastAPI()
+
+    @app.get("/items")
+    async def items(q: str = ""):
+        return {"q": q}
+
+    app.add_middleware(middleware.WAFMiddleware)
+    return app
+
+
+def shed_counts() -> dict:
+    return {
+        "/".join(sample.labels.values()): sample.value
+        for metric in REGISTRY.collect() if metric.name == "waf_stages_shed"
+        for sample in metric.samples if sample.name.endswith("_total")
+    }
+
+
+async def measure(app: FastAPI, clients: int, requests: int):
+    transport = httpx.ASGITransport(app=app, client=("198.51.100.7", 4000))
+    latencies, statuses = [], collections.Counter()
+
+    async def client(index: int):
+        async with httpx.AsyncClient(transport=transport, base_url="http://waf") as http:
+            for i in range(requests):
+                start = time.perf_counter()
+                response = await http.get("/items", params={"q": f"item {index} {i}"})
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] += 1
+
+    await asyncio.gather(*(client(index) for index in range(clients)))
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        dict(statuses),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artifact", default="models/waf_model.npz")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=50, help="per client")
+    parser.add_argument("--budget-ms", type=float, default=20.0)
+    parser.add_argument("--lag-threshold-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    settings.LOG_DIR = tempfile.mkdtemp(prefix="waf-bench-logs-")
+    settings.ENABLE_ACCESS_LOG = settings.ENABLE_ERROR_LOG = False
+    settings.ENABLE_VERDICT_CACHE = False  # every request is distinct anyway
+    settings.ML_RUNTIME, settings.ML_ARTIFACT_PATH = "numpy", args.artifact
+    settings.WAF_TIME_BUDGET_MS = args.budget_ms
+    settings.LOAD_SHED_LAG_THRESHOLD_MS = args.lag_threshold_ms
+    settings.RATE_LIMIT_BURST = args.clients * args.requests * 2
+    middleware.redis_client = fakeredis.aioredis.FakeRedis()
+
+    print(f"{args.clients} clients x {args.requests} requests")
+    for label, shedding in (("shedding off", False), ("shedding on", True)):
+        p50, p99, statuses = asyncio.run(measure(build_app(shedding), args.clients, args.requests))
+        print(f"{label:<13} p50 {p50:8.2f} ms  p99 {p99:8.2f} ms  responses {statuses}")
+    print(f"stages shed (stage/cause/action): {shed_counts()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+WAFMiddleware request latency with access/error logging on and off.
+
+Requests go through the full middleware in-process (httpx ASGI transport),
+with an in-process fakeredis for rate limiting and ML detection disabled so
+logging is the only difference between the two runs:
+    python -m benchmarks.bench_logging --requests 5000
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+import fakeredis
+import httpx
+from fastapi import FastAPI
+
+from src import middleware
+from src.config import settings
+
+
+def build_app(access_log: bool) -> FastAPI:
+    settings.ENABLE_ACCESS_LOG = access_log
+    settings.ENABLE_ERROR_LOG = access_log
+    app = FastAPI()
+
+    @app.get("/items")
+    async def items(q: str = ""):
+        return {"q": q}
+
+    app.add_middleware(middleware.WAFMiddleware)
+    return app
+
+
+async def measure(app: FastAPI, requests: int):
+    transport = httpx.ASGITransport(app=app, client=("198.51.100.7", 4000))
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://waf") as client:
+        for i in range(requests):
+            start = time.perf_counter()
+            await client.get("/items", params={"q": f"item {i}"}, headers={"cookie": "session=abc"})
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    settings.LOG_DIR = tempfile.mkdtemp(prefix="waf-bench-logs-")
+    settings.ENABLE_ML_DETECTION = False
+    settings.ENABLE_VERDICT_CACHE = False
+    settings.RATE_LIMIT_BURST = args.requests * 2
+    middleware.redis_client = fakeredis.aioredis.FakeRedis()
+
+    for label, enabled in (("logging off", False), ("logging on", True)):
+        p50, p99 = asyncio.run(measure(build_app(enabled), args.requests))
+        print(f"{label:<12} p50 {p50:6.3f}ms  p99 {p99:6.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
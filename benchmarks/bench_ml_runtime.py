@@ -0,0 +1,71 @@
+"""
+Startup time, peak RSS and per-request latency of WAFMLModel under the Keras
+runtime and the TensorFlow-free numpy runtime.
+
+Each runtime is measured in a fresh interpreter so imports and RSS are not
+shared. Export the artifact first (python -m src.ml_runtime ...), then:
+    python -m benchmarks.bench_ml_runtime --model models/waf_model.h5 --artifact models/waf_model.npz
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+CHILD = r"""
+import json, os, resource, statistics, sys, time
+start = time.perf_counter()
+from src.config import settings
+settings.ML_RUNTIME = sys.argv[1]
+settings.ML_MODEL_PATH = sys.argv[2]
+settings.ML_ARTIFACT_PATH = sys.argv[3]
+from src.ml_model import WAFMLModel
+model = WAFMLModel()
+request = {"method": "GET", "path": "/search", "headers": {"user-agent": "bench"},
+           "query_params": {"q": "select name from users"}, "body": ""}
+model.predict(request)  # warm-up
+startup = time.perf_counter() - start
+latencies = []
+for _ in range(int(sys.argv[4])):
+    t = time.perf_counter()
+    model.predict(request)
+    latencies.append(time.perf_counter() - t)
+latencies.sort()
+print(json.dumps({
+    "runtime": model.runtime,
+    "startup_s": startup,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "p50_ms": statistics.median(latencies) * 1000,
+    "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    "tensorflow_imported": "tensorflow" in sys.modules,
+}))
+"""
+
+
+def run(runtime: str, args) -> dict:
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3")
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, runtime, args.model, args.artifact, str(args.requests)],
+        capture_output=True, text=True, check=True, env=env
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="models/waf_model.h5")
+    parser.add_argument("--artifact", default="models/waf_model.npz")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'runtime':<8} {'startup':>9} {'peak RSS':>10} {'p50':>9} {'p95':>9}  tensorflow")
+    for runtime in ("keras", "numpy"):
+        result = run(runtime, args)
+        print(
+            f"{result['runtime']:<8} {result['startup_s']:>8.2f}s {result['rss_mb']:>8.0f}MB "
+            f"{result['p50_ms']:>7.2f}ms {result['p95_ms']:>7.2f}ms  {result['tensorflow_imported']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Requests per second of the synchronous GET/INCR/EXPIRE RateLimiter, the
+single-round-trip AsyncRateLimiter and the Redis-free SharedMemoryRateLimiter.
+
+The Redis limiters run against an in-process fakeredis by default, or a
+real server. The shared-memory limiter is also run in ``--processes``
+worker processes at once, all updating the same table, to show lock
+contention:
+    python -m benchmarks.bench_rate_limiter
+    python -m benchmarks.bench_rate_limiter --redis-url redis://localhost:6379/15 --processes 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+import redis
+import redis.asyncio as aioredis
+
+from src.config import settings
+from src.rate_limiter import RateLimiter, AsyncRateLimiter, SharedMemoryRateLimiter
+
+
+def make_clients(redis_url):
+    if redis_url:
+        return redis.Redis.from_url(redis_url), aioredis.Redis.from_url(redis_url)
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.aioredis.FakeRedis(server=server)
+
+
+def bench_sync(client, requests: int, ips: int) -> float:
+    limiter = RateLimiter(client)
+    start = time.perf_counter()
+    for i in range(requests):
+        limiter.is_rate_limited(f"10.0.{i % ips // 256}.{i % 256}")
+    return requests / (time.perf_counter() - start)
+
+
+async def bench_async(client, requests: int, ips: int, concurrency: int) -> float:
+    limiter = AsyncRateLimiter(client, rate=6000, burst=1000)
+
+    async def worker(offset: int):
+        for i in range(offset, requests, concurrency):
+            await limiter.is_rate_limited(f"10.1.{i % ips // 256}.{i % 256}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+def _run_shared(requests: int, ips: int, offset: int = 0):
+    """Returns: (start, end) on the monotonic clock, which every process shares"""
+    limiter = SharedMemoryRateLimiter(rate=6000, burst=1000)
+
+    async def run():
+        for i in range(offset, offset + requests):
+            await limiter.is_rate_limited(f"10.2.{i % ips // 256}.{i % 256}")
+
+    start = time.monotonic()
+    asyncio.run(run())
+    return start, time.monotonic()
+
+
+def bench_shared(requests: int, ips: int) -> float:
+    start, end = _run_shared(requests, ips)
+    return requests / (end - start)
+
+
+def _shared_worker(name: str, requests: int, ips: int, offset: int):
+    settings.SHARED_STATE_NAME = name
+    return _run_shared(requests, ips, offset)
+
+
+def bench_shared_processes(name: str, requests: int, ips: int, processes: int) -> float:
+    """Total requests per second of ``processes`` workers sharing one table (process startup excluded)"""
+    per_process = requests // processes
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes) as pool:
+        spans = pool.starmap(_shared_worker, [(name, per_process, ips, n * per_process) for n in range(processes)])
+    return per_process * processes / (max(end for _, end in spans) - min(start for start, _ in spans))
+
+
+def _unlink(name: str):
+    from multiprocessing import shared_memory
+    segment = shared_memory.SharedMemory(name=f"{name}-rate_limit")
+    segment.close()
+    segment.unlink()
+    os.remove(os.path.join(tempfile.gettempdir(), f"{name}-rate_limit.lock"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--ips", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    sync_client, async_client = make_clients(args.redis_url)
+    sync_rps = bench_sync(sync_client, args.requests, args.ips)
+    async_rps = asyncio.run(bench_async(async_client, args.requests, args.ips, args.concurrency))
+    print(f"RateLimiter (GET/INCR/EXPIRE) : {sync_rps:10.0f} req/s")
+    print(f"AsyncRateLimiter (Lua bucket) : {async_rps:10.0f} req/s  ({async_rps / sync_rps:.2f}x)")
+
+    # A private table, so the run neither sees nor leaves the WAF's buckets
+    settings.SHARED_STATE_NAME = name = f"bench-{os.getpid()}"
+    try:
+        shared_rps = bench_shared(args.requests, args.ips)
+        print(f"SharedMemoryRateLimiter       : {shared_rps:10.0f} req/s  ({shared_rps / async_rps:.2f}x async)")
+        total_rps = bench_shared_processes(name, args.requests, args.ips, args.processes)
+        print(f"  x {args.processes} processes, one table : {total_rps:10.0f} req/s total")
+    finally:
+        _unlink(name)
+
+
+if __name__ == "__main__":
+    main()
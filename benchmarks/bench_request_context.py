@@ -0,0 +1,146 @@
+"""
+Per-request memory and time of the request data the inspection stages
+share: the eager dict WAFMiddleware used to build with Starlette's Request
+vs the lazy RequestContext.
+
+Both sides run what the stages read from a request: the content-length
+check, the header and query values the rules scan, the verdict cache key,
+the model's input text (the "+ml" rows) and the logger's redacted headers
+and query params.
+The dict side does it the way the stages used to (dict(request.headers),
+dict(request.query_params), a sanitized copy of the headers for the log);
+the context side calls the stages' current code.
+
+  peak      bytes allocated at once while one request is processed
+  retained  bytes each request keeps alive while queued for the log writer
+  time      microseconds per request (tracing off)
+
+    python -m benchmarks.bench_request_context --requests 20000
+"""
+import argparse
+import hashlib
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from starlette.requests import Request
+
+from src.logger import RequestLogger
+from src.request_context import RequestContext, request_text
+from src.verdict_cache import VerdictCache
+
+SENSITIVE_HEADERS = ('authorization', 'cookie', 'x-api-key', 'api-key', 'password')
+
+
+def make_scope(i: int) -> Dict:
+    return {
+        "type": "http", "method": "GET", "path": f"/api/items/{i % 100}", "raw_path": b"/api/items",
+        "scheme": "http", "server": ("waf", 80), "client": ("198.51.100.7", 40000 + i % 1000), "root_path": "",
+        "query_string": f"q=item+{i}&page={i % 50}&tag=a&tag=b".encode(),
+        "headers": [
+            (b"host", b"waf"), (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0"),
+            (b"accept", b"application/json"), (b"accept-encoding", b"gzip, deflate"),
+            (b"cookie", f"session={i:032x}".encode()), (b"authorization", b"Bearer abc.def.ghi"),
+            (b"x-request-id", f"{i:016x}".encode()), (b"content-length", b"0"),
+        ],
+    }
+
+
+def eager_inspect(scope: Dict, ml: bool) -> Dict:
+    """The pre-context stages over the dict _extract_request_data built"""
+    request = Request(scope)
+    request_data = {
+        "method": request.method,
+        "path": request.url.path,
+        "headers": dict(request.headers),
+        "query_params": dict(request.query_params),
+        "body": "",
+        "client_ip": request.client.host if request.client else None,
+        "timestamp": time.time(),
+    }
+    request_data["headers"].get("content-length", "")
+    list(request_data["headers"].values())
+    list(request_data["query_params"].values())
+    hashlib.blake2b(repr((
+        request_data["method"], request_data["path"],
+        sorted(request_data["query_params"].items()), sorted(request_data["headers"].items()),
+    )).encode(), digest_size=16).digest()
+    if ml:
+        request_text(request_data)
+    return request_data
+
+
+def eager_log(request_data: Dict):
+    sanitized = request_data["headers"].copy()
+    for header in SENSITIVE_HEADERS:
+        if header in sanitized:
+            sanitized[header] = '[REDACTED]'
+    return sanitized, request_data["query_params"]
+
+
+def lazy_inspect(scope: Dict, ml: bool, cache: VerdictCache) -> RequestContext:
+    """The same stages over a RequestContext"""
+    context = RequestContext.from_scope(scope, time.time())
+    context.header("content-length")
+    [value for _, value in context.header_items]
+    [value for _, value in context.query_items]
+    cache.make_key(context, [])
+    if ml:
+        context.text
+    return context.snapshot()  # what RequestLogger queues
+
+
+def lazy_log(context: RequestContext, logger: RequestLogger):
+    return logger._sanitize_headers(context.headers), context.query_params
+
+
+def measure(inspect: Callable, log: Callable, scopes: List[Dict]) -> Dict[str, float]:
+    """Inspection, then the log writer's work on what inspection queued"""
+    start = time.perf_counter()
+    for scope in scopes:
+        log(inspect(scope))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    for scope in scopes[:1000]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        log(inspect(scope))
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    before = tracemalloc.get_traced_memory()[0]
+    # Each scope is a copy, so what a queued request keeps of it counts
+    queued = [inspect({**scope, "headers": list(scope["headers"])}) for scope in scopes[:1000]]
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        "peak_bytes": sum(peaks) / len(peaks),
+        "retained_bytes": retained / len(queued),
+        "time_us": elapsed / len(scopes) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    scopes = [make_scope(i) for i in range(args.requests)]
+    cache = VerdictCache(max_entries=1, ttl=1.0)
+    logger = RequestLogger.__new__(RequestLogger)  # only _sanitize_headers is used; no writer thread
+    results = {}
+    for ml in (False, True):
+        suffix = " +ml" if ml else ""
+        results["dict" + suffix] = measure(lambda scope: eager_inspect(scope, ml), eager_log, scopes)
+        results["context" + suffix] = measure(
+            lambda scope: lazy_inspect(scope, ml, cache), lambda context: lazy_log(context, logger), scopes
+        )
+    print(f"{'':<12} {'peak':>10} {'retained':>10} {'time':>10}")
+    for name, result in results.items():
+        print(f"{name:<12} {result['peak_bytes']:>9.0f}B {result['retained_bytes']:>9.0f}B {result['time_us']:>8.1f}us")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
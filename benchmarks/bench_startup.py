@@ -0,0 +1,115 @@
+"""
+Worker startup time and per-worker memory: every worker loading its own
+state (as uvicorn's ``workers`` option does) vs PREFORK, where the master
+loads the rules, IP index and numpy model once and forks the workers.
+
+Each mode runs in a fresh interpreter. A worker builds what WAFMiddleware
+builds from the shared state (RulesEngine, IPReputation, WAFMLModel) and runs
+the warm-up prediction, then reports ready. Startup is the time from the
+interpreter starting to the last worker being ready. Memory is read from
+/proc/<pid>/smaps_rollup (Linux): RSS counts shared pages in full, PSS splits
+them between the processes sharing them, and private is what the worker
+alone holds.
+
+Export the artifact first (python -m src.ml_runtime ...), then:
+    python -m benchmarks.bench_startup --artifact models/waf_model.npz --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+START = time.monotonic()
+
+
+def _worker(artifact, ready, release):
+    from src.config import settings
+    from src.ip_reputation import IPReputation
+    from src.ml_model import WAFMLModel
+    from src.prefork import preloaded
+    from src.rules_engine import RulesEngine
+
+    settings.ML_RUNTIME, settings.ML_ARTIFACT_PATH = "numpy", artifact
+    shared = preloaded()
+    RulesEngine(shared.rule_set)
+    IPReputation(index=shared.ip_index)
+    (shared.ml_model or WAFMLModel()).warm_up()
+    ready.put((os.getpid(), time.monotonic()))
+    release.wait()
+
+
+def _memory_kb(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def measure(mode: str, workers: int, artifact: str) -> dict:
+    """Start ``workers`` workers in this fresh interpreter and measure them"""
+    import gc
+    import multiprocessing
+    from src.config import settings
+
+    settings.ML_RUNTIME, settings.ML_ARTIFACT_PATH = "numpy", artifact
+    if mode == "prefork":
+        from src.prefork import preload
+        preload()
+        gc.freeze()
+    context = multiprocessing.get_context("fork" if mode == "prefork" else "spawn")
+
+    ready, release = context.Queue(), context.Event()
+    processes = [context.Process(target=_worker, args=(artifact, ready, release)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    reported = [ready.get(timeout=600) for _ in processes]
+    startup = max(at for _, at in reported) - START
+    memory = [_memory_kb(pid) for pid, _ in reported]
+    release.set()
+    for process in processes:
+        process.join()
+
+    return {
+        "mode": mode,
+        "startup_s": startup,
+        **{f"{name}_mb": sum(m[name] for m in memory) / len(memory) / 1024 for name in ("rss", "pss", "private")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artifact", default="models/waf_model.npz")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--measure", choices=("per_worker", "prefork"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.workers, args.artifact)))
+        return
+
+    print(f"{args.workers} workers; memory is the per-worker average")
+    print(f"{'mode':<11} {'startup':>9} {'RSS':>9} {'PSS':>9} {'private':>9}")
+    for mode in ("per_worker", "prefork"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_startup", "--measure", mode,
+             "--workers", str(args.workers), "--artifact", args.artifact],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{result['mode']:<11} {result['startup_s']:>8.2f}s {result['rss_mb']:>7.1f}MB "
+            f"{result['pss_mb']:>7.1f}MB {result['private_mb']:>7.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Request corpus for the benchmark suite.
+
+One JSON request per line, in the shape WAFMiddleware hands to the rules
+engine and the model, plus a label (1 = malicious):
+    {"method": "GET", "path": "/search", "headers": {...},
+     "query_params": {...}, "body": "...", "label": 0}
+
+Generate a reproducible corpus:
+    python -m benchmarks.corpus --output corpus.jsonl --count 5000
+"""
+import argparse
+import json
+import random
+from typing import Dict, Iterator, List
+
+BENIGN_PATHS = ["/", "/search", "/api/items", "/api/users/42", "/login", "/static/app.js", "/health"]
+BENIGN_WORDS = ["laptop", "blue shoes", "order 1234", "john.doe@example.com", "page", "sort=price", "2024-01-01"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
+    "curl/8.4.0",
+]
+ATTACKS = [
+    "<script>alert(document.cookie)</script>",
+    "javascript:alert(1)",
+    "<img src=x onerror=alert(1)>",
+    "' OR 1=1 -- ",
+    "1 UNION SELECT username, password FROM users",
+    "'; DROP TABLE users; --",
+    "../../../../etc/passwd",
+    "%252e%252e%252fetc%252fpasswd",
+    "..\\..\\Windows\\win.ini",
+]
+BODY_SIZES = [0, 0, 64, 512, 4096, 65536]
+
+
+def _body(rng: random.Random, size: int) -> str:
+    if not size:
+        return ""
+    words, length = [], 0
+    while length < size:
+        words.append(rng.choice(BENIGN_WORDS))
+        length += len(words[-1]) + 1
+    return json.dumps({"note": " ".join(words)[:size]})
+
+
+def generate(count: int, malicious_ratio: float = 0.2, seed: int = 1337) -> Iterator[Dict]:
+    """Yield a reproducible mix of benign and malicious requests"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        malicious = rng.random() < malicious_ratio
+        body_size = rng.choice(BODY_SIZES)
+        method = "POST" if body_size else "GET"
+        request = {
+            "method": method,
+            "path": rng.choice(BENIGN_PATHS),
+            "headers": {
+                "host": "shop.example.com",
+                "user-agent": rng.choice(USER_AGENTS),
+                "accept": "text/html,application/json",
+            },
+            "query_params": {"q": rng.choice(BENIGN_WORDS), "page": str(rng.randint(1, 50))},
+            "body": _body(rng, body_size),
+            "label": int(malicious),
+        }
+        if malicious:
+            attack = rng.choice(ATTACKS)
+            where = rng.choice(["query", "body", "header"])
+            if where == "query":
+                request["query_params"]["q"] = attack
+            elif where == "body":
+                request["method"] = "POST"
+                request["body"] = json.dumps({"comment": attack}) + request["body"]
+            else:
+                request["headers"]["referer"] = attack
+        yield request
+
+
+def load(path: str) -> List[Dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--malicious-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1337)
+    args = parser.parse_args()
+
+    with open(args.output, "w") as f:
+        for request in generate(args.count, args.malicious_ratio, args.seed):
+            f.write(json.dumps(request) + "\n")
+
+
+if __name__ == "__main__":
+    main()
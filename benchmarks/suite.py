@@ -0,0 +1,187 @@
+"""
+Benchmark suite for the WAF decision pipeline.
+
+Drives each stage over the same request corpus and reports throughput and
+p50/p95/p99 latency per stage:
+  rules       RulesEngine.analyze_request
+  ml          WAFMLModel.predict
+  rate_limit  the configured rate limiter against an in-process fakeredis
+  middleware  the full WAFMiddleware through an in-process ASGI client
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json --threshold 0.15
+
+With --baseline, any stage whose p95 rose or whose throughput fell by more
+than the threshold is reported and the run exits with status 1.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from benchmarks import corpus as corpus_module
+
+STAGES = ("rules", "ml", "rate_limit", "middleware")
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Throughput and nearest-rank percentiles of per-request latencies (seconds)"""
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[max(0, int(round(p / 100 * len(ordered))) - 1)] * 1000
+
+    return {
+        "requests": len(ordered),
+        "throughput_rps": len(ordered) / sum(ordered) if sum(ordered) else 0.0,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+    }
+
+
+def time_sync(call: Callable, requests: List[Dict]) -> List[float]:
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        call(request)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def time_async(call: Callable, requests: List[Dict]) -> List[float]:
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        await call(request)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_rules(requests: List[Dict]) -> List[float]:
+    from src.rules_engine import RulesEngine
+    engine = RulesEngine()
+    return time_sync(engine.analyze_request, requests)
+
+
+def bench_ml(requests: List[Dict]) -> List[float]:
+    from src.ml_model import WAFMLModel
+    model = WAFMLModel()
+    model.predict(requests[0])  # warm-up
+    return time_sync(model.predict, requests)
+
+
+def bench_rate_limit(requests: List[Dict]) -> List[float]:
+    import fakeredis
+    from src.rate_limiter import create_rate_limiter
+
+    async def run():
+        limiter = create_rate_limiter(fakeredis.aioredis.FakeRedis())
+        ips = [f"203.0.113.{i % 250}" for i in range(len(requests))]
+        return await time_async(limiter.is_rate_limited, ips)
+
+    return asyncio.run(run())
+
+
+def bench_middleware(requests: List[Dict]) -> List[float]:
+    import fakeredis
+    import httpx
+    from fastapi import FastAPI, Request
+    from src import middleware
+
+    middleware.redis_client = fakeredis.aioredis.FakeRedis()
+    app = FastAPI()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+    async def echo(request: Request):
+        return {"received": len(await request.body())}
+
+    app.add_middleware(middleware.WAFMiddleware)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app, client=("198.51.100.10", 5000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://waf") as client:
+            async def send(request: Dict):
+                await client.request(
+                    request["method"], request["path"], params=request["query_params"],
+                    headers=request["headers"], content=request["body"].encode() or None
+                )
+            return await time_async(send, requests)
+
+    return asyncio.run(run())
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """List stages that regressed by more than the threshold against the baseline"""
+    regressions = []
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{stage}: p95 {previous['p95_ms']:.3f}ms -> {current['p95_ms']:.3f}ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{stage}: throughput {previous['throughput_rps']:.0f} -> {current['throughput_rps']:.0f} req/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL corpus (default: generated with benchmarks.corpus)")
+    parser.add_argument("--count", type=int, default=2000, help="Requests to generate when no corpus is given")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--ml-requests", type=int, default=200, help="Cap on requests sent to the ML stage")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    from src.config import settings
+    settings.LOG_DIR = tempfile.mkdtemp(prefix="waf-bench-logs-")
+    settings.RATE_LIMIT_BURST = 10 ** 9  # measure the limiter's cost, not its verdicts
+    settings.ENABLE_VERDICT_CACHE = False  # every request pays for the full pipeline
+
+    requests = corpus_module.load(args.corpus) if args.corpus else list(corpus_module.generate(args.count))
+    stages = [stage for stage in args.stages.split(",") if stage]
+    runners = {
+        "rules": bench_rules,
+        "ml": lambda reqs: bench_ml(reqs[:args.ml_requests]),
+        "rate_limit": bench_rate_limit,
+        "middleware": bench_middleware,
+    }
+
+    results = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "corpus_size": len(requests),
+        "stages": {},
+    }
+    for stage in stages:
+        summary = summarize(runners[stage](requests))
+        results["stages"][stage] = summary
+        print(
+            f"{stage:<11} {summary['requests']:>6} req  {summary['throughput_rps']:>9.0f} req/s  "
+            f"p50 {summary['p50_ms']:8.3f}ms  p95 {summary['p95_ms']:8.3f}ms  p99 {summary['p99_ms']:8.3f}ms"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
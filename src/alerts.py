@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Dict, Optional, Set, Tuple
+import httpx
+from .config import settings
+from .metrics import ALERTS_AGGREGATED, ALERTS_DROPPED, ALERTS_SENT
+
+logger = logging.getLogger(__name__)
+
+
+class _AlertGroup:
+    __slots__ = ("message", "repeats", "started")
+
+    def __init__(self, message: str, started: float):
+        self.message = message
+        self.repeats = 0
+        self.started = started
+
+
+class AlertDispatcher:
+    """
+    Background Slack alerting off the request path.
+
+    ``notify`` only enqueues onto a bounded queue and never waits. A
+    background task sends the first alert for an (IP, reason) key right
+    away, counts repeats of that key for ``window`` seconds and then sends
+    one summary. Each message is posted from its own task, at most
+    ``max_in_flight`` at a time and each within ``timeout`` seconds, so a
+    slow webhook never holds up the alerts behind it. Outbound messages are
+    capped at ``max_per_minute``; alerts over the cap, over the in-flight
+    limit or arriving to a full queue are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        webhook_url: Optional[str] = None,
+        queue_size: int = None,
+        window: float = None,
+        max_per_minute: int = None,
+        max_in_flight: int = None,
+        timeout: float = None,
+        client: Optional[httpx.AsyncClient] = None
+    ):
+        self.webhook_url = webhook_url if webhook_url is not None else settings.SLACK_WEBHOOK_URL
+        self.queue_size = queue_size or settings.ALERT_QUEUE_SIZE
+        self.window = window if window is not None else settings.ALERT_AGGREGATION_WINDOW
+        self.max_per_minute = max_per_minute or settings.ALERT_MAX_PER_MINUTE
+        self.max_in_flight = max_in_flight or settings.ALERT_MAX_IN_FLIGHT
+        self.timeout = timeout if timeout is not None else settings.ALERT_TIMEOUT
+        self._client = client
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._groups: Dict[Tuple[str, str], _AlertGroup] = {}
+        self._tokens = float(self.max_per_minute)
+        self._refilled = time.monotonic()
+
+    def notify(self, client_ip: str, reason: str, message: str):
+        """Queue an alert without blocking the caller"""
+        if not self.webhook_url:
+            return
+
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = asyncio.ensure_future(self._run())
+
+        try:
+            self._queue.put_nowait(((client_ip, reason), message))
+        except asyncio.QueueFull:
+            ALERTS_DROPPED.labels(reason="queue_full").inc()
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.max_per_minute, self._tokens + (now - self._refilled) * self.max_per_minute / 60)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _post(self, text: str):
+        """Start sending ``text`` unless the rate cap or the in-flight limit says no"""
+        if not self._take_token():
+            ALERTS_DROPPED.labels(reason="rate_limited").inc()
+            return
+        if len(self._in_flight) >= self.max_in_flight:
+            ALERTS_DROPPED.labels(reason="in_flight").inc()
+            return
+
+        task = asyncio.ensure_future(self._send(text))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, text: str):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+            )
+        try:
+            response = await asyncio.wait_for(self._client.post(self.webhook_url, json={"text": text}), self.timeout)
+            response.raise_for_status()
+            ALERTS_SENT.inc()
+        except asyncio.TimeoutError:
+            ALERTS_DROPPED.labels(reason="timeout").inc()
+            logger.error(f"Alert webhook did not answer within {self.timeout:g}s")
+        except httpx.HTTPError as e:
+            ALERTS_DROPPED.labels(reason="send_failed").inc()
+            logger.error(f"Error sending alert: {str(e)}")
+
+    def _flush_expired(self, now: float):
+        """Send a summary for every group whose window has closed"""
+        for key in [key for key, group in self._groups.items() if group.started + self.window <= now]:
+            group = self._groups.pop(key)
+            if group.repeats:
+                self._post(f"{group.message} (repeated {group.repeats} more times in {self.window:g}s)")
+
+    async def _run(self):
+        while True:
+            timeout = None
+            if self._groups:
+                oldest = min(group.started for group in self._groups.values())
+                timeout = max(0.0, oldest + self.window - time.monotonic())
+            try:
+                key, message = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                key = None
+
+            now = time.monotonic()
+            self._flush_expired(now)
+            if key is not None:
+                self._add(key, message, now)
+
+    def _add(self, key: Tuple[str, str], message: str, now: float):
+        """Send the first alert of a key, or count it towards the key's summary"""
+        group = self._groups.get(key)
+        if group is not None:
+            group.repeats += 1
+            ALERTS_AGGREGATED.inc()
+        else:
+            self._groups[key] = _AlertGroup(message, now)
+            self._post(message)
+
+    async def close(self):
+        """
+        Stop the background task, handle the alerts still queued, flush
+        every pending summary and wait for the posts in flight
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+            now = time.monotonic()
+            while not self._queue.empty():
+                key, message = self._queue.get_nowait()
+                self._add(key, message, now)
+            self._flush_expired(float("inf"))
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,93 @@
+import codecs
+from typing import List, Optional, Set, Tuple
+from .config import settings
+from .rules_engine import RulesEngine, RuleMatch, FIELD_FAMILIES
+
+
+class BodyInspector:
+    """
+    Inspect a request body incrementally as ``receive()`` delivers it.
+
+    The last ``window_size`` characters of each scanned chunk are carried over
+    and scanned again with the next one, so a match that straddles a chunk
+    boundary is still caught as long as it fits in the window. Only the
+    window and a prefix of the same size are kept, never the whole body.
+    Only ``families`` are scanned; with none, the body is only measured and
+    its prefix kept. Bytes that are not valid UTF-8 decode to U+FFFD, so a
+    body in another encoding is still inspected rather than skipped.
+    ``feed_async`` hands the windows of a large body to a BodyScanPool so
+    they are scanned off the event loop. A body is large once its declared
+    ``expected_size`` (Content-Length) or the bytes received so far reach
+    BODY_OFFLOAD_THRESHOLD; receive() delivers a body in chunks far smaller
+    than that, so the size of one window says little about the body's.
+    """
+
+    def __init__(self, rules_engine: RulesEngine, max_size: int, window_size: int,
+                 families: Tuple[str, ...] = FIELD_FAMILIES, scan_pool=None, expected_size: int = 0):
+        self.rules_engine = rules_engine
+        self.families = families
+        self.scan_pool = scan_pool
+        self.max_size = max_size
+        self.window_size = window_size
+        self.expected_size = expected_size
+        self.size = 0
+        self.matches: List[RuleMatch] = []
+        self.prefix = ""  # start of the decoded body, handed to ML and the logger
+        self._tail = ""
+        self._reported: Set[str] = set()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @property
+    def too_large(self) -> bool:
+        return self.size > self.max_size
+
+    @property
+    def offloaded(self) -> bool:
+        """Whether windows are scanned in the scan pool"""
+        return (
+            self.scan_pool is not None
+            and max(self.expected_size, self.size) >= settings.BODY_OFFLOAD_THRESHOLD
+        )
+
+    def _accept(self, chunk: bytes, final: bool) -> Optional[str]:
+        """Take in the next chunk and return the window to scan, if any"""
+        self.size += len(chunk)
+        if self.too_large:
+            return None
+
+        text = self._decoder.decode(chunk, final)
+
+        if len(self.prefix) < self.window_size:
+            self.prefix += text[:self.window_size - len(self.prefix)]
+        if not self.families:
+            return None
+
+        window = self._tail + text
+        self._tail = window[-self.window_size:] if self.window_size else ""
+        return window
+
+    def _record(self, found: List[RuleMatch]) -> List[RuleMatch]:
+        added = []
+        for match in found:
+            # A pattern is reported once per body, like a single findall() over it
+            if match.pattern not in self._reported:
+                self._reported.add(match.pattern)
+                added.append(match)
+        self.matches.extend(added)
+        return added
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[RuleMatch]:
+        """Inspect the next body chunk and return the matches it added"""
+        window = self._accept(chunk, final)
+        if window is None:
+            return []
+        return self._record(self.rules_engine.scan_body(window, self.families))
+
+    async def feed_async(self, chunk: bytes, final: bool = False) -> List[RuleMatch]:
+        """``feed``, but the windows of a large body are scanned in the scan pool"""
+        window = self._accept(chunk, final)
+        if window is None:
+            return []
+        if self.offloaded:
+            return self._record(await self.scan_pool.scan(window, self.families))
+        return self._record(self.rules_engine.scan_body(window, self.families))
@@ -13,19 +13,66 @@ class WAFSettings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     WORKERS: int = os.cpu_count() or 4  # Dynamically set workers based on CPU
+    PREFORK: bool = False  # load rules, IP index and numpy model once, then fork WORKERS that share them copy-on-write
     
     # Security Settings
     MAX_REQUEST_SIZE: int = 10 * 1024 * 1024  # 10MB
+    BODY_BUFFER_SIZE: int = 64 * 1024  # body bytes held back before the app sees the request
+    BODY_INSPECTION_WINDOW: int = 4096  # overlap kept between streamed body chunks
+    BODY_SCAN_POOL_WORKERS: int = 0  # processes scanning large body windows off the event loop; 0 scans inline
+    BODY_OFFLOAD_THRESHOLD: int = 256 * 1024  # bodies this large (declared Content-Length or bytes received) are scanned in the pool
+    BODY_SCAN_POOL_TIMEOUT: float = 2.0  # seconds
+    BODY_SCAN_POOL_FAIL_OPEN: bool = False  # on timeout or pool failure: allow (True) or block (False)
     RATE_LIMIT: int = 100  # requests per minute
     RATE_LIMIT_BURST: int = 20
+    RATE_LIMIT_MODE: str = "redis"  # "redis" (token bucket per request), "hybrid" (local + periodic sync) or "shared_memory" (one host, no Redis)
+    RATE_LIMIT_WINDOW: int = 60  # hybrid mode sliding window, seconds
+    RATE_LIMIT_SYNC_INTERVAL_MS: int = 200
+    RATE_LIMIT_MAX_UNSYNCED: int = 10  # per IP and worker; bounds cluster overshoot
+    RATE_LIMIT_SHARDS: int = 16
+    RATE_LIMIT_SYNC_BATCH: int = 500  # IPs per Redis pipeline in a hybrid sync round
+    RATE_LIMIT_CLASSES: Dict[str, Dict] = {}  # name -> {"rate": per minute, "burst": ...}, used by ROUTE_POLICIES
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50
     
     # ML Model Settings
     ML_MODEL_PATH: str = "models/waf_model.h5"
+    ML_RUNTIME: str = "keras"  # "keras" or "numpy" (serves ML_ARTIFACT_PATH without TensorFlow)
+    ML_ARTIFACT_PATH: str = "models/waf_model.npz"
     ENABLE_ML_DETECTION: bool = True
     PREDICTION_THRESHOLD: float = 0.85
+    ML_BATCH_MAX_SIZE: int = 32
+    ML_BATCH_MAX_WAIT_MS: float = 5.0
+    ML_MODE: str = "inline"  # "inline" (block before the app), "async" (score afterwards, deny the IP) or "shadow" (score afterwards, only record)
+    ML_DEFERRED_QUEUE_SIZE: int = 1024  # async/shadow: requests waiting to be scored; more are dropped unscored
+    ML_DENY_TTL: float = 300.0  # async: seconds a client stays denied after a malicious score
+    ML_DENY_MAX_ENTRIES: int = 100000
+    ML_DENY_BACKEND: str = "local"  # or "shared_memory": entries seen by every worker on the host
+    ML_TRAINING_CACHE_DIR: str = "data/training_cache"  # featurized shards, reused by later epochs and runs
+    ML_TRAINING_WORKERS: int = 0  # preprocessing processes; 0 uses every CPU
+    ML_TRAINING_SHARD_SIZE: int = 4096  # log lines per shard
+    ML_TRAINING_SHUFFLE_BUFFER: int = 16384  # rows
 
-    BLOCK_SUSPICIOUS_IPS: bool = True
-    BLOCK_TOR_IPS: bool = True
+    # Verdict cache
+    ENABLE_VERDICT_CACHE: bool = True
+    VERDICT_CACHE_SIZE: int = 10000
+    VERDICT_CACHE_TTL: int = 60  # seconds
+    VERDICT_CACHE_BACKEND: str = "local"  # or "shared_memory": one cache for every worker on the host
+
+    # Shared-memory state: fixed-size tables in named segments, one per kind of state
+    SHARED_STATE_NAME: str = "amnii-waf"  # segment name prefix
+    SHARED_STATE_SLOTS: int = 65536  # entries per table
+    SHARED_STATE_STRIPES: int = 64  # lock stripes per table
+
+    BLOCK_SUSPICIOUS_IPS: bool = True  # deny lists with category "suspicious"
+    BLOCK_TOR_IPS: bool = True  # deny lists with category "tor"
+
+    # IP reputation feeds: name -> {"path": ..., "action": "allow" | "deny" | "score", "score": int, "category": ...}
+    # Feed files hold one address or CIDR range per line and are compiled into IP_INDEX_PATH
+    IP_FEEDS: Dict[str, Dict] = {}
+    IP_INDEX_PATH: str = "data/ip_index.bin"
+    IP_FEED_RELOAD_INTERVAL: float = 60.0  # seconds between checks for changed feed files
+    IP_SCORE_BLOCK_THRESHOLD: int = 0  # block when the summed list scores reach this; 0 disables
     ENABLE_XSS_PROTECTION: bool = True
     ENABLE_SQL_INJECTION_PROTECTION: bool = True
     ENABLE_PATH_TRAVERSAL_PROTECTION: bool = True
@@ -33,14 +80,31 @@ class WAFSettings(BaseSettings):
     # Allowed HTTP Methods
     ALLOWED_HTTP_METHODS: List[str] = ["GET", "POST", "PUT", "DELETE", "PATCH"]
     
-    # Custom Rules with enhanced regex
+    # Request normalization (fields are decoded to a canonical form before the rules run)
+    NORMALIZE_MAX_DECODE_ROUNDS: int = 3
+    NORMALIZE_CACHE_SIZE: int = 4096
+    NORMALIZE_MEMO_MAX_LENGTH: int = 2048  # longer values are normalized but not memoized
+
+    # Rule evaluation
+    RULES_EVALUATION_MODE: str = "short_circuit"  # or "full": scan every field even once the verdict is decided (forensics)
+    RULES_BLOCK_POLICY: str = "severity"  # or "anomaly_score": block once the summed severity scores reach the threshold
+    RULE_SEVERITY_SCORES: Dict[str, int] = {"CRITICAL": 5, "HIGH": 4, "MEDIUM": 3, "LOW": 2}
+    RULES_ANOMALY_THRESHOLD: int = 5
+
+    # External rules (JSON file or directory of *.json in the CUSTOM_RULES format); replaces CUSTOM_RULES when set
+    RULES_PATH: Optional[str] = None
+    RULES_RELOAD_INTERVAL: float = 2.0  # seconds between checks for changed rule files
+    RULES_REGEX_TIME_BUDGET_MS: float = 1000.0  # CPU time per pattern over all adversarial probes, also as extrapolated to a body window
+    RULES_REGEX_PROBE_LENGTH: int = 2048  # probes run at this length and twice it
+
+    # Custom Rules with enhanced regex, matched against normalized field values
     CUSTOM_RULES: Dict[str, Dict] = {
         "xss_patterns": {
             "enabled": True,
             "patterns": [
-                r"(?i)<script.*?>.*?</script.*?>",  # Case-insensitive XSS detection
+                r"(?i)<script\b[^>]{0,256}>",  # An opening script tag; no scan to its closing tag, which is quadratic
                 r"(?i)javascript\s*:",
-                r"(?i)on\w+\s*=",
+                r"(?i)on\w{1,32}\s*=",  # Event handler attributes; \w+ would rescan "onon..." to its end from every "on"
                 r"(?i)eval\s*\(",
             ]
         },
@@ -53,25 +117,36 @@ class WAFSettings(BaseSettings):
                 r"(?i)UPDATE\s+\w+\s+SET",
                 r"(?i)--\s",
                 r"(?i)OR\s+\d+=\d+",
-                r"(?i)'.*?OR.*?=.*?'",
+                r"(?i)'\s*OR\b[^=]{0,64}=",  # ' OR 1=1, ' or 'a'='a; bounded, so linear in the field length
             ]
         },
         "path_traversal_patterns": {
             "enabled": True,
             "patterns": [
-                r"\.\./",  # Classic traversal
+                r"\.\./",  # Classic traversal (encoded variants are decoded by the normalizer)
                 r"\.\.\\",
-                r"%2e%2e%2f",  # Encoded traversal
-                r"%252e%252e%252f",
                 r"(?i)/etc/passwd",  # Targeting UNIX paths
                 r"(?i)C:\\Windows",  # Targeting Windows paths
             ]
         }
     }
 
+    # Load shedding: under overload, skip or downgrade pipeline stages instead of queueing requests
+    ENABLE_LOAD_SHEDDING: bool = False
+    WAF_TIME_BUDGET_MS: float = 50.0  # WAF time per request, body upload excluded; 0: no budget
+    LOAD_SHED_LAG_THRESHOLD_MS: float = 100.0  # event-loop lag shedding the first stage of LOAD_SHED_ORDER, twice it the first two...; 0: ignore lag
+    LOAD_SHED_LAG_INTERVAL_MS: float = 50.0  # how often the event-loop lag is sampled
+    LOAD_SHED_ORDER: List[str] = ["ml", "rules", "body_scan", "rate_limit"]  # first shed first; stages not listed always run
+    LOAD_SHED_FAIL_OPEN: Dict[str, bool] = {"ml": True, "rules": False, "body_scan": False, "rate_limit": True}  # shed stage: let the request through (ML scored in the background if only the budget was short) or answer 503
+
     # Whitelist Configurations
-    IP_WHITELIST: List[str] = ["127.0.0.1"]
-    PATH_WHITELIST: List[str] = ["/health", "/metrics"]
+    IP_WHITELIST: List[str] = ["127.0.0.1"]  # addresses or CIDR ranges
+    PATH_WHITELIST: List[str] = ["/health", "/metrics"]  # routes skipped entirely
+
+    # Route policies: pattern -> {"skip", "rule_families", "ml", "max_body_size", "rate_limit_class"}
+    # Patterns take literal segments, "*" for one segment, globs like "*.js" and a trailing "**"
+    ROUTE_POLICIES: Dict[str, Dict] = {}
+    ROUTE_CACHE_SIZE: int = 4096
 
     # Logging Configuration
     LOG_LEVEL: str = "INFO"
@@ -79,12 +154,24 @@ class WAFSettings(BaseSettings):
     ENABLE_ACCESS_LOG: bool = True
     ENABLE_ERROR_LOG: bool = True
     LOG_DIR: str = os.getenv("LOG_DIR", "logs")  # Allow log dir to be set dynamically
+    LOG_QUEUE_SIZE: int = 10000  # records waiting for the writer thread before new ones are dropped
+    LOG_BATCH_SIZE: int = 256
+    ACCESS_LOG_SAMPLE_RATE: float = 1.0  # fraction of allowed requests logged; blocked ones always are
     
     # Database Settings (Use SecretStr to prevent accidental logging)
     DB_URL: SecretStr = SecretStr("mysql+pymysql://root:@localhost:3306/waf_db")
 
+    # Alerting
+    SLACK_WEBHOOK_URL: Optional[str] = None
+    ALERT_QUEUE_SIZE: int = 1000
+    ALERT_AGGREGATION_WINDOW: float = 60.0  # seconds to fold repeats per IP and reason
+    ALERT_MAX_PER_MINUTE: int = 30
+    ALERT_TIMEOUT: float = 2.0  # seconds one webhook post may take in total
+    ALERT_MAX_IN_FLIGHT: int = 4  # concurrent webhook posts; alerts beyond are dropped
+
     # Monitoring Settings
     ENABLE_PROMETHEUS: bool = True
+    RULE_TIMING_SAMPLE_RATE: float = 0.01  # fraction of rule scans timed per pattern
     ENABLE_APM: bool = True
     APM_SERVER_URL: Optional[str] = None
 
@@ -98,7 +185,3 @@ class WAFSettings(BaseSettings):
 
 # Initialize settings
 settings = WAFSettings()
-
-# Example of using the settings
-print(f"Application Name: {settings.APP_NAME}")
-print(f"Database URL: {settings.get_db_url()}")
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from .config import settings
+from .inference import BatchInferenceQueue
+from .metrics import ML_DEFERRED_DROPPED, ML_DEFERRED_LAG, ML_DENY_ENTRIES, ML_VERDICTS
+from .shared_state import SharedTable, shared_table
+
+logger = logging.getLogger(__name__)
+
+
+class MLDenyList:
+    """
+    Short-lived per-IP deny entries set by deferred ML scores.
+
+    A lookup is one dict access, cheap enough to run before anything else
+    on every request. Entries expire ``ttl`` seconds after they were last
+    set; past ``max_entries`` the oldest are dropped first.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_denied(self, client_ip: Optional[str]) -> bool:
+        expires = self._entries.get(client_ip)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._entries[client_ip]
+            ML_DENY_ENTRIES.set(len(self._entries))
+            return False
+        return True
+
+    def add(self, client_ip: Optional[str]):
+        if client_ip is None:
+            return
+        self._entries[client_ip] = time.monotonic() + self.ttl
+        self._entries.move_to_end(client_ip)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        ML_DENY_ENTRIES.set(len(self._entries))
+
+
+class SharedDenyList:
+    """
+    MLDenyList kept in a shared-memory table, so a client denied by one
+    worker is denied by every worker on the host. Bounded by the table's
+    size rather than ``max_entries``.
+    """
+
+    def __init__(self, ttl: float, table: SharedTable = None):
+        self.ttl = ttl
+        self.table = table or shared_table("ml_deny", 1)
+
+    def is_denied(self, client_ip: Optional[str]) -> bool:
+        return client_ip is not None and self.table.get(client_ip.encode()) is not None
+
+    def add(self, client_ip: Optional[str]):
+        if client_ip is not None:
+            self.table.put(client_ip.encode(), b"\1", self.ttl)
+
+
+def create_deny_list():
+    """Build the deny list selected by ML_DENY_BACKEND"""
+    if settings.ML_DENY_BACKEND == "shared_memory":
+        return SharedDenyList(settings.ML_DENY_TTL)
+    return MLDenyList(settings.ML_DENY_TTL, settings.ML_DENY_MAX_ENTRIES)
+
+
+class DeferredScorer:
+    """
+    ML scoring after the request was let through.
+
+    ``submit`` only enqueues onto a bounded queue and never waits; requests
+    arriving to a full queue are dropped and counted. A background task
+    hands everything queued to the BatchInferenceQueue at once, so deferred
+    requests share its batched forward passes.
+
+    In "async" mode a score over ``threshold`` calls ``on_block`` with the
+    request and its confidence, which the middleware uses to deny the
+    client for a while. In "shadow" mode scores are only counted and
+    logged, for comparing detections and latency against inline mode on
+    the same traffic.
+    """
+
+    def __init__(self, inference_queue: BatchInferenceQueue, mode: str, threshold: float,
+                 on_block: Callable[[Dict, float], None], queue_size: int = None):
+        if mode not in ("async", "shadow"):
+            raise ValueError(f"Unknown deferred ML mode: {mode}")
+        self.inference_queue = inference_queue
+        self.mode = mode
+        self.threshold = threshold
+        self.on_block = on_block
+        self.queue_size = queue_size or settings.ML_DEFERRED_QUEUE_SIZE
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def submit(self, request_data: Dict):
+        """Queue a request for scoring without blocking the caller"""
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = asyncio.ensure_future(self._run())
+
+        try:
+            self._queue.put_nowait((request_data, time.perf_counter()))
+        except asyncio.QueueFull:
+            ML_DEFERRED_DROPPED.inc()
+
+    def _drain(self, first: Tuple[Dict, float]) -> List[Tuple[Dict, float]]:
+        batch = [first]
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _score(self, request_data: Dict, submitted: float):
+        is_malicious, confidence = await self.inference_queue.predict(request_data)
+        ML_DEFERRED_LAG.labels(self.mode).observe(time.perf_counter() - submitted)
+        if not (is_malicious and confidence >= self.threshold):
+            ML_VERDICTS.labels(self.mode, "allow").inc()
+            return
+
+        ML_VERDICTS.labels(self.mode, "block").inc()
+        if self.mode == "shadow":
+            logger.info(
+                f"ML shadow verdict: would block {request_data['method']} {request_data['path']} "
+                f"from {request_data['client_ip']} (Confidence: {confidence:.2%})"
+            )
+        else:
+            self.on_block(request_data, confidence)
+
+    async def _run(self):
+        while True:
+            batch = self._drain(await self._queue.get())
+            results = await asyncio.gather(*(self._score(*item) for item in batch), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"⚠️ Error in deferred ML scoring: {str(result)}")
+
+    async def close(self):
+        """Stop the background task; queued requests are not scored"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
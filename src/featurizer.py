@@ -0,0 +1,171 @@
+import functools
+import json
+import operator
+from typing import Dict, List, Sequence
+import numpy as np
+from .request_context import RequestContext, request_text
+
+_FNV_OFFSET = np.uint32(2166136261)
+_FNV_PRIME = np.uint32(16777619)
+# Odd multiplier for the token prefix hashes, and its inverse mod 2**32
+_TOKEN_BASE = 0x01000193
+_TOKEN_BASE_INVERSE = pow(_TOKEN_BASE, -1, 2 ** 32)
+_TOKEN_SALT = np.uint64(0x9E3779B97F4A7C15)
+_BIGRAM_SALT = np.uint64(0xC2B2AE3D27D4EB4F)
+
+_LOWER = np.arange(256, dtype=np.uint8)
+_LOWER[ord("A"):ord("Z") + 1] += 32
+# Token bytes: ASCII letters, digits, "_" and every non-ASCII byte (UTF-8 letters)
+_WORD = np.zeros(256, dtype=bool)
+for _chars in (b"abcdefghijklmnopqrstuvwxyz", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", b"0123456789_"):
+    _WORD[np.frombuffer(_chars, dtype=np.uint8)] = True
+_WORD[128:] = True
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, so similar tokens land in unrelated buckets"""
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+class HashingFeaturizer:
+    """
+    Stateless request featurizer over hashed character and token n-grams.
+
+    Every request becomes one fixed-length row of int32 bucket ids in
+    ``[1, num_buckets)``, 0 being padding, so it feeds the model's Embedding
+    layer directly. The first ``max_length - 2 * token_slots`` positions hold
+    the character n-grams of the lowercased text, in order. The remaining
+    ``2 * token_slots`` hold the first ``token_slots`` word tokens found in
+    the first ``text_window`` bytes, each followed by the bigram it forms
+    with the next token.
+
+    There is no vocabulary: ids depend only on the text and the settings
+    below, so training and serving agree by construction and nothing is
+    learned from live traffic. A batch is featurized with array operations;
+    no Python code runs per request or per character.
+    """
+
+    def __init__(self, num_buckets: int = 10000, max_length: int = 1000, char_ngram: int = 3,
+                 token_slots: int = 128, text_window: int = 4096):
+        if 2 * token_slots >= max_length:
+            raise ValueError("token_slots must leave room for character n-grams")
+        self.num_buckets = num_buckets
+        self.max_length = max_length
+        self.char_ngram = char_ngram
+        self.token_slots = token_slots
+        self.char_slots = max_length - 2 * token_slots
+        self.text_window = max(text_window, self.char_slots + char_ngram)
+        # Featurizers with the same key produce the same rows, so they share cached ones
+        self.key = (num_buckets, max_length, char_ngram, token_slots, self.text_window)
+
+        powers = np.full(self.text_window, _TOKEN_BASE, dtype=np.uint32)
+        powers[0] = 1
+        self._powers = np.multiply.accumulate(powers, dtype=np.uint32)
+        inverse = np.full(self.text_window, _TOKEN_BASE_INVERSE, dtype=np.uint32)
+        inverse[0] = 1
+        self._inverse_powers = np.multiply.accumulate(inverse, dtype=np.uint32)
+
+    @property
+    def config(self) -> Dict:
+        return {
+            "num_buckets": self.num_buckets,
+            "max_length": self.max_length,
+            "char_ngram": self.char_ngram,
+            "token_slots": self.token_slots,
+            "text_window": self.text_window,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.config, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, json_string: str) -> "HashingFeaturizer":
+        return cls(**json.loads(json_string))
+
+    def _bucket(self, h: np.ndarray) -> np.ndarray:
+        return (h % (self.num_buckets - 1) + 1).astype(np.int32)
+
+    def _bytes(self, texts: Sequence[str]):
+        """Lowercased UTF-8 of each text in a zero-padded matrix: (bytes, lengths)"""
+        window = self.text_window
+        # map() keeps the per-text slicing, encoding and padding in C
+        encode = functools.partial(str.encode, encoding="utf-8", errors="replace")
+        head = operator.itemgetter(slice(0, window))
+        encoded = list(map(head, map(encode, map(head, texts))))
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        # Only as wide as the longest text needs, plus a zero column so every token ends inside
+        width = max(int(lengths.max()), self.char_slots + self.char_ngram - 1) + 1
+        padded = b"".join(map(operator.methodcaller("ljust", width, b"\0"), encoded))
+        data = _LOWER[np.frombuffer(padded, dtype=np.uint8).reshape(len(encoded), width)]
+        return data, lengths
+
+    def _char_ngrams(self, data: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        n, width = self.char_ngram, self.char_slots
+        h = np.full((len(data), width), _FNV_OFFSET, dtype=np.uint32)
+        for k in range(n):
+            h = (h ^ data[:, k:k + width]) * _FNV_PRIME
+        ids = self._bucket(_mix(h.astype(np.uint64)))
+        ids[np.arange(width) > (lengths - n)[:, None]] = 0
+        return ids
+
+    def _tokens(self, data: np.ndarray) -> np.ndarray:
+        batch, width = data.shape[0], data.shape[1] - 1
+        word = _WORD[data]
+        starts = word[:, :width] & ~np.pad(word[:, :width - 1], ((0, 0), (1, 0)))
+        ends = word[:, :width] & ~word[:, 1:]
+
+        # Hash of a token [s, e]: (prefix[e + 1] - prefix[s]) / base**s, all mod 2**32
+        prefix = np.zeros((batch, width + 1), dtype=np.uint32)
+        np.cumsum(data[:, :width] * self._powers[:width], axis=1, dtype=np.uint32, out=prefix[:, 1:])
+        positions = np.arange(width, dtype=np.int32)
+        token_start = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+
+        rank = np.cumsum(ends, axis=1, dtype=np.int32) - 1
+        rows, cols = np.nonzero(ends & (rank < self.token_slots))
+        begin = token_start[rows, cols]
+        hashes = (prefix[rows, cols + 1] - prefix[rows, begin]) * self._inverse_powers[begin]
+        hashes = hashes.astype(np.uint64)
+
+        unigrams = np.zeros((batch, self.token_slots), dtype=np.uint64)
+        present = np.zeros((batch, self.token_slots), dtype=bool)
+        unigrams[rows, rank[rows, cols]] = _mix(hashes ^ _TOKEN_SALT)
+        present[rows, rank[rows, cols]] = True
+
+        bigrams = _mix(unigrams[:, :-1] * np.uint64(31) ^ unigrams[:, 1:] ^ _BIGRAM_SALT)
+        ids = np.zeros((batch, self.token_slots, 2), dtype=np.int32)
+        ids[:, :, 0] = np.where(present, self._bucket(unigrams), 0)
+        ids[:, :-1, 1] = np.where(present[:, 1:], self._bucket(bigrams), 0)
+        return ids.reshape(batch, 2 * self.token_slots)
+
+    def transform(self, texts: Sequence[str]) -> np.ndarray:
+        """Featurize texts. Returns: int32 array of shape (len(texts), max_length)"""
+        if not len(texts):
+            return np.zeros((0, self.max_length), dtype=np.int32)
+        data, lengths = self._bytes(texts)
+        return np.concatenate([self._char_ngrams(data, lengths), self._tokens(data)], axis=1)
+
+    def transform_requests(self, requests: List[Dict]) -> np.ndarray:
+        """
+        Featurize request dicts or RequestContexts. A context keeps its row,
+        so it is featurized once however many models score it.
+        """
+        rows = [
+            request.cached_features(self.key) if isinstance(request, RequestContext) else None
+            for request in requests
+        ]
+        pending = [index for index, row in enumerate(rows) if row is None]
+        if len(pending) == len(requests):
+            features = self.transform(list(map(request_text, requests)))
+        else:
+            features = np.zeros((len(requests), self.max_length), dtype=np.int32)
+            for index, row in enumerate(rows):
+                if row is not None:
+                    features[index] = row
+            if pending:
+                features[pending] = self.transform([request_text(requests[index]) for index in pending])
+        for index in pending:
+            if isinstance(requests[index], RequestContext):
+                requests[index].cache_features(self.key, features[index].copy())
+        return features
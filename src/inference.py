@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .ml_model import WAFMLModel
+from .metrics import ML_BATCH_SIZE, ML_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class BatchInferenceQueue:
+    """
+    Micro-batching front end for WAFMLModel.
+
+    Concurrent ``predict`` calls are queued and collected until
+    ``max_batch_size`` requests are waiting or the oldest one has waited
+    ``max_wait_ms``. The batch then runs as one forward pass on a dedicated
+    worker thread, so the event loop never blocks on the model, and each
+    caller's future is resolved with its own score.
+    """
+
+    def __init__(self, model: WAFMLModel, max_batch_size: int = None, max_wait_ms: float = None):
+        self.model = model
+        self.max_batch_size = max_batch_size or settings.ML_BATCH_MAX_SIZE
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else settings.ML_BATCH_MAX_WAIT_MS) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="waf-inference")
+
+    async def predict(self, request_data: Dict) -> Tuple[bool, float]:
+        """Queue a request for the next batch and wait for its verdict"""
+        if not settings.ENABLE_ML_DETECTION or not self.model.enabled:
+            return False, 0.0
+
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request_data, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Dict, asyncio.Future, float]]:
+        """Wait for one request, then gather more until the batch is full or the wait runs out"""
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                ML_QUEUE_WAIT.observe(started - enqueued)
+            ML_BATCH_SIZE.observe(len(batch))
+
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.model.predict_batch, [item[0] for item in batch]
+                )
+            except Exception as e:
+                logger.error(f"⚠️ Error in ML inference worker: {str(e)}")
+                results = [(False, 0.0)] * len(batch)
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        """Stop the batching task and the worker thread"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,438 @@
+import bisect
+import fcntl
+import hashlib
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WAFIPX01"
+MAX_LISTS = 32  # list membership is a uint32 bitmask per range
+_HEADER_LENGTH = struct.Struct("<I")
+_LOW_BITS = 0xFFFFFFFFFFFFFFFF
+
+# category -> settings toggle that must be on for the category's deny lists to block
+DENY_TOGGLES = {
+    "tor": "BLOCK_TOR_IPS",
+    "suspicious": "BLOCK_SUSPICIOUS_IPS",
+}
+
+
+@dataclass(frozen=True)
+class IPVerdict:
+    allowed: bool = False
+    denied: bool = False
+    score: int = 0
+    lists: Tuple[str, ...] = ()
+
+
+NO_VERDICT = IPVerdict()
+
+
+def _feed_entries(path: str) -> Iterable[str]:
+    """Addresses and CIDR ranges in a feed file: one per line, # starts a comment"""
+    with open(path, "r") as f:
+        for line in f:
+            entry = line.split("#", 1)[0].strip()
+            if entry:
+                yield entry
+
+
+def _parse_range(entry: str) -> Tuple[int, int, int]:
+    """Return (version, first address, last address) of an address or CIDR range"""
+    address, _, prefix = entry.partition("/")
+    if ":" not in address and address.count(".") == 3 and (not prefix or prefix.isdigit() and int(prefix) <= 32):
+        # Dotted IPv4, the bulk of most feeds, without building an ip_network
+        try:
+            value = int.from_bytes(socket.inet_aton(address), "big")
+        except OSError:
+            pass
+        else:
+            host_bits = 32 - int(prefix or 32)
+            first = value >> host_bits << host_bits
+            return 4, first, first | ((1 << host_bits) - 1)
+    network = ipaddress.ip_network(entry, strict=False)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+class _Ranges:
+    """The ranges of one address family, as 64-bit halves in flat arrays"""
+
+    def __init__(self):
+        self.start_hi, self.start_lo = array("Q"), array("Q")
+        self.end_hi, self.end_lo = array("Q"), array("Q")
+        self.list_index = array("B")
+
+    def add(self, position: int, first: int, last: int):
+        self.start_hi.append(first >> 64)
+        self.start_lo.append(first & _LOW_BITS)
+        self.end_hi.append(last >> 64)
+        self.end_lo.append(last & _LOW_BITS)
+        self.list_index.append(position)
+
+    def __len__(self) -> int:
+        return len(self.list_index)
+
+
+def _flatten(ranges: _Ranges, last_address: int) -> Tuple[np.ndarray, ...]:
+    """
+    Turn possibly overlapping per-list ranges into disjoint segments.
+    Returns arrays of segment start (high, low), end (high, low) and list
+    bitmask, sorted by start.
+    """
+    empty = np.zeros(0, dtype=np.uint64)
+    if not len(ranges):
+        return empty, empty, empty, empty, np.zeros(0, dtype=np.uint32)
+    start_hi, start_lo = np.frombuffer(ranges.start_hi, np.uint64), np.frombuffer(ranges.start_lo, np.uint64)
+    end_hi, end_lo = np.frombuffer(ranges.end_hi, np.uint64), np.frombuffer(ranges.end_lo, np.uint64)
+    list_index = np.frombuffer(ranges.list_index, np.uint8)
+
+    # Each range adds one to its list's count at its start and takes it off
+    # at the address after its end; a range reaching the last address never ends
+    after_lo = end_lo + np.uint64(1)
+    after_hi = end_hi + (after_lo == 0)
+    ends = (end_hi != last_address >> 64) | (end_lo != last_address & _LOW_BITS)
+    position_hi = np.concatenate((start_hi, after_hi[ends]))
+    position_lo = np.concatenate((start_lo, after_lo[ends]))
+    event_list = np.concatenate((list_index, list_index[ends]))
+    event_delta = np.concatenate((np.ones(len(start_hi), np.int8), np.full(int(ends.sum()), -1, np.int8)))
+
+    order = np.lexsort((position_lo, position_hi))
+    position_hi, position_lo = position_hi[order], position_lo[order]
+    event_list, event_delta = event_list[order], event_delta[order]
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = (position_hi[1:] != position_hi[:-1]) | (position_lo[1:] != position_lo[:-1])
+    group = np.cumsum(distinct) - 1
+    position_hi, position_lo = position_hi[distinct], position_lo[distinct]
+
+    # From each distinct position on, a list covers the addresses while its count is positive
+    mask = np.zeros(len(position_hi), dtype=np.uint32)
+    for position in np.unique(event_list):
+        chosen = event_list == position
+        counts = np.zeros(len(mask), dtype=np.int32)
+        np.add.at(counts, group[chosen], event_delta[chosen])
+        mask |= (np.cumsum(counts) > 0).astype(np.uint32) << np.uint32(position)
+
+    # A segment runs from a position where the mask changes to the address before the next one
+    changed = np.ones(len(mask), dtype=bool)
+    changed[1:] = mask[1:] != mask[:-1]
+    seg_start_hi, seg_start_lo, mask = position_hi[changed], position_lo[changed], mask[changed]
+    seg_end_lo = np.append(seg_start_lo[1:] - np.uint64(1), np.uint64(last_address & _LOW_BITS))
+    seg_end_hi = np.append(seg_start_hi[1:] - (seg_start_lo[1:] == 0), np.uint64(last_address >> 64))
+    covered = mask != 0
+    return seg_start_hi[covered], seg_start_lo[covered], seg_end_hi[covered], seg_end_lo[covered], mask[covered]
+
+
+def build_index(lists: List[Dict], signature: str = "") -> bytes:
+    """
+    Compile IP lists into the on-disk index format.
+
+    ``lists`` holds dicts with ``name``, ``action`` ("allow", "deny" or
+    "score"), ``score``, ``category`` and ``entries`` (an iterable of
+    addresses or CIDR ranges). The result is a JSON header followed by
+    sorted, disjoint range arrays per address family: IPv4 as uint32
+    start/end, IPv6 as uint64 high/low halves of start and end, each with a
+    uint32 list bitmask. Entries are read once into flat arrays, so feeds
+    with millions of entries are built without a Python object per range.
+    """
+    if len(lists) > MAX_LISTS:
+        raise ValueError(f"At most {MAX_LISTS} IP lists are supported, got {len(lists)}")
+
+    v4, v6 = _Ranges(), _Ranges()
+    invalid = 0
+    for position, ip_list in enumerate(lists):
+        for entry in ip_list["entries"]:
+            try:
+                version, first, last = _parse_range(entry)
+            except ValueError:
+                invalid += 1
+                continue
+            (v4 if version == 4 else v6).add(position, first, last)
+    if invalid:
+        logger.warning(f"Skipped {invalid} unparseable IP list entries")
+
+    start_hi4, start4, end_hi4, end4, mask4 = _flatten(v4, (1 << 32) - 1)
+    segments6 = _flatten(v6, (1 << 128) - 1)
+    arrays = [start4.astype(np.uint32), end4.astype(np.uint32), mask4] + list(segments6)
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "signature": signature,
+        "lists": [{k: v for k, v in ip_list.items() if k != "entries"} for ip_list in lists],
+        "v4": len(mask4),
+        "v6": len(segments6[4]),
+    }).encode()
+    # Pad so every array starts on an 8-byte boundary
+    prefix_length = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+    header += b" " * (-prefix_length % 8)
+    body = b"".join(a.tobytes() + b"\0" * (-a.nbytes % 8) for a in arrays)
+    return MAGIC + _HEADER_LENGTH.pack(len(header)) + header + body
+
+
+class IPReputationIndex:
+    """
+    Allow/deny/score lookups over a compiled IP index.
+
+    The index is searched in place, either in bytes or in a read-only memory
+    map of the index file, so every worker mapping the same file shares one
+    copy in the page cache. A lookup is a binary search over the sorted,
+    disjoint range starts followed by a bounds check on the range end.
+    """
+
+    def __init__(self, buffer, source: str = "memory"):
+        self.source = source
+        self._buffer = buffer
+        view = memoryview(buffer)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{source} is not an IP index")
+        (header_length,) = _HEADER_LENGTH.unpack_from(view, len(MAGIC))
+        offset = len(MAGIC) + _HEADER_LENGTH.size
+        self.header = json.loads(bytes(view[offset:offset + header_length]))
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{source} was built on a {self.header['byteorder']}-endian host")
+        offset += header_length
+
+        def take(fmt: str, count: int) -> memoryview:
+            nonlocal offset
+            size = count * array(fmt).itemsize
+            part = view[offset:offset + size].cast(fmt)
+            offset += size + (-size % 8)
+            return part
+
+        n4, n6 = self.header["v4"], self.header["v6"]
+        self._v4_start, self._v4_end, self._v4_mask = take("I", n4), take("I", n4), take("I", n4)
+        self._v6_start_hi, self._v6_start_lo = take("Q", n6), take("Q", n6)
+        self._v6_end_hi, self._v6_end_lo = take("Q", n6), take("Q", n6)
+        self._v6_mask = take("I", n6)
+        self.lists = self.header["lists"]
+        self._verdicts: Dict[int, IPVerdict] = {0: NO_VERDICT}
+
+    @classmethod
+    def open(cls, path: str) -> "IPReputationIndex":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, source=path)
+
+    @property
+    def signature(self) -> str:
+        return self.header["signature"]
+
+    def __len__(self) -> int:
+        return self.header["v4"] + self.header["v6"]
+
+    def _verdict(self, mask: int) -> IPVerdict:
+        verdict = self._verdicts.get(mask)
+        if verdict is None:
+            allowed = denied = False
+            score = 0
+            names = []
+            for position, ip_list in enumerate(self.lists):
+                if not mask & (1 << position):
+                    continue
+                names.append(ip_list["name"])
+                score += ip_list.get("score", 0)
+                if ip_list["action"] == "allow":
+                    allowed = True
+                elif ip_list["action"] == "deny":
+                    toggle = DENY_TOGGLES.get(ip_list.get("category"))
+                    denied = denied or toggle is None or getattr(settings, toggle)
+            verdict = self._verdicts[mask] = IPVerdict(allowed, denied, score, tuple(names))
+        return verdict
+
+    def _mask_v4(self, value: int) -> int:
+        i = bisect.bisect_right(self._v4_start, value) - 1
+        if i >= 0 and self._v4_end[i] >= value:
+            return self._v4_mask[i]
+        return 0
+
+    def _mask_v6(self, value: int) -> int:
+        high, low = value >> 64, value & 0xFFFFFFFFFFFFFFFF
+        # Last range whose (high, low) start is <= the address
+        after = bisect.bisect_right(self._v6_start_hi, high)
+        first = bisect.bisect_left(self._v6_start_hi, high, 0, after)
+        i = bisect.bisect_right(self._v6_start_lo, low, first, after) - 1
+        if i < first:
+            i = first - 1
+        if i >= 0 and (self._v6_end_hi[i], self._v6_end_lo[i]) >= (high, low):
+            return self._v6_mask[i]
+        return 0
+
+    def lookup(self, ip: Optional[str]) -> IPVerdict:
+        """Return the combined verdict of every list containing the address"""
+        if not ip:
+            return NO_VERDICT
+        if ":" not in ip:
+            try:
+                return self._verdict(self._mask_v4(int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")))
+            except OSError:
+                return NO_VERDICT
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return NO_VERDICT
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if address.version == 4:
+            return self._verdict(self._mask_v4(int(address)))
+        return self._verdict(self._mask_v6(int(address)))
+
+
+def configured_lists() -> List[Dict]:
+    """IP_WHITELIST plus every feed in IP_FEEDS, without their entries"""
+    lists = [{"name": "whitelist", "action": "allow", "score": 0, "category": None, "path": None}]
+    for name, feed in settings.IP_FEEDS.items():
+        lists.append({
+            "name": name,
+            "action": feed.get("action", "deny"),
+            "score": feed.get("score", 0),
+            "category": feed.get("category"),
+            "path": feed["path"],
+        })
+    return lists
+
+
+def feeds_signature(lists: List[Dict]) -> str:
+    """Digest of the list configuration and the size and mtime of every feed file"""
+    state = []
+    for ip_list in lists:
+        stat = None
+        if ip_list["path"]:
+            try:
+                st = os.stat(ip_list["path"])
+                stat = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        state.append((ip_list, stat))
+    state.append(sorted(settings.IP_WHITELIST))
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _list_entries(ip_list: Dict) -> Iterable[str]:
+    if ip_list["path"] is None:
+        yield from settings.IP_WHITELIST
+        return
+    try:
+        yield from _feed_entries(ip_list["path"])
+    except OSError as e:
+        logger.warning(f"IP feed {ip_list['name']} not loaded: {e}")
+
+
+def load_lists(lists: List[Dict]) -> List[Dict]:
+    """Attach the entries of each list, streamed from its feed file as the index is built"""
+    return [dict(ip_list, entries=_list_entries(ip_list)) for ip_list in lists]
+
+
+def build_index_file(path: str, wait: bool = False) -> bool:
+    """
+    Rebuild the index file at ``path`` if the feeds changed since it was
+    built. Returns whether this process wrote a new file. A lock file keeps
+    workers from building the same index concurrently: while another worker
+    holds it this returns at once, or with ``wait`` blocks until that build
+    is done. The new index is written beside the old one and renamed over it.
+    """
+    lists = configured_lists()
+    signature = feeds_signature(lists)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False  # another worker is building it
+        try:
+            if IPReputationIndex.open(path).signature == signature:
+                return False
+        except (OSError, ValueError):
+            pass
+        data = build_index(load_lists(lists), signature)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        return True
+
+
+def load_index(path: str) -> IPReputationIndex:
+    """The index for the current configuration: built in memory without IP_FEEDS, else (re)built at ``path`` and mapped"""
+    if not settings.IP_FEEDS:
+        lists = configured_lists()
+        return IPReputationIndex(build_index(load_lists(lists), feeds_signature(lists)))
+    # At startup the file may not exist until the worker building it is done
+    build_index_file(path, wait=True)
+    return IPReputationIndex.open(path)
+
+
+class IPReputation:
+    """
+    The IP index in use by this worker.
+
+    Without IP_FEEDS the index only holds IP_WHITELIST and is built in memory.
+    With feeds it is built into IP_INDEX_PATH and memory-mapped. A daemon
+    thread checks every ``interval`` seconds whether the feeds changed,
+    rebuilds the file if so (only one worker does) and maps whichever new
+    file appears. Lookups read the current index through one reference, so
+    a swap never blocks them.
+
+    ``index`` is an index already built for the current configuration, such
+    as one loaded before the workers were forked.
+    """
+
+    def __init__(self, index_path: str = None, interval: float = None, index: IPReputationIndex = None):
+        self.index_path = index_path or settings.IP_INDEX_PATH
+        self.interval = interval or settings.IP_FEED_RELOAD_INTERVAL
+        self._thread = None
+        self.index = index if index is not None else load_index(self.index_path)
+        if not settings.IP_FEEDS:
+            return
+
+        self._file_state = self._read_file_state()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="waf-ip-reputation", daemon=True)
+        self._thread.start()
+
+    def lookup(self, ip: Optional[str]) -> IPVerdict:
+        return self.index.lookup(ip)
+
+    def _read_file_state(self) -> Tuple:
+        try:
+            st = os.stat(self.index_path)
+            return st.st_ino, st.st_mtime_ns
+        except OSError:
+            return ()
+
+    def refresh(self):
+        """Rebuild the index file if needed and map it if it changed"""
+        try:
+            build_index_file(self.index_path)
+        except Exception as e:
+            logger.error(f"Error building IP index: {str(e)}")
+        state = self._read_file_state()
+        if state and state != self._file_state:
+            try:
+                index = IPReputationIndex.open(self.index_path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error opening IP index: {str(e)}")
+                return
+            self._file_state = state
+            self.index = index
+            logger.info(f"IP index reloaded: {len(index)} ranges from {len(index.lists)} lists")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.refresh()
+
+    def close(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join(timeout=self.interval + 1)
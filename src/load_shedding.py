@@ -0,0 +1,149 @@
+"""
+Deadline-aware stage shedding for the WAF pipeline.
+
+Every request gets a time budget (WAF_TIME_BUDGET_MS) for the WAF's own
+work; time spent waiting for the client to upload the body does not count.
+Before each sheddable stage runs, the shedder compares what is left of the
+budget with what the stages still ahead are expected to cost (a moving
+average of their measured durations) and, while they would not fit, sheds
+stages in LOAD_SHED_ORDER, ML first. Independently, a background task
+samples the event-loop lag: at LOAD_SHED_LAG_THRESHOLD_MS the first stage
+of the order is shed for every request, at twice that the first two, and
+so on, so a worker that is already behind stops taking on optional work
+instead of queueing it.
+
+A shed stage either lets the request through without it (fail open) or
+answers it with a 503 (fail closed), per LOAD_SHED_FAIL_OPEN. A stage with
+a cheaper fallback (ML scored in the background) takes it when only the
+request's budget is short; under lag the worker has no time to spare for
+it either, so the stage is skipped. Every shed decision is counted in
+``waf_stages_shed_total``.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .metrics import EVENT_LOOP_LAG, STAGES_SHED
+
+# Sheddable stages in the order a request runs them
+PIPELINE = ("rate_limit", "body_scan", "rules", "ml")
+
+COST_SMOOTHING = 0.1  # weight of a new duration in a stage's moving average
+COST_DECAY = 0.98  # a shed stage's estimate shrinks, so it is tried again once load drops
+LAG_RELEASE = 0.5  # lag falls halfway towards each new, lower sample
+
+
+class RequestBudget:
+    """The time one request may spend in the WAF, and the stages shed for it"""
+
+    __slots__ = ("started", "budget", "excluded", "shed")
+
+    def __init__(self, budget: float):
+        self.started = time.perf_counter()
+        self.budget = budget
+        self.excluded = 0.0
+        self.shed: List[str] = []
+
+    def exclude(self, seconds: float):
+        """Don't count time the WAF spent waiting on the client"""
+        self.excluded += seconds
+
+    def remaining(self) -> float:
+        return self.budget - (time.perf_counter() - self.started - self.excluded)
+
+
+class LoadShedder:
+    """
+    Decides per request and stage whether to run the stage or shed it.
+
+    ``begin`` starts a request's budget (and, on first use, the lag
+    sampler); ``decide`` is asked before each stage in PIPELINE and
+    ``record`` is told how long the stages that ran took.
+    """
+
+    def __init__(self, budget_ms: float = None, lag_threshold_ms: float = None, order: List[str] = None,
+                 fail_open: Dict[str, bool] = None, lag_interval_ms: float = None):
+        self.budget = (settings.WAF_TIME_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+        self.lag_threshold = (
+            settings.LOAD_SHED_LAG_THRESHOLD_MS if lag_threshold_ms is None else lag_threshold_ms
+        ) / 1000
+        self.order = list(settings.LOAD_SHED_ORDER if order is None else order)
+        unknown = set(self.order) - set(PIPELINE)
+        if unknown:
+            raise ValueError(f"Unknown stages in LOAD_SHED_ORDER: {sorted(unknown)}")
+        self.fail_open = settings.LOAD_SHED_FAIL_OPEN if fail_open is None else fail_open
+        self.lag_interval = (lag_interval_ms or settings.LOAD_SHED_LAG_INTERVAL_MS) / 1000
+        self.lag = 0.0
+        self._costs: Dict[str, float] = {}
+        self._monitor: Optional[asyncio.Task] = None
+
+    def begin(self) -> RequestBudget:
+        """Start the budget of a request that just arrived"""
+        if self._monitor is None and self.lag_threshold:
+            self._monitor = asyncio.ensure_future(self._sample_lag())
+        return RequestBudget(self.budget)
+
+    async def _sample_lag(self):
+        while True:
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            # Rise at once, fall gradually, so one quiet sample does not end shedding
+            self.lag = lag if lag >= self.lag else self.lag * LAG_RELEASE + lag * (1 - LAG_RELEASE)
+            EVENT_LOOP_LAG.set(self.lag)
+
+    def record(self, stage: str, seconds: float):
+        """Fold a stage's measured duration into its expected cost"""
+        cost = self._costs.get(stage)
+        self._costs[stage] = seconds if cost is None else cost + COST_SMOOTHING * (seconds - cost)
+
+    def _lag_shed(self) -> Tuple[str, ...]:
+        """The stages every request sheds at the current lag"""
+        if not self.lag_threshold or self.lag < self.lag_threshold:
+            return ()
+        return tuple(self.order[:int(self.lag / self.lag_threshold)])
+
+    def _budget_shed(self, budget: RequestBudget, stage: str) -> bool:
+        """Whether ``stage`` has to go for the stages still ahead to fit the budget"""
+        ahead = PIPELINE[PIPELINE.index(stage):]
+        costs = {s: self._costs.get(s, 0.0) for s in ahead if s not in budget.shed}
+        expected, remaining = sum(costs.values()), budget.remaining()
+        for candidate in self.order:
+            if expected <= remaining:
+                return False
+            if candidate in costs:
+                if candidate == stage:
+                    return True
+                expected -= costs[candidate]
+        return False
+
+    def decide(self, budget: Optional[RequestBudget], stage: str, fallback: str = "skipped") -> Optional[str]:
+        """
+        None to run ``stage``; otherwise it is shed and this is what to do
+        instead: "rejected" (fail closed), "skipped", or ``fallback`` (such
+        as "deferred") when the budget rather than lag shed it.
+        """
+        if budget is None or stage not in self.order:
+            return None
+        if stage in self._lag_shed():
+            cause = "lag"
+        elif self.budget and self._budget_shed(budget, stage):
+            cause = "budget"
+        else:
+            return None
+
+        if stage in self._costs:
+            self._costs[stage] *= COST_DECAY
+        if not self.fail_open.get(stage, True):
+            action = "rejected"
+        else:
+            action = fallback if cause == "budget" else "skipped"
+        budget.shed.append(stage)
+        STAGES_SHED.labels(stage, cause, action).inc()
+        return action
+
+    async def close(self):
+        """Stop the lag sampler"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
@@ -0,0 +1,51 @@
+import bz2
+import collections
+import gzip
+import itertools
+import lzma
+import os
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Iterator, List, Sequence
+
+_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def open_log(path: str):
+    """Open a plain or compressed (.gz, .bz2, .xz) log file for reading text"""
+    opener = _OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, "rt", encoding="utf-8", errors="replace")
+
+
+def iter_lines(paths: Sequence[str]) -> Iterator[str]:
+    """Non-blank lines of the files, in order, read one at a time"""
+    for path in paths:
+        with open_log(path) as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def iter_chunks(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_bounded(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    ``executor.map(fn, items)`` that keeps at most ``window`` calls in flight.
+
+    Executor.map submits every item up front, which reads a whole multi-GB
+    input into memory; this pulls the next item only once a slot is free.
+    Results come back in input order.
+    """
+    in_flight = collections.deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, *item))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
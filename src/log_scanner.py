@@ -0,0 +1,285 @@
+"""
+Offline re-scan of logged traffic, and verdict diffs between two versions.
+
+Reads JSON-lines request logs in the shape RequestLogger writes (``method``,
+``path``, ``headers``, ``query_params``, optionally ``body``), plain or
+compressed, and decides each request the way WAFMiddleware does: the route
+policy, then the rules, then the ML model for requests the rules let
+through. Lines that are not JSON records (text-format logs) are skipped.
+
+The files are streamed in chunks to one worker process per core, with a
+bounded number of chunks in flight, so memory stays constant however large
+the logs are. Each worker builds its RulesEngine and models once and scores
+a chunk's ML candidates with one predict_batch call. Both versions read the
+same RequestContext per request, so a field is normalized and a request
+featurized once even when diffing.
+
+A version is a rule set plus an optional model. With only the candidate
+version, every request it blocks is written out. With a baseline
+(``--baseline-rules`` and/or ``--baseline-model``; what is not given is
+taken from the candidate), only requests whose verdict differs are written.
+Written records carry the request's line number, counting non-blank lines
+across all the files.
+
+Run from the repository root:
+    python -m src.log_scanner logs/access.log --rules rules/ --baseline-rules rules.old/ -o diff.jsonl
+    python -m src.log_scanner dumps/*.jsonl.gz --model models/new.npz --baseline-model models/old.npz
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from .body_inspector import BodyInspector
+from .config import settings
+from .log_files import imap_bounded, iter_chunks, iter_lines
+from .request_context import RequestContext
+from .routes import route_table
+from .rule_sets import compile_rule_set, load_rule_set
+from .rules_engine import FIELD_FAMILIES, RulesEngine
+
+logger = logging.getLogger(__name__)
+
+ML_CONFIDENCE_THRESHOLD = 0.85  # as WAFMiddleware: block only if confidence is 85%+
+
+
+@dataclass(frozen=True)
+class Version:
+    """What one side of a scan runs: rules (None: settings) and a model (None: no ML)"""
+    rules: Optional[Dict[str, Dict]] = None
+    model_path: Optional[str] = None
+
+
+def load_model(path: str):
+    """Load a WAFMLModel from an exported .npz artifact or a Keras .h5 model"""
+    from .ml_model import WAFMLModel
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    settings.ENABLE_ML_DETECTION = True
+    if path.endswith(".npz"):
+        settings.ML_RUNTIME, settings.ML_ARTIFACT_PATH = "numpy", path
+    else:
+        settings.ML_RUNTIME, settings.ML_MODEL_PATH = "keras", path
+    model = WAFMLModel()
+    if path.endswith(".npz") and model.runtime != "numpy":
+        raise ValueError(f"Could not load ML artifact {path}")
+    if not model.enabled:
+        raise ValueError(f"ML model {path} was not trained on hashed features (no {model.featurizer_path})")
+    return model
+
+
+class Scanner:
+    """Decide requests for one or two versions (runs in a worker process)"""
+
+    def __init__(self, versions: List[Version]):
+        self.engines = []
+        for version in versions:
+            engine = RulesEngine()
+            if version.rules is not None:
+                engine.swap_rule_set(compile_rule_set(version.rules))
+            self.engines.append(engine)
+        self.versions = versions
+        # Versions sharing a model share one instance and its scores
+        self.models = {path: load_model(path) for path in {v.model_path for v in versions} if path}
+
+    def _rules_verdict(self, engine: RulesEngine, request: RequestContext) -> Dict:
+        policy = request["route_policy"]
+        # Stream the body through a BodyInspector in window-sized chunks, as
+        # the middleware does, so a large body costs linear time
+        inspector = BodyInspector(
+            engine, policy.max_body_size or settings.MAX_REQUEST_SIZE, settings.BODY_INSPECTION_WINDOW,
+            RulesEngine.route_families(FIELD_FAMILIES, policy.rule_families)
+        )
+        body = request["body"].encode("utf-8") if isinstance(request["body"], str) else b""
+        step = max(settings.BODY_INSPECTION_WINDOW, 1024)
+        for offset in range(0, len(body), step):
+            inspector.feed(body[offset:offset + step], final=offset + step >= len(body))
+        if inspector.too_large:
+            return {"blocked": True, "reason": "too_large", "detail": None, "rules": []}
+
+        _, matches = engine.analyze_request(request, inspector.matches)
+        blocked, reason = engine.should_block_request(matches)
+        return {
+            "blocked": blocked,
+            "reason": "rules" if blocked else None,
+            "detail": reason,
+            "rules": sorted({f"{m.rule_name}: {m.pattern}" for m in matches}),
+        }
+
+    def _score(self, requests: List[RequestContext], verdicts: List[List[Dict]]):
+        """Score every request some version still lets through, one batch per model"""
+        for path, model in self.models.items():
+            pending = sorted({
+                index for side, version in enumerate(self.versions) if version.model_path == path
+                for index, verdict in enumerate(verdicts[side])
+                if not verdict["blocked"] and requests[index]["route_policy"].ml
+            })
+            if not pending:
+                continue
+            scores = dict(zip(pending, model.predict_batch([requests[index] for index in pending])))
+            for side, version in enumerate(self.versions):
+                if version.model_path != path:
+                    continue
+                for index, verdict in enumerate(verdicts[side]):
+                    if index in scores:
+                        is_malicious, confidence = scores[index]
+                        verdict["ml_score"] = round(confidence, 4)
+                        if is_malicious and confidence >= ML_CONFIDENCE_THRESHOLD:
+                            verdict.update(blocked=True, reason="ml", detail=f"Confidence {confidence:.2%}")
+
+    def scan(self, requests: List[RequestContext]) -> List[List[Dict]]:
+        """Verdicts per version, each a list in request order"""
+        verdicts = [[] for _ in self.versions]
+        for request in requests:
+            policy = request["route_policy"]
+            for side, engine in enumerate(self.engines):
+                if policy.skip:
+                    verdicts[side].append({"blocked": False, "reason": "skipped", "detail": None, "rules": []})
+                else:
+                    verdicts[side].append(self._rules_verdict(engine, request))
+        self._score(requests, verdicts)
+        return verdicts
+
+
+# Worker process state, set up once by _init_worker
+_scanner: Optional[Scanner] = None
+
+
+def _init_worker(versions: List[Version]):
+    global _scanner
+    # Per-match warnings from the engine and model would swamp the output
+    logging.disable(logging.WARNING)
+    _scanner = Scanner(versions)
+
+
+def _parse(lines: List[str], first_line: int) -> List[Tuple[int, RequestContext]]:
+    """Contexts for the request records, shared by both versions' rules and models"""
+    requests = []
+    for number, line in enumerate(lines, start=first_line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or "path" not in record:
+            continue
+        record["headers"] = record.get("headers") or {}
+        record["query_params"] = record.get("query_params") or {}
+        record.setdefault("body", "")
+        record["route_policy"] = route_table().resolve(record["path"])
+        requests.append((number, RequestContext.from_dict(record)))
+    return requests
+
+
+def _scan_chunk(lines: List[str], first_line: int) -> Tuple[int, List[Dict], List[int]]:
+    """
+    Scan one chunk (runs in a worker)
+    Returns: (requests scanned, records to write, requests blocked per version)
+    """
+    parsed = _parse(lines, first_line)
+    requests = [request for _, request in parsed]
+    verdicts = _scanner.scan(requests)
+    diffing = len(verdicts) == 2
+    records = []
+    for position, (number, request) in enumerate(parsed):
+        sides = [side[position] for side in verdicts]
+        if diffing and (sides[0]["blocked"], sides[0]["reason"]) == (sides[1]["blocked"], sides[1]["reason"]):
+            continue
+        if not diffing and not sides[0]["blocked"]:
+            continue
+        record = {
+            "line": number,
+            "client_ip": request.get("client_ip"),
+            "method": request.get("method"),
+            "path": request.get("path"),
+        }
+        if diffing:
+            record["baseline"], record["candidate"] = sides
+        else:
+            record["verdict"] = sides[0]
+        records.append(record)
+    return len(requests), records, [sum(v["blocked"] for v in side) for side in verdicts]
+
+
+def scan_logs(paths: List[str], versions: List[Version], output, workers: int = None,
+              chunk_size: int = 1000) -> Dict:
+    """
+    Scan the logs with one version, or diff two (``versions[0]`` is the
+    baseline). Writes JSON lines to ``output`` and returns a summary.
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    scanned = written = 0
+    blocked = [0] * len(versions)
+
+    chunks = (
+        (chunk, 1 + index * chunk_size)
+        for index, chunk in enumerate(iter_chunks(iter_lines(paths), chunk_size))
+    )
+    # spawn: workers must not inherit the parent's threads or loaded models
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(versions,)
+    ) as executor:
+        for count, records, chunk_blocked in imap_bounded(executor, _scan_chunk, chunks, 2 * workers):
+            scanned += count
+            written += len(records)
+            blocked = [total + chunk for total, chunk in zip(blocked, chunk_blocked)]
+            for record in records:
+                output.write(json.dumps(record) + "\n")
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "requests": scanned,
+        "blocked": blocked[-1],
+        "written": written,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(scanned / max(elapsed, 1e-9)),
+    }
+    if len(versions) == 2:
+        summary["baseline_blocked"] = blocked[0]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="JSON-lines request logs (.log, .jsonl, .gz, .bz2, .xz)")
+    parser.add_argument("--rules", help="Candidate rules file or directory (default: RULES_PATH or CUSTOM_RULES)")
+    parser.add_argument("--model", help="Candidate model, .npz artifact or .h5 (default: no ML)")
+    parser.add_argument("--baseline-rules", help="Baseline rules; enables diff mode")
+    parser.add_argument("--baseline-model", help="Baseline model; enables diff mode")
+    parser.add_argument("-o", "--output", help="Where to write JSON lines (default: stdout)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Log lines per work unit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Rule sets pass the backtracking check once, here, before the workers compile them
+    candidate_rules = load_rule_set(args.rules).rules if args.rules else None
+    candidate = Version(candidate_rules, args.model)
+    versions = [candidate]
+    if args.baseline_rules or args.baseline_model:
+        baseline = Version(
+            load_rule_set(args.baseline_rules).rules if args.baseline_rules else candidate_rules,
+            args.baseline_model or args.model
+        )
+        versions.insert(0, baseline)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        summary = scan_logs(args.paths, versions, output, workers=args.workers, chunk_size=args.chunk_size)
+    finally:
+        if args.output:
+            output.close()
+    logger.info(f"✅ Scan finished: {json.dumps(summary)}")
+
+
+if __name__ == "__main__":
+    main()
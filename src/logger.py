@@ -1,16 +1,62 @@
 import logging
 import json
+import queue
+import random
+import threading
+import time
+import atexit
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 import os
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
 from pythonjsonlogger import jsonlogger
 from .config import settings
+from .metrics import LOG_RECORDS_DROPPED, LOG_RECORDS_WRITTEN
+from .request_context import RequestContext, as_context
+
+try:
+    import orjson
+
+    def _dumps(data: Dict) -> str:
+        return orjson.dumps(data, default=str).decode()
+except ImportError:  # pragma: no cover
+    def _dumps(data: Dict) -> str:
+        return json.dumps(data, default=str)
+
+SENSITIVE_HEADERS = frozenset((
+    'authorization',
+    'cookie',
+    'x-api-key',
+    'api-key',
+    'password',
+))
+
+# (kind, enqueue time, request snapshot, status code, response time or block reason)
+LogItem = Tuple[str, float, RequestContext, int, object]
 
 class RequestLogger:
+    """
+    Access and blocked-request logging without file I/O on the request path.
+
+    ``log_request`` and ``log_blocked_request`` only put a snapshot of the
+    request context (``RequestContext.snapshot``, references to the raw
+    headers and query string) on a bounded queue, so later stages cannot
+    change what gets logged. A background thread drains it in batches,
+    redacts headers (building the header dict there, off the event loop),
+    serializes each record to one JSON line and writes the batch to the
+    rotating log file with a single flush. Allowed
+    requests are sampled at ACCESS_LOG_SAMPLE_RATE; blocked requests are
+    always kept. When the writer falls behind and the queue is full, records
+    are dropped and counted rather than stalling requests.
+    """
+
     def __init__(self):
         self.setup_logging()
+        self._queue: "queue.Queue[Optional[LogItem]]" = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        self._writer = threading.Thread(target=self._run, name="waf-log-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
         
     def setup_logging(self):
         """Setup logging configuration"""
@@ -21,10 +67,12 @@ class RequestLogger:
         # Setup access logger
         self.access_logger = logging.getLogger('waf.access')
         self.access_logger.setLevel(logging.INFO)
+        self.access_handler = None
         
         # Setup error logger
         self.error_logger = logging.getLogger('waf.error')
         self.error_logger.setLevel(logging.ERROR)
+        self.error_handler = None
         
         if settings.ENABLE_ACCESS_LOG:
             self._setup_access_handler()
@@ -40,18 +88,9 @@ class RequestLogger:
             maxBytes=10 * 1024 * 1024,  # 10MB
             backupCount=5
         )
-        
-        if settings.LOG_FORMAT.lower() == 'json':
-            formatter = jsonlogger.JsonFormatter(
-                '%(asctime)s %(name)s %(levelname)s %(message)s'
-            )
-        else:
-            formatter = logging.Formatter(
-                '[%(asctime)s] %(levelname)s: %(message)s'
-            )
-            
-        handler.setFormatter(formatter)
+        # The writer thread writes finished lines to the file itself, so no formatter
         self.access_logger.addHandler(handler)
+        self.access_handler = handler
         
     def _setup_error_handler(self):
         """Setup handler for error logs"""
@@ -73,23 +112,21 @@ class RequestLogger:
             
         handler.setFormatter(formatter)
         self.error_logger.addHandler(handler)
+        self.error_handler = handler
         
     def _sanitize_headers(self, headers: Dict) -> Dict:
-        """Remove sensitive information from headers"""
-        sanitized = headers.copy()
-        sensitive_headers = [
-            'authorization',
-            'cookie',
-            'x-api-key',
-            'api-key',
-            'password',
-        ]
+        """Remove sensitive information from headers (one pass, no copy to patch)"""
+        return {
+            name: '[REDACTED]' if name in SENSITIVE_HEADERS else value
+            for name, value in headers.items()
+        }
         
-        for header in sensitive_headers:
-            if header in sanitized:
-                sanitized[header] = '[REDACTED]'
-                
-        return sanitized
+    def _enqueue(self, kind: str, request_data: Dict, status_code: int, extra):
+        item = (kind, time.time(), as_context(request_data).snapshot(), status_code, extra)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(kind=kind).inc()
         
     def log_request(
         self,
@@ -97,32 +134,12 @@ class RequestLogger:
         status_code: int,
         response_time: float
     ):
-        """Log a processed request"""
-        try:
-            log_data = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'client_ip': request_data.get('client_ip'),
-                'method': request_data.get('method'),
-                'path': request_data.get('path'),
-                'status_code': status_code,
-                'response_time': f"{response_time:.3f}s",
-                'headers': self._sanitize_headers(request_data.get('headers', {})),
-                'query_params': request_data.get('query_params'),
-            }
-            
-            if settings.LOG_FORMAT.lower() == 'json':
-                self.access_logger.info(json.dumps(log_data))
-            else:
-                self.access_logger.info(
-                    f"{log_data['client_ip']} - {log_data['method']} "
-                    f"{log_data['path']} {status_code} {log_data['response_time']}"
-                )
-                
-        except Exception as e:
-            self.error_logger.error(
-                f"Error logging request: {str(e)}",
-                exc_info=True
-            )
+        """Queue a processed request for the access log"""
+        if self.access_handler is None:
+            return
+        if settings.ACCESS_LOG_SAMPLE_RATE < 1.0 and random.random() >= settings.ACCESS_LOG_SAMPLE_RATE:
+            return
+        self._enqueue('access', request_data, status_code, response_time)
             
     def log_blocked_request(
         self,
@@ -130,33 +147,99 @@ class RequestLogger:
         status_code: int,
         reason: Optional[str] = None
     ):
-        """Log a blocked request"""
+        """Queue a blocked request for the error log"""
+        if self.error_handler is None:
+            return
+        self._enqueue('blocked', request_data, status_code, reason)
+
+    def _format(self, item: LogItem) -> str:
+        """Serialize one queued record to a log line (runs on the writer thread)"""
+        kind, logged_at, request_data, status_code, extra = item
+        log_data = {
+            'timestamp': datetime.utcfromtimestamp(logged_at).isoformat(),
+            'level': 'INFO' if kind == 'access' else 'WARNING',
+            'client_ip': request_data.get('client_ip'),
+            'method': request_data.get('method'),
+            'path': request_data.get('path'),
+            'status_code': status_code,
+        }
+        if kind == 'access':
+            log_data['response_time'] = f"{extra:.3f}s"
+        else:
+            log_data['reason'] = extra or 'Request blocked by WAF'
+
+        if settings.LOG_FORMAT.lower() == 'json':
+            log_data['headers'] = self._sanitize_headers(request_data.get('headers', {}))
+            log_data['query_params'] = request_data.get('query_params')
+            if 'rule_scans_skipped' in request_data:
+                log_data['rule_scans_skipped'] = request_data['rule_scans_skipped']
+            return _dumps(log_data) + "\n"
+        if kind == 'access':
+            return (
+                f"[{log_data['timestamp']}] INFO: {log_data['client_ip']} - {log_data['method']} "
+                f"{log_data['path']} {status_code} {log_data['response_time']}\n"
+            )
+        return (
+            f"[{log_data['timestamp']}] WARNING: Blocked request from {log_data['client_ip']} - "
+            f"{log_data['method']} {log_data['path']} "
+            f"{status_code} - {log_data['reason']}\n"
+        )
+
+    def _write_batch(self, handler: RotatingFileHandler, lines: List[str]):
+        """Write lines with one flush, rotating the file when it fills up"""
+        handler.acquire()
         try:
-            log_data = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'client_ip': request_data.get('client_ip'),
-                'method': request_data.get('method'),
-                'path': request_data.get('path'),
-                'status_code': status_code,
-                'reason': reason or 'Request blocked by WAF',
-                'headers': self._sanitize_headers(request_data.get('headers', {})),
-                'query_params': request_data.get('query_params'),
-            }
+            if handler.stream is None:
+                handler.stream = handler._open()
+            for line in lines:
+                if handler.maxBytes > 0 and handler.stream.tell() + len(line) >= handler.maxBytes:
+                    handler.doRollover()
+                handler.stream.write(line)
+            handler.stream.flush()
+        finally:
+            handler.release()
             
-            if settings.LOG_FORMAT.lower() == 'json':
-                self.error_logger.warning(json.dumps(log_data))
-            else:
-                self.error_logger.warning(
-                    f"Blocked request from {log_data['client_ip']} - "
-                    f"{log_data['method']} {log_data['path']} "
-                    f"{status_code} - {log_data['reason']}"
-                )
+    def _drain(self, first: LogItem) -> bool:
+        """Format and write one batch; returns False once the queue is closed"""
+        batch, running = [first], True
+        while len(batch) < settings.LOG_BATCH_SIZE:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                running = False
+                break
+            batch.append(item)
                 
-        except Exception as e:
-            self.error_logger.error(
-                f"Error logging blocked request: {str(e)}",
-                exc_info=True
-            )
+        lines = {'access': [], 'blocked': []}
+        for item in batch:
+            try:
+                lines[item[0]].append(self._format(item))
+            except Exception as e:
+                self.error_logger.error(f"Error logging request: {str(e)}", exc_info=True)
+
+        for kind, handler in (('access', self.access_handler), ('blocked', self.error_handler)):
+            if lines[kind]:
+                try:
+                    self._write_batch(handler, lines[kind])
+                    LOG_RECORDS_WRITTEN.labels(kind=kind).inc(len(lines[kind]))
+                except Exception as e:
+                    LOG_RECORDS_DROPPED.labels(kind=kind).inc(len(lines[kind]))
+                    self.error_logger.error(f"Error writing log batch: {str(e)}", exc_info=True)
+        return running
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None or not self._drain(item):
+                return
+
+    def close(self):
+        """Write everything still queued and stop the writer thread"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
             
     def log_error(self, error: Exception, request_data: Optional[Dict] = None):
         """Log an error"""
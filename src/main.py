@@ -1,12 +1,12 @@
-import elasticapm
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import logging
+import os
 from .config import settings
+from .metrics import reset_multiprocess_dir
 from .middleware import WAFMiddleware
-from prometheus_client import make_asgi_app
-from elasticapm.contrib.starlette import ElasticAPM
+from prometheus_client import CollectorRegistry, make_asgi_app, multiprocess
 
 # Setup logging
 logging.basicConfig(level=settings.LOG_LEVEL)
@@ -29,10 +29,20 @@ app.add_middleware(
 
 app.add_middleware(WAFMiddleware)
 if settings.ENABLE_PROMETHEUS:
-    metrics_app = make_asgi_app()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Each uvicorn worker writes its samples to the shared directory;
+        # the registry aggregates them on scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        metrics_app = make_asgi_app(registry=registry)
+    else:
+        metrics_app = make_asgi_app()
     app.mount("/metrics", metrics_app)
     
 if settings.ENABLE_APM and settings.APM_SERVER_URL:
+    # Imported only when used; the agent is slow to import
+    import elasticapm
+    from elasticapm.contrib.starlette import ElasticAPM
     app.add_middleware(ElasticAPM, client=elasticapm.Client(
         service_name=settings.APP_NAME,
         server_url=settings.APM_SERVER_URL
@@ -65,10 +75,15 @@ async def test_path_traversal(path: str):
     return {"message": f"Received path: {path}"}
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host=settings.HOST,
-        port=settings.PORT,
-        workers=settings.WORKERS,
-        reload=settings.DEBUG
-    )
+    if settings.PREFORK and not settings.DEBUG:
+        from .prefork import serve
+        serve()
+    else:
+        reset_multiprocess_dir()
+        uvicorn.run(
+            "main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            workers=settings.WORKERS,
+            reload=settings.DEBUG
+        )
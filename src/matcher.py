@@ -0,0 +1,159 @@
+import hashlib
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+# Non-ASCII characters that IGNORECASE matches against ASCII letters
+_CASE_FOLD_FIXES = str.maketrans({
+    "İ": "i",  # LATIN CAPITAL LETTER I WITH DOT ABOVE
+    "ı": "i",  # LATIN SMALL LETTER DOTLESS I
+    "ſ": "s",  # LATIN SMALL LETTER LONG S
+    "K": "k",  # KELVIN SIGN
+})
+
+
+@dataclass(frozen=True)
+class PatternHit:
+    family: str
+    pattern: str
+    matched_content: Any
+    rule_id: str
+
+
+@dataclass(frozen=True)
+class _Entry:
+    family: str
+    compiled: Pattern
+    literals: Tuple[str, ...]
+    ignore_case: bool
+    rule_id: str
+
+
+def rule_id(pattern: str) -> str:
+    """Short ID of a rule pattern, the same across reloads and reorderings; the metrics label rules by it"""
+    return hashlib.blake2b(pattern.encode(), digest_size=4).hexdigest()
+
+
+def required_literals(pattern: str, flags: int = 0) -> Tuple[str, ...]:
+    """
+    Return the literal runs every match of the pattern must contain, longest
+    first. Under IGNORECASE the runs are lowercased and restricted to ASCII.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return ()
+
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+    runs, current = [], []
+    for op, arg in parsed:
+        char = chr(arg) if op is sre_parse.LITERAL else None
+        if char is not None and (char.isascii() or not ignore_case):
+            current.append(char.lower() if ignore_case else char)
+            continue
+        runs.append("".join(current))
+        current = []
+    runs.append("".join(current))
+
+    return tuple(sorted({run for run in runs if run}, key=len, reverse=True))
+
+
+def first_finding(compiled: Pattern, content: str) -> Any:
+    """Return what ``compiled.findall(content)[0]`` would, without building the list"""
+    match = compiled.search(content)
+    if match is None:
+        return None
+    if compiled.groups == 0:
+        return match.group(0)
+    if compiled.groups == 1:
+        return match.group(1) or ""
+    return match.groups(default="")
+
+
+def fold_case(content: str) -> str:
+    """Lowercase content so ASCII literals can be tested against IGNORECASE patterns"""
+    if not content.isascii():
+        content = content.translate(_CASE_FOLD_FIXES)
+    return content.lower()
+
+
+class MultiPatternMatcher:
+    """
+    Scan a field once for every enabled rule pattern.
+
+    Each pattern is reduced at compile time to the literal runs any match must
+    contain. A field is case-folded once and the literals of all requested
+    families are checked against it with plain substring search; the regex
+    itself only runs for patterns whose literals are all present.
+    """
+
+    def __init__(self, compiled_rules: Dict[str, List[Pattern]]):
+        self.entries: List[_Entry] = []
+        for family, patterns in compiled_rules.items():
+            for compiled in patterns:
+                self.entries.append(_Entry(
+                    family=family,
+                    compiled=compiled,
+                    literals=required_literals(compiled.pattern, compiled.flags),
+                    ignore_case=bool(compiled.flags & re.IGNORECASE),
+                    rule_id=rule_id(compiled.pattern),
+                ))
+        self._plans: Dict[Tuple[str, ...], List[_Entry]] = {}
+
+    def _plan(self, families: Tuple[str, ...]) -> List[_Entry]:
+        """Return (and cache) the ordered entries for a family combination"""
+        plan = self._plans.get(families)
+        if plan is None:
+            plan = self._plans[families] = [
+                entry for family in families for entry in self.entries if entry.family == family
+            ]
+        return plan
+
+    def scan(self, content: str, families: Sequence[str],
+             timings: Optional[List[Tuple[str, str, float]]] = None) -> List[PatternHit]:
+        """
+        Return one hit per pattern that matches the content, in family and
+        pattern order, with the same matched content as ``findall(...)[0]``.
+        If ``timings`` is given, a (family, rule ID, seconds) entry is appended
+        to it for every pattern evaluated.
+        """
+        if timings is not None:
+            return self._timed_scan(content, families, timings)
+        hits = []
+        folded = None
+        for entry in self._plan(tuple(families)):
+            if entry.literals:
+                if entry.ignore_case:
+                    if folded is None:
+                        folded = fold_case(content)
+                    haystack = folded
+                else:
+                    haystack = content
+                if not all(literal in haystack for literal in entry.literals):
+                    continue
+            found = first_finding(entry.compiled, content)
+            if found is not None:
+                hits.append(PatternHit(entry.family, entry.compiled.pattern, found, entry.rule_id))
+        return hits
+
+    def _timed_scan(self, content: str, families: Sequence[str],
+                    timings: List[Tuple[str, str, float]]) -> List[PatternHit]:
+        """``scan`` with the literal check and regex run of each pattern timed together"""
+        hits = []
+        folded = fold_case(content)
+        for entry in self._plan(tuple(families)):
+            start = time.perf_counter()
+            haystack = folded if entry.ignore_case else content
+            found = None
+            if all(literal in haystack for literal in entry.literals):
+                found = first_finding(entry.compiled, content)
+            timings.append((entry.family, entry.rule_id, time.perf_counter() - start))
+            if found is not None:
+                hits.append(PatternHit(entry.family, entry.compiled.pattern, found, entry.rule_id))
+        return hits
@@ -0,0 +1,170 @@
+import glob
+import os
+from prometheus_client import Counter, Gauge, Histogram, multiprocess
+
+ML_BATCH_SIZE = Histogram(
+    "waf_ml_batch_size",
+    "Requests per batched ML forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+ML_QUEUE_WAIT = Histogram(
+    "waf_ml_queue_wait_seconds",
+    "Time a request waited in the ML inference queue before its batch ran",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+
+ML_VERDICTS = Counter(
+    "waf_ml_verdicts_total",
+    "ML scores by serving mode (inline, async, shadow) and outcome",
+    ["mode", "verdict"]
+)
+
+ML_DEFERRED_LAG = Histogram(
+    "waf_ml_deferred_lag_seconds",
+    "Time from letting a request through to its deferred ML score",
+    ["mode"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+ML_DEFERRED_DROPPED = Counter(
+    "waf_ml_deferred_dropped_total",
+    "Requests not scored because the deferred ML queue was full"
+)
+
+ML_DENY_ENTRIES = Gauge(
+    "waf_ml_deny_entries",
+    "Client IPs currently denied by deferred ML scores, in this worker",
+    multiprocess_mode="liveall"
+)
+
+VERDICT_CACHE_HITS = Counter(
+    "waf_verdict_cache_hits_total",
+    "Requests answered from the verdict cache"
+)
+
+VERDICT_CACHE_MISSES = Counter(
+    "waf_verdict_cache_misses_total",
+    "Requests that had to be fully inspected"
+)
+
+VERDICT_CACHE_EVICTIONS = Counter(
+    "waf_verdict_cache_evictions_total",
+    "Verdict cache entries removed before being hit again",
+    ["reason"]
+)
+
+SHARED_STATE_FULL = Counter(
+    "waf_shared_state_full_total",
+    "Writes dropped because a shared-memory table had no free slot within probe reach",
+    ["table"]
+)
+
+ALERTS_SENT = Counter(
+    "waf_alerts_sent_total",
+    "Alert messages delivered to the webhook"
+)
+
+ALERTS_AGGREGATED = Counter(
+    "waf_alerts_aggregated_total",
+    "Repeated alerts folded into a summary instead of sent"
+)
+
+ALERTS_DROPPED = Counter(
+    "waf_alerts_dropped_total",
+    "Alerts that were not delivered",
+    ["reason"]
+)
+
+LOG_RECORDS_WRITTEN = Counter(
+    "waf_log_records_written_total",
+    "Request log records written to disk",
+    ["kind"]
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "waf_log_records_dropped_total",
+    "Request log records dropped because the writer fell behind or failed",
+    ["kind"]
+)
+
+STAGE_DURATION = Histogram(
+    "waf_stage_duration_seconds",
+    "Time spent in each stage of the WAF decision pipeline",
+    ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+STAGES_SHED = Counter(
+    "waf_stages_shed_total",
+    "Pipeline stages shed under load, by cause (budget or lag) and action (skipped, deferred or rejected)",
+    ["stage", "cause", "action"]
+)
+
+EVENT_LOOP_LAG = Gauge(
+    "waf_event_loop_lag_seconds",
+    "Event-loop lag as seen by the load shedder (recent peak, decaying)",
+    multiprocess_mode="liveall"
+)
+
+RULE_EVAL_DURATION = Histogram(
+    "waf_rule_eval_duration_seconds",
+    "Sampled time to evaluate one rule pattern against one field",
+    ["family", "rule"],
+    buckets=(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001, 0.01)
+)
+
+RULE_HITS = Counter(
+    "waf_rule_hits_total",
+    "Fields matched by each rule pattern",
+    ["family", "rule"]
+)
+
+REQUESTS_BLOCKED = Counter(
+    "waf_requests_blocked_total",
+    "Requests blocked by the WAF",
+    ["reason"]
+)
+
+RULE_SET_LOADED = Gauge(
+    "waf_rule_set_loaded",
+    "1 for the rule set version this worker is running, 0 for versions it replaced",
+    ["version"],
+    multiprocess_mode="liveall"
+)
+
+RULE_SET_RELOADS = Counter(
+    "waf_rule_set_reloads_total",
+    "Rule set reload attempts",
+    ["result"]
+)
+
+RULE_SCANS_SKIPPED = Histogram(
+    "waf_rule_scans_skipped",
+    "Field scans per request skipped because the verdict was already decided",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64)
+)
+
+BODY_SCAN_OFFLOADS = Counter(
+    "waf_body_scan_offloads_total",
+    "Body windows sent to the scan process pool, by outcome",
+    ["result"]
+)
+
+
+def reset_multiprocess_dir():
+    """
+    Delete the samples a previous run left in PROMETHEUS_MULTIPROC_DIR, which
+    would otherwise be aggregated with this one's. Called by the process that
+    starts the workers, before it starts them.
+    """
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+
+def mark_worker_dead(pid: int):
+    """Drop the live-only gauge samples of a worker that exited"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
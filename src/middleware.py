@@ -1,110 +1,422 @@
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Response
 from fastapi.responses import JSONResponse
-from typing import Callable, Dict, Optional
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from collections import deque
+import contextlib
+from typing import Deque, List, Optional
+import os
 import time
 import logging
-import redis
-import requests
+import redis.asyncio as aioredis
 from .config import settings
-from .rules_engine import RulesEngine
+from .rules_engine import RulesEngine, RuleMatch, FIELD_FAMILIES
+from .rule_sets import RuleSetWatcher
+from .ip_reputation import IPReputation, IPVerdict
+from .routes import RoutePolicy, route_table
 from .ml_model import WAFMLModel
-from .rate_limiter import RateLimiter
+from .inference import BatchInferenceQueue
+from .deferred_ml import DeferredScorer, create_deny_list
+from .load_shedding import LoadShedder
+from .rate_limiter import HybridRateLimiter, create_rate_limiter, create_redis_pool
 from .logger import RequestLogger
+from .body_inspector import BodyInspector
+from .scan_pool import BodyScanPool
+from .verdict_cache import create_verdict_cache
+from .alerts import AlertDispatcher
+from .prefork import preloaded
+from .request_context import RequestContext
+from .metrics import ML_VERDICTS, STAGE_DURATION, REQUESTS_BLOCKED
 
 logger = logging.getLogger(__name__)
 
 # Redis setup for rate limiting
-redis_client = redis.Redis(host="localhost", port=6379, db=0)
+redis_client = aioredis.Redis(connection_pool=create_redis_pool())
 
-class WAFMiddleware(BaseHTTPMiddleware):
+class WAFMiddleware:
+    """
+    Pure ASGI WAF middleware.
+
+    The request body is inspected chunk by chunk as it is received. Bodies up
+    to ``BODY_BUFFER_SIZE`` are fully inspected before the app is called and
+    the received messages are replayed to it as-is. Larger bodies are streamed
+    through to the app with each further chunk inspected on the way; if a
+    chunk tips the verdict, the app sees a disconnect and the client gets the
+    block response.
+
+    With ENABLE_LOAD_SHEDDING, the rate limit, body scan, rules and ML
+    stages are skipped or answered with a 503 when the request's time
+    budget or the event-loop lag says the worker cannot afford them.
+    """
     ML_CONFIDENCE_THRESHOLD = 0.85  # Block only if confidence is 85%+
 
-    def __init__(self, app):
-        super().__init__(app)
-        self.rules_engine = RulesEngine()
-        self.ml_model = WAFMLModel()
-        self.rate_limiter = RateLimiter(redis_client)
+    def __init__(self, app: ASGIApp):
+        started = time.perf_counter()
+        # Under PREFORK the rules, IP index and model were loaded by the master
+        shared = preloaded()
+        self.app = app
+        self.rules_engine = RulesEngine(shared.rule_set)
+        self.rules_watcher = (
+            RuleSetWatcher(self.rules_engine, settings.RULES_PATH) if settings.RULES_PATH else None
+        )
+        self.scan_pool = (
+            BodyScanPool(self.rules_engine) if settings.BODY_SCAN_POOL_WORKERS else None
+        )
+        self.ml_model = shared.ml_model or WAFMLModel()
+        self.inference_queue = BatchInferenceQueue(self.ml_model)
+        self.ml_deny = create_deny_list()
+        self.deferred_ml = (
+            DeferredScorer(self.inference_queue, settings.ML_MODE, self.ML_CONFIDENCE_THRESHOLD, self._deny_for_ml)
+            if settings.ML_MODE != "inline" else None
+        )
+        self.load_shedder = LoadShedder() if settings.ENABLE_LOAD_SHEDDING else None
+        # With inline ML, a shed ML stage is scored in the background instead
+        self.ml_fallback = (
+            DeferredScorer(self.inference_queue, "async", self.ML_CONFIDENCE_THRESHOLD, self._deny_for_ml)
+            if self.load_shedder is not None and self.deferred_ml is None else None
+        )
+        self.rate_limiter = create_rate_limiter(redis_client)
+        self.rate_limiters = {"default": self.rate_limiter}
+        for name, limits in settings.RATE_LIMIT_CLASSES.items():
+            self.rate_limiters[name] = create_rate_limiter(redis_client, limits.get("rate"), limits.get("burst"))
+        self.routes = route_table()
+        self.ip_reputation = IPReputation(index=shared.ip_index)
         self.request_logger = RequestLogger()
+        self.alerts = AlertDispatcher()
+        self.verdict_cache = create_verdict_cache() if settings.ENABLE_VERDICT_CACHE else None
+        # Starlette builds the middleware during lifespan startup, so this
+        # runs before the worker accepts connections
+        if settings.ENABLE_ML_DETECTION:
+            self.ml_model.warm_up()
+        logger.info(f"✅ WAF worker {os.getpid()} ready in {time.perf_counter() - started:.2f}s")
+
+    def _extract_request_data(self, scope: Scope) -> RequestContext:
+        """The request's shared context; fields are read from the scope as the stages need them"""
+        return RequestContext.from_scope(scope, time.time())
+
+    def _check_ip_whitelist(self, reputation: IPVerdict) -> bool:
+        """Check if IP is whitelisted (IP_WHITELIST or an allow feed)"""
+        return reputation.allowed
+
+    def _check_ip_reputation(self, reputation: IPVerdict) -> bool:
+        """Check if IP is on an enforced deny list or scores over the block threshold"""
+        threshold = settings.IP_SCORE_BLOCK_THRESHOLD
+        return reputation.denied or bool(threshold and reputation.score >= threshold)
 
-    async def _extract_request_data(self, request: Request) -> Dict:
-        """Extract relevant data from the request"""
-        client_ip = request.client.host if request.client else None
+    def _body_limit(self, policy: RoutePolicy) -> int:
+        """The route's body size limit, or MAX_REQUEST_SIZE"""
+        return policy.max_body_size or settings.MAX_REQUEST_SIZE
 
+    def _check_content_length(self, request_data: RequestContext, policy: RoutePolicy) -> bool:
+        """Check if the declared body size is within the route's body limit"""
+        declared = request_data.header("content-length")
+        return not declared.isdigit() or int(declared) <= self._body_limit(policy)
+
+    async def _check_rate_limit(self, client_ip: str, policy: RoutePolicy) -> bool:
+        """Check the client against the rate limit class of the route"""
+        if policy.rate_limit_class is None:
+            return False
+        if policy.rate_limit_class == "default":
+            return await self.rate_limiter.is_rate_limited(client_ip)
+        limiter = self.rate_limiters.get(policy.rate_limit_class, self.rate_limiter)
+        return await limiter.is_rate_limited(f"{policy.rate_limit_class}:{client_ip}")
+
+    def _send_alert(self, request_data: RequestContext, reason: str, message: str):
+        """Queue an alert to the security team via Slack"""
+        self.alerts.notify(request_data["client_ip"], reason, message)
+
+    @contextlib.contextmanager
+    def _timed(self, stage: str):
+        """Observe a stage's duration, and feed it to the load shedder's cost estimates"""
+        started = time.perf_counter()
         try:
-            body = await request.body()
-            body = body.decode() if body else ""
-        except:
-            body = ""
-
-        request_data = {
-            "method": request.method,
-            "path": request.url.path,
-            "headers": dict(request.headers),
-            "query_params": dict(request.query_params),
-            "body": body,
-            "client_ip": client_ip,
-            "timestamp": time.time(),
-        }
-
-        return request_data
-
-    def _check_ip_whitelist(self, client_ip: str) -> bool:
-        """Check if IP is whitelisted"""
-        return client_ip in settings.IP_WHITELIST
-
-    def _check_path_whitelist(self, path: str) -> bool:
-        """Check if path is whitelisted"""
-        return path in settings.PATH_WHITELIST
-
-    def _send_alert(self, message: str):
-        """Send alert to security team via Slack"""
-        if settings.SLACK_WEBHOOK_URL:
-            requests.post(settings.SLACK_WEBHOOK_URL, json={"text": message})
-
-    async def _process_request(self, request_data: Dict) -> Optional[Response]:
-        """Process request and return response if it should be blocked"""
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_DURATION.labels(stage).observe(elapsed)
+            if self.load_shedder is not None:
+                self.load_shedder.record(stage, elapsed)
 
-        if self._check_ip_whitelist(request_data["client_ip"]):
+    def _shed(self, request_data: RequestContext, stage: str, fallback: str = "skipped") -> Optional[str]:
+        """None to run the stage; otherwise it is shed: "rejected", "skipped" or ``fallback``"""
+        if self.load_shedder is None:
             return None
+        return self.load_shedder.decide(request_data.get("budget"), stage, fallback)
 
-        if self._check_path_whitelist(request_data["path"]):
-            return None
+    def _overloaded_response(self) -> Response:
+        REQUESTS_BLOCKED.labels("overloaded").inc()
+        return JSONResponse(status_code=503, content={"detail": "WAF overloaded"}, headers={"Retry-After": "1"})
 
-        if self.rate_limiter.is_rate_limited(request_data["client_ip"]):
-            return JSONResponse(status_code=429, content={"detail": "Too many requests"})
+    def _too_large_response(self) -> Response:
+        REQUESTS_BLOCKED.labels("too_large").inc()
+        return JSONResponse(status_code=413, content={"detail": "Request body too large"})
+
+    def _block_for_rules(self, request_data: RequestContext, matches: List[RuleMatch]) -> Optional[Response]:
+        """Return a block response if the rule matches warrant one"""
+        should_block, reason = self.rules_engine.should_block_request(matches)
+        if should_block:
+            REQUESTS_BLOCKED.labels("rules").inc()
+            self._send_alert(request_data, reason, f"🚨 WAF blocked request from {request_data['client_ip']} to {request_data['path']}")
+            return JSONResponse(status_code=403, content={"detail": reason or "Request blocked by WAF"})
+        return None
+
+    async def _process_headers(self, request_data: RequestContext, reputation: IPVerdict,
+                               policy: RoutePolicy) -> Optional[Response]:
+        """Checks that run before any of the body is read"""
+        if self._check_ip_reputation(reputation):
+            REQUESTS_BLOCKED.labels("ip_reputation").inc()
+            return JSONResponse(status_code=403, content={"detail": "IP address blocked"})
+
+        if self.ml_deny.is_denied(request_data["client_ip"]):
+            REQUESTS_BLOCKED.labels("ml_deferred").inc()
+            return JSONResponse(status_code=403, content={"detail": "IP address blocked"})
+
+        shed = self._shed(request_data, "rate_limit") if policy.rate_limit_class is not None else None
+        if shed == "rejected":
+            return self._overloaded_response()
+        if shed is None:
+            with self._timed("rate_limit"):
+                rate_limited = await self._check_rate_limit(request_data["client_ip"], policy)
+            if rate_limited:
+                REQUESTS_BLOCKED.labels("rate_limit").inc()
+                return JSONResponse(status_code=429, content={"detail": "Too many requests"})
+
+        if not self._check_content_length(request_data, policy):
+            return self._too_large_response()
+
+        return None
+
+    async def _process_request(self, request_data: RequestContext, inspector: BodyInspector) -> Optional[Response]:
+        """Process request and return response if it should be blocked"""
+        if inspector.too_large:
+            return self._too_large_response()
 
-        is_threat, matches = self.rules_engine.analyze_request(request_data)
+        shed = self._shed(request_data, "rules")
+        if shed == "rejected":
+            return self._overloaded_response()
+        if shed is None:
+            with self._timed("rules"):
+                is_threat, matches = self.rules_engine.analyze_request(request_data, inspector.matches)
+        else:
+            # Headers and query params go unscanned; body matches found while streaming still count
+            matches = list(inspector.matches)
+            is_threat = bool(matches)
+        request_data["rule_matches"] = matches
         if is_threat:
-            should_block, reason = self.rules_engine.should_block_request(matches)
-            if should_block:
-                self._send_alert(f"🚨 WAF blocked request from {request_data['client_ip']} to {request_data['path']}")
-                return JSONResponse(status_code=403, content={"detail": reason or "Request blocked by WAF"})
+            if blocked_response := self._block_for_rules(request_data, matches):
+                return blocked_response
 
-        if settings.ENABLE_ML_DETECTION:
-            is_malicious, confidence = self.ml_model.predict(request_data)
+        if settings.ENABLE_ML_DETECTION and self.ml_model.enabled and request_data["route_policy"].ml:
+            if self.deferred_ml is not None:
+                # async/shadow: the request goes upstream now and is scored in the background
+                self.deferred_ml.submit(request_data)
+                return None
+
+            shed = self._shed(request_data, "ml", fallback="deferred")
+            if shed == "rejected":
+                return self._overloaded_response()
+            if shed == "deferred":
+                self.ml_fallback.submit(request_data)
+            if shed:
+                return None
+
+            with self._timed("ml"):
+                is_malicious, confidence = await self.inference_queue.predict(request_data)
             if is_malicious and confidence >= self.ML_CONFIDENCE_THRESHOLD:
-                self._send_alert(f"🚨 ML Model blocked request (Confidence: {confidence:.2%}) from {request_data['client_ip']}")
+                ML_VERDICTS.labels("inline", "block").inc()
+                REQUESTS_BLOCKED.labels("ml").inc()
+                self._send_alert(request_data, "ml", f"🚨 ML Model blocked request (Confidence: {confidence:.2%}) from {request_data['client_ip']}")
                 return JSONResponse(status_code=403, content={"detail": f"Blocked by ML model (Confidence: {confidence:.2%})"})
+            ML_VERDICTS.labels("inline", "allow").inc()
 
         return None
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    def _deny_for_ml(self, request_data: RequestContext, confidence: float):
+        """Act on a malicious deferred score: deny the client for a while and cache the verdict"""
+        self.ml_deny.add(request_data["client_ip"])
+        self._send_alert(request_data, "ml_deferred", f"🚨 ML Model flagged request (Confidence: {confidence:.2%}) from {request_data['client_ip']}; IP denied for {settings.ML_DENY_TTL:.0f}s")
+        # Identical requests from other clients are then blocked from the cache, as in inline mode
+        cached = request_data.get("verdict_cache_key")
+        if cached is not None and self.verdict_cache.generation == cached[0]:
+            response = JSONResponse(status_code=403, content={"detail": f"Blocked by ML model (Confidence: {confidence:.2%})"})
+            self.verdict_cache.put(cached[1], (response.status_code, response.body))
+
+    async def _buffer_body(self, receive: Receive, max_size: int) -> Deque[Message]:
+        """Receive body messages until the body ends or the buffer is full"""
+        messages: Deque[Message] = deque()
+        buffered = 0
+        while buffered <= settings.BODY_BUFFER_SIZE:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            buffered += len(message.get("body", b""))
+            if buffered > max_size or not message.get("more_body", False):
+                break
+        return messages
+
+    def _verdict_generation(self):
+        """Everything besides the request itself that a cached verdict depends on"""
+        return (
+            self.rules_engine.version, self.ml_model.version, settings.ENABLE_ML_DETECTION and self.ml_model.enabled,
+            settings.ML_MODE
+        )
+
+    async def _inspect_request(self, request_data: RequestContext, messages: Deque[Message],
+                               inspector: BodyInspector) -> Optional[Response]:
+        """Inspect the buffered request, answering from the verdict cache when possible"""
+        chunks = [m.get("body", b"") for m in messages if m["type"] == "http.request"]
+        cache_key = None
+        if self.verdict_cache is not None and not messages[-1].get("more_body", False):
+            self.verdict_cache.ensure_generation(self._verdict_generation())
+            cache_key = self.verdict_cache.make_key(request_data, chunks)
+            request_data["verdict_cache_key"] = (self.verdict_cache.generation, cache_key)
+            hit, verdict = self.verdict_cache.get(cache_key)
+            if hit:
+                request_data["rule_matches"] = []
+                if verdict is None:
+                    return None
+                status_code, body = verdict
+                REQUESTS_BLOCKED.labels("cached").inc()
+                self._send_alert(request_data, "cached", f"🚨 WAF blocked request from {request_data['client_ip']} to {request_data['path']} (cached verdict)")
+                return Response(content=body, status_code=status_code, media_type="application/json")
+
+        with self._timed("body_scan"):
+            for message in messages:
+                if message["type"] == "http.request":
+                    await inspector.feed_async(message.get("body", b""), final=not message.get("more_body", False))
+        request_data["body"] = inspector.prefix
+        blocked_response = await self._process_request(request_data, inspector)
+
+        # A verdict reached without some stage would outlive the overload
+        budget = request_data.get("budget")
+        if cache_key is not None and not inspector.too_large and not (budget and budget.shed):
+            verdict = (blocked_response.status_code, blocked_response.body) if blocked_response else None
+            self.verdict_cache.put(cache_key, verdict)
+        return blocked_response
+
+    async def close(self):
+        """Stop the worker's background tasks and threads, flushing what they still hold"""
+        for limiter in self.rate_limiters.values():
+            if isinstance(limiter, HybridRateLimiter):
+                await limiter.close()
+        for scorer in (self.deferred_ml, self.ml_fallback):
+            if scorer is not None:
+                await scorer.close()
+        await self.inference_queue.close()
+        if self.load_shedder is not None:
+            await self.load_shedder.close()
+        await self.alerts.close()
+        if self.scan_pool is not None:
+            self.scan_pool.close()
+        if self.rules_watcher is not None:
+            self.rules_watcher.close()
+        self.ip_reputation.close()
+        self.request_logger.close()
+
+    async def _lifespan(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Pass the lifespan protocol through, closing the WAF once the app has shut down"""
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "lifespan.shutdown.complete":
+                await self.close()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request through WAF middleware"""
+        if scope["type"] == "lifespan":
+            await self._lifespan(scope, receive, send)
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
+        request_data = self._extract_request_data(scope)
+        if self.load_shedder is not None:
+            request_data["budget"] = self.load_shedder.begin()
+        response_status: List[int] = []
+        late_block: List[Response] = []
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                if late_block:
+                    return
+                response_status.append(message["status"])
+            elif late_block and not response_status:
+                return
+            await send(message)
 
         try:
-            request_data = await self._extract_request_data(request)
-            blocked_response = await self._process_request(request_data)
+            reputation = self.ip_reputation.lookup(request_data["client_ip"])
+            policy = request_data["route_policy"] = self.routes.resolve(request_data["path"])
+            if self._check_ip_whitelist(reputation) or policy.skip:
+                await self.app(scope, receive, send_wrapper)
+                self.request_logger.log_request(request_data, response_status[0], time.time() - start_time)
+                return
+
+            blocked_response = await self._process_headers(request_data, reputation, policy)
+            body_families = RulesEngine.route_families(FIELD_FAMILIES, policy.rule_families)
+            if not blocked_response and body_families:
+                shed = self._shed(request_data, "body_scan")
+                if shed == "rejected":
+                    blocked_response = self._overloaded_response()
+                elif shed:
+                    body_families = ()  # the body is still measured against its size limit
+            declared = request_data.header("content-length")
+            inspector = BodyInspector(
+                self.rules_engine, self._body_limit(policy), settings.BODY_INSPECTION_WINDOW,
+                body_families, self.scan_pool, int(declared) if declared.isdigit() else 0
+            )
+            if not blocked_response:
+                read_started = time.perf_counter()
+                with STAGE_DURATION.labels("body_read").time():
+                    messages = await self._buffer_body(receive, self._body_limit(policy))
+                if "budget" in request_data:
+                    # Waiting for the client's upload is not WAF time
+                    request_data["budget"].exclude(time.perf_counter() - read_started)
+                blocked_response = await self._inspect_request(request_data, messages, inspector)
 
             if blocked_response:
                 self.request_logger.log_blocked_request(request_data, blocked_response.status_code)
-                return blocked_response
+                await blocked_response(scope, receive, send)
+                return
+
+            header_matches = [m for m in request_data["rule_matches"] if m.stage != "body"]
+            streaming = bool(messages) and messages[-1].get("more_body", False)
+
+            async def replay_receive() -> Message:
+                if messages:
+                    return messages.popleft()
+                if late_block:
+                    return {"type": "http.disconnect"}
+                message = await receive()
+                if streaming and message["type"] == "http.request":
+                    added = await inspector.feed_async(message.get("body", b""), final=not message.get("more_body", False))
+                    if inspector.too_large:
+                        late_block.append(self._too_large_response())
+                    elif added and (response := self._block_for_rules(request_data, header_matches + inspector.matches)):
+                        late_block.append(response)
+                    if late_block:
+                        return {"type": "http.disconnect"}
+                return message
+
+            try:
+                await self.app(scope, replay_receive, send_wrapper)
+            except Exception:
+                if not late_block:
+                    raise
+
+            if late_block:
+                self.request_logger.log_blocked_request(request_data, late_block[0].status_code)
+                if not response_status:
+                    await late_block[0](scope, receive, send)
+                return
 
-            response = await call_next(request)
-            self.request_logger.log_request(request_data, response.status_code, time.time() - start_time)
-            return response
+            self.request_logger.log_request(request_data, response_status[0], time.time() - start_time)
 
         except Exception as e:
             logger.error(f"Error in WAF middleware: {str(e)}")
-            return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+            if not response_status:
+                response = JSONResponse(status_code=500, content={"detail": "Internal server error"})
+                await response(scope, receive, send)
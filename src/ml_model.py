@@ -1,44 +1,93 @@
-import tensorflow as tf
 import numpy as np
-import json
 import logging
 import os
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Sequence
 from .config import settings
+from .featurizer import HashingFeaturizer
+from .ml_runtime import load_artifact
+from .ml_training import build_shards, evaluate_streaming, train_streaming
 
 logger = logging.getLogger(__name__)
 
+def _tf():
+    """Import TensorFlow on first use; the numpy runtime never needs it"""
+    import tensorflow as tf
+    return tf
+
 class WAFMLModel:
     def __init__(self):
         self.model = None
-        self.tokenizer = tf.keras.preprocessing.text.Tokenizer(num_words=10000, oov_token="<OOV>")
         self.max_sequence_length = 1000
         self.embedding_dim = 64
+        self.featurizer = HashingFeaturizer(num_buckets=10000, max_length=self.max_sequence_length)
         self.model_path = settings.ML_MODEL_PATH
-        self.tokenizer_path = self.model_path.replace(".h5", "_tokenizer.json")
+        self.featurizer_path = self.model_path.replace(".h5", "_featurizer.json")
+        self.artifact_path = settings.ML_ARTIFACT_PATH
+        self.runtime = settings.ML_RUNTIME
+        self.version = None
+        self.enabled = True  # False: a model that cannot be served on hashed features was loaded
+        self._from_file = False
 
         self._load_model()
+        self._update_version()
+
+    def _update_version(self):
+        """
+        Tag the loaded weights so cached verdicts can tell when they change.
+        Workers that loaded the same file get the same tag, so they can share
+        cached verdicts; a model built in memory is tagged by its identity.
+        """
+        path = self.artifact_path if self.runtime == "numpy" else self.model_path
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        self.version = (self.runtime, path, mtime, None if self._from_file else id(self.model))
+
+    def _load_artifact(self) -> bool:
+        """Load the exported numpy artifact; returns False if it is unavailable"""
+        try:
+            self.model, self.featurizer = load_artifact(self.artifact_path)
+            self._from_file = True
+            logger.info("✅ Loaded numpy ML runtime artifact.")
+            return True
+        except Exception as e:
+            logger.error(f"⚠️ Error loading ML artifact, falling back to Keras: {str(e)}")
+            self.runtime = "keras"
+            return False
 
     def _load_model(self):
-        """Load model and tokenizer if available, otherwise create a new one"""
+        """Load model and featurizer settings if available, otherwise create a new model"""
+        if self.runtime == "numpy" and self._load_artifact():
+            return
+
+        tf = _tf()
         try:
             if os.path.exists(self.model_path):
                 self.model = tf.keras.models.load_model(self.model_path)
+                self._from_file = True
                 logger.info("✅ Loaded existing ML model.")
             else:
                 logger.info("🔄 No model found. Creating new model.")
                 self._create_model()
 
-            if os.path.exists(self.tokenizer_path):
-                with open(self.tokenizer_path, "r") as f:
-                    self.tokenizer = tf.keras.preprocessing.text.tokenizer_from_json(f.read())
-                logger.info("✅ Loaded existing tokenizer.")
+            if os.path.exists(self.featurizer_path):
+                with open(self.featurizer_path, "r") as f:
+                    self.featurizer = HashingFeaturizer.from_json(f.read())
+            elif self._from_file:
+                # Without its featurizer file the model was not trained on hashed
+                # features (older models read Keras Tokenizer ids), so its scores
+                # on them would be meaningless
+                self.enabled = False
+                logger.error(
+                    f"⚠️ ML model {self.model_path} has no featurizer file {self.featurizer_path}; "
+                    "ML detection is off until a model trained on hashed features is saved with it."
+                )
         except Exception as e:
             logger.error(f"⚠️ Error loading ML model: {str(e)}")
             self._create_model()
 
     def _create_model(self):
         """Create a CNN-LSTM based model for HTTP request anomaly detection"""
+        tf = _tf()
+        self._from_file = False
         self.model = tf.keras.Sequential([
             tf.keras.layers.Embedding(input_dim=10000, output_dim=self.embedding_dim, input_length=self.max_sequence_length),
             tf.keras.layers.Conv1D(64, 5, activation='relu'),
@@ -57,31 +106,18 @@ class WAFMLModel:
 
     def _preprocess_request(self, request_data: Dict) -> np.ndarray:
         """Convert request data to model input format"""
-        request_str = json.dumps({
-            'method': request_data.get('method', ''),
-            'path': request_data.get('path', ''),
-            'headers': request_data.get('headers', {}),
-            'query_params': request_data.get('query_params', {}),
-            'body': request_data.get('body', '')
-        })
-
-        if not self.tokenizer.word_index:
-            self.tokenizer.fit_on_texts([request_str])  # Fit only if untrained
+        return self.featurizer.transform_requests([request_data])
 
-        sequence = self.tokenizer.texts_to_sequences([request_str])
-
-        # Pad sequence
-        padded = tf.keras.preprocessing.sequence.pad_sequences(
-            sequence, maxlen=self.max_sequence_length, padding='post', truncating='post'
-        )
-        return padded
+    def _preprocess_batch(self, batch: List[Dict]) -> np.ndarray:
+        """Convert a batch of requests to model input in one pass"""
+        return self.featurizer.transform_requests(batch)
 
     def predict(self, request_data: Dict) -> Tuple[bool, float]:
         """
         Predict if a request is malicious
         Returns: (is_malicious, confidence)
         """
-        if not settings.ENABLE_ML_DETECTION:
+        if not settings.ENABLE_ML_DETECTION or not self.enabled:
             return False, 0.0
 
         try:
@@ -98,21 +134,49 @@ class WAFMLModel:
             logger.error(f"⚠️ Error in ML prediction: {str(e)}")
             return False, 0.0
 
+    def predict_batch(self, batch: List[Dict]) -> List[Tuple[bool, float]]:
+        """
+        Predict a batch of requests with a single forward pass
+        Returns: [(is_malicious, confidence), ...] in input order
+        """
+        if not settings.ENABLE_ML_DETECTION or not self.enabled:
+            return [(False, 0.0)] * len(batch)
+
+        try:
+            input_data = self._preprocess_batch(batch)
+            predictions = np.asarray(self.model.predict_on_batch(input_data)).reshape(-1)
+
+            results = []
+            for prediction in predictions:
+                is_malicious = prediction >= settings.PREDICTION_THRESHOLD
+                if is_malicious:
+                    logger.warning(f"🚨 ML model detected malicious request with {prediction:.2%} confidence")
+                results.append((bool(is_malicious), float(prediction)))
+            return results
+
+        except Exception as e:
+            logger.error(f"⚠️ Error in batched ML prediction: {str(e)}")
+            return [(False, 0.0)] * len(batch)
+
+    def warm_up(self):
+        """Run one prediction so the first request does not pay for lazy initialization"""
+        self.predict_batch([{"method": "GET", "path": "/", "headers": {}, "query_params": {}, "body": ""}])
+
     def train(self, training_data: List[Dict], labels: List[int], epochs: int = 10, batch_size: int = 32):
         """Train the model on new data"""
+        if self.runtime == "numpy":
+            logger.error("⚠️ Training needs the Keras runtime; set ML_RUNTIME=keras.")
+            return None
+
         try:
-            processed_data = np.vstack([self._preprocess_request(req) for req in training_data])
+            processed_data = self._preprocess_batch(training_data)
             labels = np.array(labels)
 
             history = self.model.fit(
                 processed_data, labels, epochs=epochs, batch_size=batch_size, validation_split=0.2, verbose=1
             )
 
-            # Save model & tokenizer
-            self.model.save(self.model_path)
-            with open(self.tokenizer_path, "w") as f:
-                f.write(self.tokenizer.to_json())
-
+            self._save()
             logger.info("✅ Model training completed successfully.")
             return history.history
 
@@ -120,10 +184,43 @@ class WAFMLModel:
             logger.error(f"⚠️ Error training model: {str(e)}")
             return None
 
+    def train_stream(self, paths: Sequence[str], epochs: int = 10, batch_size: int = 32,
+                     validation_split: float = 0.2, label_field: str = "label", workers: int = None):
+        """
+        Train on labeled request logs streamed from disk (see ml_training)
+        Returns: the training history, with ``samples_per_second`` per epoch
+        """
+        if self.runtime == "numpy":
+            logger.error("⚠️ Training needs the Keras runtime; set ML_RUNTIME=keras.")
+            return None
+
+        try:
+            shard_set = build_shards(paths, self.featurizer.to_json(), label_field, workers=workers)
+            history = train_streaming(
+                self.model, shard_set, epochs=epochs, batch_size=batch_size, validation_split=validation_split
+            )
+
+            self._save()
+            logger.info("✅ Model training completed successfully.")
+            return history
+
+        except Exception as e:
+            logger.error(f"⚠️ Error training model: {str(e)}")
+            return None
+
+    def _save(self):
+        """Save model & featurizer settings"""
+        self.model.save(self.model_path)
+        self._from_file = True
+        with open(self.featurizer_path, "w") as f:
+            f.write(self.featurizer.to_json())
+        self.enabled = True  # now trained on the hashed features saved with it
+        self._update_version()
+
     def evaluate(self, test_data: List[Dict], labels: List[int]) -> Dict:
         """Evaluate model performance on test data"""
         try:
-            processed_data = np.vstack([self._preprocess_request(req) for req in test_data])
+            processed_data = self._preprocess_batch(test_data)
             labels = np.array(labels)
 
             loss, accuracy = self.model.evaluate(processed_data, labels, verbose=0)
@@ -133,3 +230,13 @@ class WAFMLModel:
         except Exception as e:
             logger.error(f"⚠️ Error evaluating model: {str(e)}")
             return None
+
+    def evaluate_stream(self, paths: Sequence[str], label_field: str = "label", workers: int = None) -> Dict:
+        """Evaluate model performance on labeled request logs streamed from disk"""
+        try:
+            shard_set = build_shards(paths, self.featurizer.to_json(), label_field, workers=workers)
+            return evaluate_streaming(self.model, shard_set)
+
+        except Exception as e:
+            logger.error(f"⚠️ Error evaluating model: {str(e)}")
+            return None
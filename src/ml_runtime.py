@@ -0,0 +1,215 @@
+"""
+TensorFlow-free inference runtime for the WAF CNN-LSTM model.
+
+``export_artifact`` converts the trained Keras model and its featurizer
+settings into one ``.npz`` file. ``CompactModel`` loads that file and
+reproduces the Keras forward pass with NumPy only, and the featurizer is
+NumPy already, so a worker serving predictions never imports TensorFlow.
+
+Export from the command line:
+    python -m src.ml_runtime --model models/waf_model.h5 --output models/waf_model.npz
+"""
+import argparse
+import json
+import logging
+from typing import Dict, List, Optional
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from .featurizer import HashingFeaturizer
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_LAYERS = ("Embedding", "Conv1D", "MaxPooling1D", "LSTM", "Dense", "Dropout")
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # Overflow-free form of 1 / (1 + exp(-x))
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+_ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": _sigmoid,
+    "tanh": np.tanh,
+}
+
+
+class CompactModel:
+    """NumPy forward pass over an exported Embedding/Conv1D/LSTM/Dense stack"""
+
+    def __init__(self, layers: List[Dict], weights: Dict[str, np.ndarray]):
+        self.layers = layers
+        self.weights = weights
+
+    @classmethod
+    def load(cls, path: str) -> "CompactModel":
+        with np.load(path, allow_pickle=False) as artifact:
+            layers = json.loads(str(artifact["layers"]))
+            weights = {name: artifact[name] for name in artifact.files if name not in ("layers", "featurizer")}
+        return cls(layers, weights)
+
+    def _weight(self, index: int, name: str) -> Optional[np.ndarray]:
+        return self.weights.get(f"{index}_{name}")
+
+    def _conv1d(self, x, index, layer):
+        kernel, bias = self._weight(index, "kernel"), self._weight(index, "bias")
+        windows = sliding_window_view(x, kernel.shape[0], axis=1)  # (batch, steps, channels, width)
+        out = np.einsum("btcw,wco->bto", windows, kernel, optimize=True)
+        if bias is not None:
+            out = out + bias
+        return _ACTIVATIONS[layer["activation"]](out)
+
+    def _max_pooling1d(self, x, layer):
+        windows = sliding_window_view(x, layer["pool_size"], axis=1)[:, ::layer["strides"]]
+        return windows.max(axis=-1)
+
+    def _lstm(self, x, index, layer):
+        kernel, recurrent = self._weight(index, "kernel"), self._weight(index, "recurrent_kernel")
+        bias = self._weight(index, "bias")
+        activation = _ACTIVATIONS[layer["activation"]]
+        recurrent_activation = _ACTIVATIONS[layer["recurrent_activation"]]
+        units = layer["units"]
+
+        inputs = x @ kernel  # input projection for every step at once
+        if bias is not None:
+            inputs = inputs + bias
+        h = np.zeros((x.shape[0], units), dtype=x.dtype)
+        c = np.zeros_like(h)
+        outputs = []
+        for step in range(x.shape[1]):
+            z = inputs[:, step] + h @ recurrent
+            i = recurrent_activation(z[:, :units])
+            f = recurrent_activation(z[:, units:2 * units])
+            g = activation(z[:, 2 * units:3 * units])
+            o = recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * activation(c)
+            if layer["return_sequences"]:
+                outputs.append(h)
+        return np.stack(outputs, axis=1) if layer["return_sequences"] else h
+
+    def _dense(self, x, index, layer):
+        out = x @ self._weight(index, "kernel")
+        bias = self._weight(index, "bias")
+        if bias is not None:
+            out = out + bias
+        return _ACTIVATIONS[layer["activation"]](out)
+
+    def predict_on_batch(self, input_data: np.ndarray) -> np.ndarray:
+        x = np.asarray(input_data)
+        for index, layer in enumerate(self.layers):
+            kind = layer["type"]
+            if kind == "Embedding":
+                x = self._weight(index, "embeddings")[x]
+            elif kind == "Conv1D":
+                x = self._conv1d(x, index, layer)
+            elif kind == "MaxPooling1D":
+                x = self._max_pooling1d(x, layer)
+            elif kind == "LSTM":
+                x = self._lstm(x, index, layer)
+            elif kind == "Dense":
+                x = self._dense(x, index, layer)
+        return x
+
+    def predict(self, input_data: np.ndarray, verbose: int = 0) -> np.ndarray:
+        """Same call shape as keras Model.predict"""
+        return self.predict_on_batch(input_data)
+
+
+def _layer_spec(layer) -> Dict:
+    """Describe a Keras layer with the config the NumPy forward pass needs"""
+    kind = layer.__class__.__name__
+    config = layer.get_config()
+    if kind not in SUPPORTED_LAYERS:
+        raise ValueError(f"Unsupported layer for export: {kind}")
+
+    spec = {"type": kind}
+    if kind == "Conv1D":
+        if config["padding"] != "valid" or tuple(config["strides"]) != (1,) or tuple(config["dilation_rate"]) != (1,):
+            raise ValueError("Only valid-padded, unit-stride Conv1D layers can be exported")
+        spec["activation"] = config["activation"]
+    elif kind == "MaxPooling1D":
+        if config["padding"] != "valid":
+            raise ValueError("Only valid-padded MaxPooling1D layers can be exported")
+        pool_size = config["pool_size"]
+        strides = config["strides"] or pool_size
+        spec["pool_size"] = pool_size[0] if isinstance(pool_size, (list, tuple)) else pool_size
+        spec["strides"] = strides[0] if isinstance(strides, (list, tuple)) else strides
+    elif kind == "LSTM":
+        spec.update(
+            units=config["units"],
+            activation=config["activation"],
+            recurrent_activation=config["recurrent_activation"],
+            return_sequences=config["return_sequences"],
+        )
+    elif kind == "Dense":
+        spec["activation"] = config["activation"]
+    return spec
+
+
+_WEIGHT_NAMES = {
+    "Embedding": ("embeddings",),
+    "Conv1D": ("kernel", "bias"),
+    "LSTM": ("kernel", "recurrent_kernel", "bias"),
+    "Dense": ("kernel", "bias"),
+}
+
+
+def export_artifact(model, featurizer_json: str, output_path: str, verify_samples: int = 8,
+                    atol: float = 1e-4) -> float:
+    """
+    Write a Keras model and its featurizer settings to a compact ``.npz`` artifact.
+
+    The exported forward pass is checked against Keras on random token
+    sequences before the file is written; a difference larger than ``atol``
+    raises ValueError. Returns the largest difference seen.
+    """
+    layers, arrays = [], {}
+    for index, layer in enumerate(model.layers):
+        layers.append(_layer_spec(layer))
+        for name, value in zip(_WEIGHT_NAMES.get(layers[-1]["type"], ()), layer.get_weights()):
+            arrays[f"{index}_{name}"] = np.asarray(value, dtype=np.float32)
+
+    compact = CompactModel(layers, arrays)
+    vocabulary_size = arrays["0_embeddings"].shape[0]
+    sequence_length = model.input_shape[1]
+    samples = np.random.default_rng(0).integers(0, vocabulary_size, size=(verify_samples, sequence_length))
+    expected = np.asarray(model.predict(samples, verbose=0))
+    difference = float(np.max(np.abs(compact.predict_on_batch(samples) - expected)))
+    if difference > atol:
+        raise ValueError(f"Exported model differs from Keras by {difference:.2e} (atol {atol:.0e})")
+
+    np.savez(output_path, layers=np.array(json.dumps(layers)), featurizer=np.array(featurizer_json), **arrays)
+    logger.info(f"✅ Exported ML model to {output_path} (max difference {difference:.2e}).")
+    return difference
+
+
+def load_artifact(path: str):
+    """Load an exported artifact. Returns: (CompactModel, HashingFeaturizer)"""
+    with np.load(path, allow_pickle=False) as artifact:
+        if "featurizer" not in artifact.files:
+            raise ValueError("Artifact was exported with a Keras Tokenizer; retrain and export it again")
+        featurizer = HashingFeaturizer.from_json(str(artifact["featurizer"]))
+    return CompactModel.load(path), featurizer
+
+
+def main():
+    import tensorflow as tf
+
+    parser = argparse.ArgumentParser(description="Export the WAF model to a TensorFlow-free artifact")
+    parser.add_argument("--model", required=True, help="Trained Keras model (.h5)")
+    parser.add_argument("--featurizer", help="Featurizer JSON (default: <model>_featurizer.json)")
+    parser.add_argument("--output", required=True, help="Artifact path (.npz)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    featurizer_path = args.featurizer or args.model.replace(".h5", "_featurizer.json")
+    with open(featurizer_path, "r") as f:
+        featurizer_json = f.read()
+    model = tf.keras.models.load_model(args.model)
+    export_artifact(model, featurizer_json, args.output)
+
+
+if __name__ == "__main__":
+    main()
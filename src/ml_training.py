@@ -0,0 +1,307 @@
+"""
+Streaming, sharded training pipeline for the WAF model.
+
+Labeled request logs (JSON lines, optionally ``.gz``, ``.bz2`` or ``.xz``)
+are read line by line and handed in chunks to worker processes, which parse
+and featurize them and write each chunk to an ``.npz`` shard on disk.
+Training then streams the shards through a bounded shuffle buffer into a
+``tf.data`` pipeline, so the training set never has to fit in memory.
+
+Shards are cached under a key of the input files and the featurizer
+settings: later epochs read them back from disk, and a later run over the
+same logs skips preprocessing altogether.
+
+Each line is a JSON request dump (``method``, ``path``, ``headers``,
+``query_params`` and ``body``) plus a 0/1 label field. The WAF's own
+access and error logs are not valid input: RequestLogger never writes the
+body, and a model trained without bodies would not see the payloads it is
+served. Lines without the label or without a ``body`` field are skipped
+and counted.
+
+Train from the command line:
+    python -m src.ml_training logs/labeled/*.jsonl.gz --epochs 5
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from .config import settings
+from .featurizer import HashingFeaturizer
+from .log_files import imap_bounded, iter_chunks, iter_lines
+
+logger = logging.getLogger(__name__)
+
+# Shard = (path, rows)
+Shard = Tuple[str, int]
+
+# Part of the shard cache key; bump it when what a shard holds for the same logs changes
+SHARD_FORMAT = 2
+
+
+def iter_labeled(lines: Iterator[str], label_field: str = "label") -> Iterator[Tuple[Dict, float]]:
+    """Parse request dumps into (request_data, label), skipping malformed lines and ones without a label or body"""
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get(label_field) is not None and "body" in record:
+            yield record, float(record[label_field])
+
+
+# Worker process state, set up once by _init_worker
+_featurizer: Optional[HashingFeaturizer] = None
+_label_field = "label"
+_dtype = np.int32
+
+
+def _init_worker(featurizer_json: str, label_field: str):
+    global _featurizer, _label_field, _dtype
+    _featurizer = HashingFeaturizer.from_json(featurizer_json)
+    _label_field = label_field
+    _dtype = np.min_scalar_type(_featurizer.num_buckets)
+
+
+def _encode_shard(path: str, lines: List[str]) -> Tuple[str, int, int]:
+    """Parse and featurize lines into an .npz shard (runs in a worker). Returns: (path, rows, skipped)"""
+    labeled = list(iter_labeled(lines, _label_field))
+    if not labeled:
+        return path, 0, len(lines)
+    x = _featurizer.transform_requests([request for request, _ in labeled]).astype(_dtype)
+    y = np.array([label for _, label in labeled], dtype=np.float32)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, x=x, y=y)
+    os.replace(path + ".tmp", path)
+    return path, len(labeled), len(lines) - len(labeled)
+
+
+class ShardSet:
+    """Featurized shards of one set of logs, in file order"""
+
+    def __init__(self, directory: str, shards: List[Shard], maxlen: int):
+        self.directory = directory
+        self.shards = shards
+        self.maxlen = maxlen
+
+    @property
+    def rows(self) -> int:
+        return sum(rows for _, rows in self.shards)
+
+    def split(self, validation_split: float) -> Tuple[List[Shard], List[Shard]]:
+        """Hold out the last shards for validation, like Keras' validation_split holds out the last rows"""
+        if validation_split <= 0 or len(self.shards) < 2:
+            return self.shards, []
+        held_out = min(len(self.shards) - 1, max(1, round(len(self.shards) * validation_split)))
+        return self.shards[:-held_out], self.shards[-held_out:]
+
+
+def _cache_key(paths: Sequence[str], featurizer_json: str, label_field: str, shard_size: int) -> str:
+    files = []
+    for path in paths:
+        stat = os.stat(path)
+        files.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    key = json.dumps([SHARD_FORMAT, files, label_field, shard_size]) + featurizer_json
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def build_shards(paths: Sequence[str], featurizer_json: str, label_field: str = "label",
+                 cache_dir: str = None, shard_size: int = None, workers: int = None) -> ShardSet:
+    """
+    Featurize the logs into cached shards, or reuse the shards of an earlier run.
+
+    The parent only reads raw lines; parsing, featurizing and writing happen
+    in ``workers`` processes. At most two chunks per worker are in flight,
+    so memory stays bounded however large the logs are. The manifest is
+    written last, so an interrupted run is redone rather than reused.
+    """
+    cache_dir = cache_dir or settings.ML_TRAINING_CACHE_DIR
+    shard_size = shard_size or settings.ML_TRAINING_SHARD_SIZE
+    workers = workers or settings.ML_TRAINING_WORKERS or os.cpu_count() or 1
+    maxlen = HashingFeaturizer.from_json(featurizer_json).max_length
+    directory = os.path.join(cache_dir, _cache_key(paths, featurizer_json, label_field, shard_size))
+    manifest_path = os.path.join(directory, "manifest.json")
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        shards = [(os.path.join(directory, name), rows) for name, rows in manifest["shards"]]
+        logger.info(f"✅ Reusing {len(shards)} cached training shards in {directory}.")
+        return ShardSet(directory, shards, maxlen)
+
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    names, shards, skipped = [], [], 0
+    chunks = (
+        (os.path.join(directory, f"shard-{index:05d}.npz"), lines)
+        for index, lines in enumerate(iter_chunks(iter_lines(paths), shard_size))
+    )
+
+    # spawn: the caller may be running threads (TensorFlow's among them)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(featurizer_json, label_field)
+    ) as executor:
+        # At most two chunks per worker in flight
+        for path, rows, dropped in imap_bounded(executor, _encode_shard, chunks, 2 * workers):
+            skipped += dropped
+            if rows:
+                names.append((os.path.basename(path), rows))
+                shards.append((path, rows))
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"shards": names, "skipped": skipped}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    shard_set = ShardSet(directory, shards, maxlen)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"✅ Featurized {shard_set.rows} requests into {len(shards)} shards in {elapsed:.1f}s "
+        f"({shard_set.rows / max(elapsed, 1e-9):.0f} samples/s, {skipped} lines skipped)."
+    )
+    return shard_set
+
+
+def _load(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    with np.load(path, allow_pickle=False) as shard:
+        return shard["x"].astype(np.int32), shard["y"]
+
+
+def shuffled_batches(shards: List[Shard], batch_size: int, buffer_size: int,
+                     seed: int = 0) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield shuffled batches with at most ``buffer_size`` rows held back.
+
+    Shards are visited in random order. Each one is merged into the buffer,
+    the buffer is permuted, and whole batches are taken off the front until
+    only ``buffer_size`` rows remain; the rest are flushed at the end.
+    """
+    rng = np.random.default_rng(seed)
+    buffer_x = buffer_y = None
+    for index in rng.permutation(len(shards)):
+        x, y = _load(shards[index][0])
+        if buffer_x is not None:
+            x, y = np.concatenate([buffer_x, x]), np.concatenate([buffer_y, y])
+        order = rng.permutation(len(x))
+        x, y = x[order], y[order]
+        ready = max(0, len(x) - buffer_size) // batch_size * batch_size
+        for start in range(0, ready, batch_size):
+            yield x[start:start + batch_size], y[start:start + batch_size]
+        buffer_x, buffer_y = x[ready:], y[ready:]
+
+    if buffer_x is not None:
+        for start in range(0, len(buffer_x), batch_size):
+            yield buffer_x[start:start + batch_size], buffer_y[start:start + batch_size]
+
+
+def sequential_batches(shards: List[Shard], batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    for path, _ in shards:
+        x, y = _load(path)
+        for start in range(0, len(x), batch_size):
+            yield x[start:start + batch_size], y[start:start + batch_size]
+
+
+def _dataset(tf, batches, maxlen: int):
+    """Wrap a batch generator factory in a prefetching tf.data pipeline"""
+    return tf.data.Dataset.from_generator(
+        batches,
+        output_signature=(
+            tf.TensorSpec(shape=(None, maxlen), dtype=tf.int32),
+            tf.TensorSpec(shape=(None,), dtype=tf.float32),
+        )
+    ).prefetch(tf.data.AUTOTUNE)
+
+
+def _throughput_callback(tf, samples_per_epoch: int):
+    class Throughput(tf.keras.callbacks.Callback):
+        """Log training samples per second for every epoch"""
+
+        def __init__(self):
+            super().__init__()
+            self.rates = []
+            self._start = 0.0
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self._start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            rate = samples_per_epoch / max(time.perf_counter() - self._start, 1e-9)
+            self.rates.append(rate)
+            logger.info(f"Epoch {epoch + 1}: {rate:.0f} samples/s")
+
+    return Throughput()
+
+
+def train_streaming(model, shard_set: ShardSet, epochs: int = 10, batch_size: int = 32,
+                    validation_split: float = 0.2, shuffle_buffer: int = None, seed: int = 0) -> Dict:
+    """Fit a compiled Keras model on a ShardSet; returns its history plus ``samples_per_second``"""
+    import tensorflow as tf
+
+    shuffle_buffer = shuffle_buffer or settings.ML_TRAINING_SHUFFLE_BUFFER
+    train_shards, validation_shards = shard_set.split(validation_split)
+    epoch_seeds = itertools.count(seed)
+
+    def training_batches():
+        # A new shuffle order every epoch
+        return shuffled_batches(train_shards, batch_size, shuffle_buffer, next(epoch_seeds))
+
+    validation_data = None
+    if validation_shards:
+        validation_data = _dataset(tf, lambda: sequential_batches(validation_shards, batch_size), shard_set.maxlen)
+
+    throughput = _throughput_callback(tf, sum(rows for _, rows in train_shards))
+    history = model.fit(
+        _dataset(tf, training_batches, shard_set.maxlen),
+        epochs=epochs,
+        validation_data=validation_data,
+        callbacks=[throughput],
+        verbose=1
+    )
+    history.history["samples_per_second"] = throughput.rates
+    return history.history
+
+
+def evaluate_streaming(model, shard_set: ShardSet, batch_size: int = 256) -> Dict:
+    import tensorflow as tf
+
+    loss, accuracy = model.evaluate(
+        _dataset(tf, lambda: sequential_batches(shard_set.shards, batch_size), shard_set.maxlen), verbose=0
+    )
+    return {"loss": float(loss), "accuracy": float(accuracy)}
+
+
+def main():
+    from .ml_model import WAFMLModel
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Labeled request logs (.jsonl, .gz, .bz2, .xz)")
+    parser.add_argument("--label-field", default="label")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--validation-split", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, help="Preprocessing processes (default: ML_TRAINING_WORKERS)")
+    parser.add_argument("--evaluate", nargs="+", metavar="PATH", help="Held-out logs to evaluate on afterwards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    model = WAFMLModel()
+    history = model.train_stream(
+        args.paths, epochs=args.epochs, batch_size=args.batch_size,
+        validation_split=args.validation_split, label_field=args.label_field, workers=args.workers
+    )
+    if history is None:
+        raise SystemExit(1)
+    if args.evaluate:
+        print(json.dumps(model.evaluate_stream(args.evaluate, label_field=args.label_field, workers=args.workers)))
+
+
+if __name__ == "__main__":
+    main()
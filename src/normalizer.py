@@ -0,0 +1,50 @@
+import functools
+import html
+import re
+import unicodedata
+from urllib.parse import unquote
+from .config import settings
+
+_WHITESPACE = re.compile(r"[^\S\r\n]+")  # runs of whitespace other than line breaks
+
+
+class RequestNormalizer:
+    """
+    Reduce a field value to the canonical form the rules are written against.
+
+    Up to ``max_rounds`` rounds of NFKC, HTML entity decoding and URL decoding
+    run until the value stops changing, so double-encoded payloads such as
+    ``%252e%252e%252f`` come out as ``../``. A value the server already
+    URL-decoded once (a query parameter) starts at the second round. Null
+    bytes are then removed, runs of spaces and tabs collapsed to one space
+    (line breaks are kept, for the rules that look for them) and the result
+    case-folded. Short values are memoized, since headers and parameters
+    repeat across requests.
+    """
+
+    def __init__(self, max_rounds: int = None, cache_size: int = None, memo_max_length: int = None):
+        self.max_rounds = max_rounds or settings.NORMALIZE_MAX_DECODE_ROUNDS
+        self.memo_max_length = memo_max_length or settings.NORMALIZE_MEMO_MAX_LENGTH
+        self._memoized = functools.lru_cache(maxsize=cache_size or settings.NORMALIZE_CACHE_SIZE)(self._normalize)
+
+    def _decode(self, value: str, url_decoded: bool) -> str:
+        for _ in range(1 if url_decoded else 0, self.max_rounds):
+            if value.isascii() and "%" not in value and "&" not in value:
+                break
+            decoded = unquote(html.unescape(unicodedata.normalize("NFKC", value)), errors="replace")
+            if decoded == value:
+                break
+            value = decoded
+        return value
+
+    def _normalize(self, value: str, url_decoded: bool = False) -> str:
+        value = self._decode(value, url_decoded)
+        if "\x00" in value:
+            value = value.replace("\x00", "")
+        return _WHITESPACE.sub(" ", value).casefold()
+
+    def normalize(self, value: str, url_decoded: bool = False) -> str:
+        """Return the canonical form of a field value (``url_decoded``: already URL-decoded once)"""
+        if len(value) <= self.memo_max_length:
+            return self._memoized(value, url_decoded)
+        return self._normalize(value, url_decoded)
@@ -0,0 +1,149 @@
+"""
+Pre-fork serving: load once in a master process, then fork the workers.
+
+uvicorn's ``workers`` option starts every worker as a fresh interpreter, so
+each one imports the stack, compiles the rules, builds the IP index and
+loads the model on its own. With PREFORK the master does that once, runs a
+warm-up prediction, binds the listening socket and forks WORKERS children.
+The children inherit the loaded state and share its memory pages
+copy-on-write; each builds only its per-process parts (threads, queues,
+connection pools) when the app starts.
+
+Only the numpy runtime is loaded before forking: TensorFlow does not
+survive fork, so with ML_RUNTIME=keras every worker loads its own model.
+
+Enabled with PREFORK=True when starting the WAF (python -m src.main).
+"""
+import gc
+import logging
+import os
+import signal
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from .config import settings
+from .ip_reputation import IPReputationIndex, load_index
+from .metrics import mark_worker_dead, reset_multiprocess_dir
+from .ml_model import WAFMLModel
+from .routes import route_table
+from .rule_sets import RuleSet, initial_rule_set
+
+logger = logging.getLogger(__name__)
+
+# A worker that exits this soon after being forked failed to start; it is not restarted
+MIN_WORKER_LIFETIME = 5.0  # seconds
+
+
+@dataclass(frozen=True)
+class Preloaded:
+    """State the master loaded before forking; None where a worker loads its own"""
+    rule_set: Optional[RuleSet] = None
+    ip_index: Optional[IPReputationIndex] = None
+    ml_model: Optional[WAFMLModel] = None
+
+
+_preloaded = Preloaded()
+
+
+def preloaded() -> Preloaded:
+    """What this process inherited from the pre-fork master (all None otherwise)"""
+    return _preloaded
+
+
+def _preload_model() -> Optional[WAFMLModel]:
+    if settings.ML_RUNTIME != "numpy" or not os.path.exists(settings.ML_ARTIFACT_PATH):
+        logger.info("ML model is loaded per worker (pre-fork loading needs the numpy runtime artifact).")
+        return None
+    model = WAFMLModel()
+    if model.runtime != "numpy":
+        logger.warning("⚠️ ML artifact did not load; every worker will load its own model.")
+        return None
+    model.warm_up()
+    return model
+
+
+def preload() -> Preloaded:
+    """Compile the rules, build the IP index and load the model in this process"""
+    global _preloaded
+    start = time.perf_counter()
+    rule_set = initial_rule_set()
+    ip_index = load_index(settings.IP_INDEX_PATH)
+    route_table()
+    _preloaded = Preloaded(rule_set, ip_index, _preload_model())
+    logger.info(f"✅ Preloaded rules, IP index and ML model in {time.perf_counter() - start:.2f}s.")
+    return _preloaded
+
+
+def _run_worker(config, sock):
+    import uvicorn
+
+    # The master's handlers forward signals to the workers; a worker uses uvicorn's
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+    status = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        logger.exception("WAF worker crashed")
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(app: str = "src.main:app", workers: int = None):
+    """Preload, bind, fork ``workers`` processes and restart any that die, until SIGINT/SIGTERM"""
+    import uvicorn
+
+    workers = workers or settings.WORKERS
+    reset_multiprocess_dir()
+    preload()
+    config = uvicorn.Config(app, host=settings.HOST, port=settings.PORT, lifespan="on")
+    config.load()  # import the app here too, so the workers share its modules
+    sock = config.bind_socket()
+
+    # Move everything loaded so far out of the collector's reach, so collections
+    # in the workers do not write to (and so copy) the shared pages
+    gc.freeze()
+
+    children: Dict[int, float] = {}
+    stopping = False
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(config, sock)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        fork_worker()
+    logger.info(f"Forked {workers} WAF workers on {settings.HOST}:{settings.PORT} (master {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None:
+            continue
+        mark_worker_dead(pid)
+        if stopping:
+            continue
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            logger.error(f"WAF worker {pid} exited during startup (status {status}); shutting down.")
+            stop(signal.SIGTERM, None)
+            continue
+        logger.warning(f"WAF worker {pid} exited (status {status}); starting a new one.")
+        fork_worker()
+    sock.close()
@@ -1,4 +1,15 @@
+import asyncio
+import logging
+import math
+import struct
+import time
+from typing import Optional
 import redis
+import redis.asyncio as aioredis
+from .config import settings
+from .shared_state import SharedTable, shared_table
+
+logger = logging.getLogger(__name__)
 
 class RateLimiter:
     """Rate limiter using Redis"""
@@ -18,3 +29,292 @@ class RateLimiter:
         self.redis_client.incr(key, 1)
         self.redis_client.expire(key, self.window)
         return False
+
+
+# KEYS[1] bucket key; ARGV: refill rate (tokens/s), capacity, now (s), ttl (ms)
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return allowed
+"""
+
+
+def create_redis_pool() -> aioredis.ConnectionPool:
+    """Create the shared asyncio Redis connection pool"""
+    return aioredis.ConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS
+    )
+
+
+class AsyncRateLimiter:
+    """
+    Token-bucket rate limiter on redis.asyncio.
+
+    Each IP gets a bucket of ``burst`` tokens refilled at ``rate`` tokens per
+    minute, so a client may send ``burst`` requests at once and then
+    ``rate`` per minute. Refill and take run in one Lua script, which makes a
+    check a single atomic round trip.
+    """
+
+    def __init__(self, redis_client: aioredis.Redis, rate: int = None, burst: int = None):
+        self.redis_client = redis_client
+        self.rate = rate if rate is not None else settings.RATE_LIMIT
+        self.burst = burst if burst is not None else settings.RATE_LIMIT_BURST
+        self.refill_per_second = self.rate / 60.0
+        # A bucket left alone this long is full again, so Redis can drop it
+        self.ttl_ms = max(1000, math.ceil(self.burst / self.refill_per_second * 1000)) if self.rate else 60_000
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def is_rate_limited(self, ip: str) -> bool:
+        try:
+            allowed = await self._script(
+                keys=[f"rate_limit:{ip}"],
+                args=[self.refill_per_second, self.burst, time.time(), self.ttl_ms]
+            )
+        except redis.RedisError as e:
+            # Fail open: an unreachable Redis must not take the site down
+            logger.error(f"Rate limiter unavailable: {str(e)}")
+            return False
+        return not allowed
+
+
+class _LocalWindow:
+    """Sliding-window state for one IP on one worker"""
+    __slots__ = ("window", "count", "previous", "pending", "last_seen")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.count = 0  # cluster-wide count in the current window, as last seen + local admits
+        self.previous = 0  # cluster-wide count in the previous window
+        self.pending = 0  # local admits not yet flushed to Redis
+        self.last_seen = 0.0
+
+
+class HybridRateLimiter:
+    """
+    Two-tier rate limiter: in-process sliding windows synced to Redis.
+
+    Decisions are made locally with no I/O. Each worker keeps per-IP
+    sliding-window counters in ``shards`` dicts and, every ``sync_interval_ms``,
+    flushes the deltas of the IPs it admitted since the last round to Redis,
+    in pipelines of up to ``sync_batch`` IPs, and reads back their
+    cluster-wide counts, which become the baseline for further local
+    decisions. IPs with nothing new locally are left out of the round.
+
+    Tradeoff: between syncs a worker cannot see what the others admitted, so
+    the cluster may exceed the limit. The excess is bounded by
+    ``max_unsynced``: once a worker has admitted that many unsynced requests
+    for one IP it syncs that IP before answering. With W workers the cluster
+    overshoots by at most W * max_unsynced requests per IP and window. Set
+    ``max_unsynced`` to 1 for exact counting at one round trip per request,
+    or raise it to trade accuracy for latency.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        limit: int = None,
+        window_seconds: int = None,
+        sync_interval_ms: int = None,
+        max_unsynced: int = None,
+        shards: int = None,
+        sync_batch: int = None
+    ):
+        self.redis_client = redis_client
+        self.limit = limit if limit is not None else settings.RATE_LIMIT
+        self.window_seconds = window_seconds or settings.RATE_LIMIT_WINDOW
+        self.sync_interval_ms = sync_interval_ms or settings.RATE_LIMIT_SYNC_INTERVAL_MS
+        self.max_unsynced = max_unsynced or settings.RATE_LIMIT_MAX_UNSYNCED
+        self.shards = [{} for _ in range(shards or settings.RATE_LIMIT_SHARDS)]
+        self.sync_batch = sync_batch or settings.RATE_LIMIT_SYNC_BATCH
+        self._carry = []  # (ip, window, delta) left over when a window rolled before its flush
+        self._sweep_shard = 0
+        self._sync_task = None
+
+    def _key(self, ip: str, window: int) -> str:
+        return f"rate_limit:{ip}:{window}"
+
+    def _shard(self, ip: str) -> dict:
+        return self.shards[hash(ip) % len(self.shards)]
+
+    def _roll(self, ip: str, entry: _LocalWindow, window: int):
+        """Move an entry forward to the given window"""
+        if entry.window == window:
+            return
+        if entry.pending:
+            self._carry.append((ip, entry.window, entry.pending))
+        entry.previous = entry.count if window == entry.window + 1 else 0
+        entry.count = 0
+        entry.pending = 0
+        entry.window = window
+
+    def _estimate(self, entry: _LocalWindow, now: float) -> float:
+        """Sliding-window count: previous window weighted by its remaining overlap"""
+        elapsed = (now % self.window_seconds) / self.window_seconds
+        return entry.previous * (1 - elapsed) + entry.count
+
+    async def is_rate_limited(self, ip: str) -> bool:
+        if self._sync_task is None:
+            self._sync_task = asyncio.ensure_future(self._sync_loop())
+
+        now = time.time()
+        window = int(now // self.window_seconds)
+        shard = self._shard(ip)
+        entry = shard.get(ip)
+        if entry is None:
+            entry = shard[ip] = _LocalWindow(window)
+        self._roll(ip, entry, window)
+        entry.last_seen = now
+
+        if self._estimate(entry, now) >= self.limit:
+            return True
+
+        entry.count += 1
+        entry.pending += 1
+        if entry.pending >= self.max_unsynced:
+            await self._sync([(ip, entry)])
+        return False
+
+    async def _sync(self, entries):
+        """Flush pending deltas and refresh cluster-wide counts in one pipeline"""
+        carry, self._carry = self._carry, []
+        in_flight = []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for ip, window, delta in carry:
+            pipe.incrby(self._key(ip, window), delta)
+            pipe.expire(self._key(ip, window), self.window_seconds * 2)
+        for ip, entry in entries:
+            key = self._key(ip, entry.window)
+            delta, entry.pending = entry.pending, 0
+            in_flight.append((ip, entry, entry.window, delta))
+            if delta:
+                pipe.incrby(key, delta)
+                pipe.expire(key, self.window_seconds * 2)
+            else:
+                pipe.get(key)
+            pipe.get(self._key(ip, entry.window - 1))
+
+        try:
+            results = await pipe.execute()
+        except redis.RedisError as e:
+            # Keep deciding locally; the deltas go out with the next sync
+            logger.error(f"Rate limiter sync failed: {str(e)}")
+            self._carry.extend(carry)
+            for ip, entry, window, delta in in_flight:
+                if entry.window == window:
+                    entry.pending += delta
+                else:
+                    self._carry.append((ip, window, delta))
+            return
+
+        results = iter(results[len(carry) * 2:])
+        for ip, entry, window, delta in in_flight:
+            current = int(next(results) or 0)
+            if delta:
+                next(results)  # EXPIRE
+            previous = int(next(results) or 0)
+            if entry.window == window:
+                # Local admits made while the pipeline was in flight stay on top
+                entry.count = current + entry.pending
+                entry.previous = previous
+
+    def _expire_idle(self, shard: dict, now: float):
+        """Drop IPs idle for two windows with nothing left to flush"""
+        idle_before = now - self.window_seconds * 2
+        for ip in [ip for ip, entry in shard.items() if entry.last_seen < idle_before and not entry.pending]:
+            del shard[ip]
+
+    async def sync(self):
+        """Flush the IPs with pending deltas, in batches, and expire idle IPs in one shard"""
+        now = time.time()
+        window = int(now // self.window_seconds)
+        changed = []
+        for shard in self.shards:
+            for ip, entry in shard.items():
+                self._roll(ip, entry, window)
+                if entry.pending:
+                    changed.append((ip, entry))
+        if not changed and self._carry:
+            await self._sync([])
+        for start in range(0, len(changed), self.sync_batch):
+            await self._sync(changed[start:start + self.sync_batch])
+
+        self._expire_idle(self.shards[self._sweep_shard], now)
+        self._sweep_shard = (self._sweep_shard + 1) % len(self.shards)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval_ms / 1000)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Rate limiter sync loop error: {str(e)}")
+
+    async def close(self):
+        """Stop the background sync and flush what is left"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        await self.sync()
+
+
+_BUCKET = struct.Struct("<dd")  # tokens, last refill (time.monotonic())
+
+
+class SharedMemoryRateLimiter:
+    """
+    Token-bucket rate limiter on a shared-memory table, for a single host.
+
+    Same buckets as AsyncRateLimiter, kept in a SharedTable that every
+    worker on the host maps instead of in Redis: refill and take run under
+    the bucket's stripe lock, with no I/O. A bucket that cannot be stored
+    because its stripe is full fails open, like an unreachable Redis.
+    """
+
+    def __init__(self, table: SharedTable = None, rate: int = None, burst: int = None):
+        self.table = table or shared_table("rate_limit", _BUCKET.size)
+        self.rate = rate if rate is not None else settings.RATE_LIMIT
+        self.burst = burst if burst is not None else settings.RATE_LIMIT_BURST
+        self.refill_per_second = self.rate / 60.0
+        # A bucket left alone this long is full again, so its slot can be reused
+        self.ttl = max(1.0, self.burst / self.refill_per_second) if self.rate else 60.0
+
+    def _take(self, state: Optional[bytes]):
+        now = time.monotonic()
+        tokens, refilled = _BUCKET.unpack(state) if state is not None else (self.burst, now)
+        tokens = min(self.burst, tokens + max(0.0, now - refilled) * self.refill_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        return _BUCKET.pack(tokens, now), allowed
+
+    async def is_rate_limited(self, ip: str) -> bool:
+        return self.table.update(f"rate_limit:{ip}".encode(), self.ttl, self._take) is False
+
+
+def create_rate_limiter(redis_client: aioredis.Redis, rate: int = None, burst: int = None):
+    """
+    Build the rate limiter selected by RATE_LIMIT_MODE (defaults: RATE_LIMIT,
+    RATE_LIMIT_BURST). ``burst`` applies to the token-bucket modes; hybrid
+    mode counts a sliding window, has no burst and logs that it ignores one.
+    """
+    if settings.RATE_LIMIT_MODE == "hybrid":
+        if burst is not None:
+            logger.warning(f"RATE_LIMIT_MODE=hybrid has no burst; ignoring burst={burst} (rate {rate})")
+        return HybridRateLimiter(redis_client, limit=rate)
+    if settings.RATE_LIMIT_MODE == "shared_memory":
+        return SharedMemoryRateLimiter(rate=rate, burst=burst)
+    return AsyncRateLimiter(redis_client, rate=rate, burst=burst)
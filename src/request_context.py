@@ -0,0 +1,257 @@
+"""
+The per-request state every inspection stage shares.
+
+A RequestContext is built from the raw ASGI scope without copying it:
+method, path and client address are references into the scope, and the
+header list and query string stay raw until a stage asks for them. Each
+derived form (header and query pairs, the header and query dicts, the text
+the model reads, its feature row, normalized field values) is computed on
+first use and kept, so the rules, the verdict cache, the model and the
+logger never build the same thing twice for one request.
+
+Repeated query parameters and headers are kept: the pair lists hold every
+value in order, the query dict maps a repeated name to the list of its
+values and the header dict joins repeated headers as RFC 9110 does.
+
+A context also reads like the request dict the stages used to get
+(``request_data["path"]``, ``.get("route_policy")``), and ``as_context``
+wraps a plain dict (a log record, a training sample) in one, so every stage
+takes either.
+"""
+import json
+from typing import Dict, Hashable, List, Mapping, Optional, Tuple, Union
+from urllib.parse import parse_qsl
+
+# Keys readable as request_data[key]; the stages' own results can also be set
+_FIELDS = frozenset({
+    "method", "path", "client_ip", "timestamp", "headers", "query_params", "body",
+    "route_policy", "rule_matches", "rule_scans_skipped", "verdict_cache_key", "budget",
+})
+_SETTABLE = frozenset({"body", "route_policy", "rule_matches", "rule_scans_skipped", "verdict_cache_key", "budget"})
+
+QueryParams = Dict[str, Union[str, List[str]]]
+
+
+def _pairs(mapping: Mapping) -> List[Tuple[str, str]]:
+    """(name, value) pairs of a dict whose values may be lists of values"""
+    pairs = []
+    for name, value in mapping.items():
+        if isinstance(value, list):
+            pairs.extend((name, item) for item in value)
+        else:
+            pairs.append((name, value))
+    return pairs
+
+
+class RequestContext:
+    """Lazily derived view of one request, shared by every inspection stage"""
+
+    __slots__ = (
+        "method", "path", "client_ip", "timestamp", "_body",
+        "route_policy", "rule_matches", "rule_scans_skipped", "verdict_cache_key", "budget",
+        "_raw_headers", "_query_string", "_header_items", "_headers", "_query_items", "_query_params",
+        "_text", "_features", "_normalized",
+    )
+
+    def __init__(self, method: str, path: str, client_ip: Optional[str] = None, timestamp: float = None,
+                 raw_headers: List[Tuple[bytes, bytes]] = (), query_string: bytes = b""):
+        self.method = method
+        self.path = path
+        self.client_ip = client_ip
+        self.timestamp = timestamp
+        self._body = ""
+        self._raw_headers = raw_headers
+        self._query_string = query_string
+        self._header_items: Optional[List[Tuple[str, str]]] = None
+        self._headers: Optional[Dict[str, str]] = None
+        self._query_items: Optional[List[Tuple[str, str]]] = None
+        self._query_params: Optional[QueryParams] = None
+        self._text: Optional[str] = None
+        self._features = None
+        self._normalized: Optional[Dict[Tuple[str, bool], str]] = None
+
+    @classmethod
+    def from_scope(cls, scope: Mapping, timestamp: float = None) -> "RequestContext":
+        client = scope.get("client")
+        return cls(
+            scope["method"], scope["path"], client[0] if client else None, timestamp,
+            scope.get("headers", ()), scope.get("query_string", b"")
+        )
+
+    @classmethod
+    def from_dict(cls, request_data: Mapping) -> "RequestContext":
+        """Wrap a request dict (``method``, ``path``, ``headers``, ``query_params``, ``body``, ...)"""
+        context = cls(
+            request_data.get("method", ""), request_data.get("path", ""),
+            request_data.get("client_ip"), request_data.get("timestamp")
+        )
+        context.body = request_data.get("body", "")
+        # The dicts are the source the pairs are derived from
+        context._raw_headers = context._query_string = None
+        context._headers = request_data.get("headers") or {}
+        context._query_params = request_data.get("query_params") or {}
+        for key in _SETTABLE - {"body"}:
+            if key in request_data:
+                setattr(context, key, request_data[key])
+        return context
+
+    @property
+    def body(self) -> str:
+        return self._body
+
+    @body.setter
+    def body(self, body: str):
+        # The text and features cover the body, so they are derived again
+        self._body = body
+        self._text = self._features = None
+
+    @property
+    def header_items(self) -> List[Tuple[str, str]]:
+        """Every (name, value) header pair, in order"""
+        if self._header_items is None:
+            if self._raw_headers is None:
+                self._header_items = _pairs(self._headers)
+            else:
+                self._header_items = [
+                    (name.decode("latin-1"), value.decode("latin-1")) for name, value in self._raw_headers
+                ]
+        return self._header_items
+
+    def header(self, name: str, default: str = "") -> str:
+        """First value of a header, without building the header dict"""
+        if self._headers is not None:
+            return self._headers.get(name, default)
+        for item_name, value in self.header_items:
+            if item_name == name:
+                return value
+        return default
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Header name -> value; repeated headers joined with ", " ("; " for cookie)"""
+        if self._headers is None:
+            headers = {}
+            for name, value in self.header_items:
+                if name in headers:
+                    headers[name] = f"{headers[name]}{'; ' if name == 'cookie' else ', '}{value}"
+                else:
+                    headers[name] = value
+            self._headers = headers
+        return self._headers
+
+    @property
+    def query_items(self) -> List[Tuple[str, str]]:
+        """Every (name, value) query parameter, in order"""
+        if self._query_items is None:
+            if self._query_string is None:
+                self._query_items = _pairs(self._query_params)
+            else:
+                self._query_items = parse_qsl(self._query_string.decode("latin-1"), keep_blank_values=True)
+        return self._query_items
+
+    @property
+    def query_params(self) -> QueryParams:
+        """Parameter name -> value, or -> list of values when the name repeats"""
+        if self._query_params is None:
+            params: QueryParams = {}
+            for name, value in self.query_items:
+                if name not in params:
+                    params[name] = value
+                elif isinstance(params[name], list):
+                    params[name].append(value)
+                else:
+                    params[name] = [params[name], value]
+            self._query_params = params
+        return self._query_params
+
+    @property
+    def text(self) -> str:
+        """The text the model reads for this request"""
+        if self._text is None:
+            self._text = _render(self)
+        return self._text
+
+    def cached_features(self, key: Hashable):
+        """The feature row a featurizer with this ``key`` stored, or None"""
+        if self._features is not None and self._features[0] == key:
+            return self._features[1]
+        return None
+
+    def cache_features(self, key: Hashable, row):
+        self._features = (key, row)
+
+    def normalized(self, value: str, normalizer, url_decoded: bool = False) -> str:
+        """``normalizer.normalize(value, url_decoded)``, computed once per request and value"""
+        if self._normalized is None:
+            self._normalized = {}
+        key = (value, url_decoded)
+        normalized = self._normalized.get(key)
+        if normalized is None:
+            normalized = self._normalized[key] = normalizer.normalize(value, url_decoded)
+        return normalized
+
+    def snapshot(self) -> "RequestContext":
+        """
+        A context of this request's method, path, client, headers and query
+        as they are now, sharing nothing a later stage can change (the rule
+        matches, the body) and none of the derived forms, which it builds
+        again if asked. The logger queues this instead of the live context.
+        """
+        snapshot = RequestContext(
+            self.method, self.path, self.client_ip, self.timestamp,
+            None if self._raw_headers is None else tuple(self._raw_headers), self._query_string
+        )
+        if self._raw_headers is None:
+            snapshot._headers = dict(self._headers)
+        if self._query_string is None:
+            snapshot._query_params = dict(self._query_params)
+        if hasattr(self, "rule_scans_skipped"):
+            snapshot.rule_scans_skipped = self.rule_scans_skipped
+        return snapshot
+
+    # Read like the request dict
+    def __getitem__(self, key: str):
+        if key not in _FIELDS:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        if key not in _SETTABLE:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELDS and hasattr(self, key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def as_context(request_data: Mapping) -> RequestContext:
+    """``request_data`` itself if it is a RequestContext, else a context wrapping the dict"""
+    if isinstance(request_data, RequestContext):
+        return request_data
+    return RequestContext.from_dict(request_data)
+
+
+def _render(request_data: Mapping) -> str:
+    return json.dumps({
+        'method': request_data.get('method', ''),
+        'path': request_data.get('path', ''),
+        'headers': request_data.get('headers', {}),
+        'query_params': request_data.get('query_params', {}),
+        'body': request_data.get('body', '')
+    })
+
+
+def request_text(request_data: Mapping) -> str:
+    """The text the model reads for a request"""
+    if isinstance(request_data, RequestContext):
+        return request_data.text
+    return _render(request_data)
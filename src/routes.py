@@ -0,0 +1,144 @@
+import fnmatch
+import functools
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .rule_sets import RULE_FAMILIES
+
+
+@dataclass(frozen=True)
+class RoutePolicy:
+    """What the WAF does for requests to a route"""
+    skip: bool = False  # pass straight through, like the old PATH_WHITELIST
+    rule_families: Optional[Tuple[str, ...]] = None  # None: every family
+    ml: bool = True
+    max_body_size: Optional[int] = None  # None: MAX_REQUEST_SIZE
+    rate_limit_class: Optional[str] = "default"  # key of RATE_LIMIT_CLASSES; None: not rate limited
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "RoutePolicy":
+        config = dict(config)
+        families = config.get("rule_families")
+        if families is not None:
+            if not isinstance(families, (list, tuple)):
+                raise ValueError(f"rule_families must be a list of rule families, not {families!r}")
+            unknown = [family for family in families if family not in RULE_FAMILIES]
+            if unknown:
+                raise ValueError(
+                    f"Unknown rule families {unknown} (expected some of {', '.join(RULE_FAMILIES)})"
+                )
+            config["rule_families"] = tuple(families)
+        return cls(**config)
+
+
+DEFAULT_POLICY = RoutePolicy()
+SKIP_POLICY = RoutePolicy(skip=True, rule_families=(), ml=False, rate_limit_class=None)
+
+
+class _Node:
+    __slots__ = ("children", "globs", "star", "rest", "policy")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}  # literal segments
+        self.globs: List[Tuple[str, "_Node"]] = []  # segments like *.js, in insertion order
+        self.star: Optional["_Node"] = None  # "*": any one segment
+        self.rest: Optional[RoutePolicy] = None  # "**": this prefix and everything below it
+        self.policy: Optional[RoutePolicy] = None  # the path ends exactly here
+
+
+class RouteTable:
+    """
+    Map request paths to route policies with a segment trie.
+
+    Route patterns are paths whose segments may be literals, ``*`` (any one
+    segment), a glob such as ``*.js`` (one matching segment), or a trailing
+    ``**`` (the prefix itself and anything below it). The most specific route
+    wins: at each segment a literal beats a glob, a glob beats ``*``, and
+    ``*`` beats ``**``. Paths matching no route get ``default``. Resolved
+    policies are memoized per path.
+    """
+
+    def __init__(self, routes: Dict[str, RoutePolicy], default: RoutePolicy = DEFAULT_POLICY,
+                 cache_size: int = 4096):
+        self.root = _Node()
+        self.default = default
+        for pattern, policy in routes.items():
+            self.add(pattern, policy)
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self._resolve)
+
+    @staticmethod
+    def _segments(path: str) -> List[str]:
+        """Path segments with dot segments resolved, so /static/../admin is not a static route"""
+        segments = []
+        for segment in path.split("/"):
+            if segment == "..":
+                if segments:
+                    segments.pop()
+            elif segment and segment != ".":
+                segments.append(segment)
+        return segments
+
+    def add(self, pattern: str, policy: RoutePolicy):
+        node = self.root
+        segments = self._segments(pattern)
+        for position, segment in enumerate(segments):
+            if segment == "**":
+                if position != len(segments) - 1:
+                    raise ValueError(f"'**' must be the last segment of route {pattern!r}")
+                node.rest = policy
+                return
+            if segment == "*":
+                node.star = node.star or _Node()
+                node = node.star
+            elif any(char in segment for char in "*?["):
+                for glob, child in node.globs:
+                    if glob == segment:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.globs.append((segment, child))
+                    node = child
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.policy = policy
+
+    def _match(self, node: _Node, segments: List[str], position: int) -> Optional[RoutePolicy]:
+        if position == len(segments):
+            if node.policy is not None:
+                return node.policy
+            return node.rest
+
+        segment = segments[position]
+        candidates = []
+        if segment in node.children:
+            candidates.append(node.children[segment])
+        candidates.extend(child for glob, child in node.globs if fnmatch.fnmatchcase(segment, glob))
+        if node.star is not None:
+            candidates.append(node.star)
+        for child in candidates:
+            policy = self._match(child, segments, position + 1)
+            if policy is not None:
+                return policy
+        return node.rest
+
+    def _resolve(self, path: str) -> RoutePolicy:
+        """Return the policy of the most specific route matching the path"""
+        return self._match(self.root, self._segments(path), 0) or self.default
+
+
+def build_route_table() -> RouteTable:
+    """ROUTE_POLICIES plus a skip route for every PATH_WHITELIST entry"""
+    routes = {path: SKIP_POLICY for path in settings.PATH_WHITELIST}
+    for pattern, config in settings.ROUTE_POLICIES.items():
+        try:
+            routes[pattern] = RoutePolicy.from_config(config)
+        except ValueError as e:
+            raise ValueError(f"ROUTE_POLICIES[{pattern!r}]: {e}") from None
+    return RouteTable(routes, cache_size=settings.ROUTE_CACHE_SIZE)
+
+
+@functools.lru_cache(maxsize=None)
+def route_table() -> RouteTable:
+    """The route table built from settings, shared by the middleware and the rules engine"""
+    return build_route_table()
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import logging
+import math
+import re
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Pattern, Tuple
+from .config import settings
+from .matcher import MultiPatternMatcher, required_literals, rule_id
+from .metrics import RULE_SET_LOADED, RULE_SET_RELOADS
+
+logger = logging.getLogger(__name__)
+
+# Characters that drive backtracking in common rule constructs (.*?, \s+, \w+)
+_PROBE_CHARACTERS = "a0 <'\"=-/.\\%\t"
+
+# Runs in a bare interpreter so a runaway pattern can be killed without
+# taking a worker (or its GIL) down with it. Prints one line per pattern:
+# the CPU time its probes took at each probe length, so a busy host does not
+# push a rule over budget. A pattern over budget is not run at longer lengths.
+_PROBE_SCRIPT = """
+import json, re, sys, time
+job = json.load(sys.stdin)
+for pattern, flags, probe_sets in job["patterns"]:
+    compiled = re.compile(pattern, flags)
+    timings = []
+    for probes in probe_sets:
+        start = time.process_time()
+        for probe in probes:
+            compiled.search(probe)
+        timings.append(time.process_time() - start)
+        if timings[-1] > job["budget"]:
+            break
+    print(*timings, flush=True)
+"""
+
+# Below this CPU time a probe's timing is too noisy to tell how it grows
+_GROWTH_MIN_SECONDS = 0.0005
+
+# rule family -> (rule name, severity, confidence, settings toggle); the
+# engine runs these families only, so a rule set may not define others
+RULE_FAMILIES = {
+    "xss_patterns": ("XSS Detection", "HIGH", 0.9, "ENABLE_XSS_PROTECTION"),
+    "sql_injection_patterns": ("SQL Injection Detection", "CRITICAL", 0.95, "ENABLE_SQL_INJECTION_PROTECTION"),
+    "path_traversal_patterns": ("Path Traversal Detection", "HIGH", 0.85, "ENABLE_PATH_TRAVERSAL_PROTECTION"),
+}
+
+
+class RuleSetError(ValueError):
+    """A rule set failed validation and was not loaded"""
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    """One immutable, compiled version of the rules"""
+    rules: Dict[str, Dict]
+    compiled_rules: Dict[str, List[Pattern]]
+    matcher: MultiPatternMatcher
+    version: str
+    source: str
+
+
+def compile_rule_set(rules: Dict[str, Dict], source: str = "settings") -> RuleSet:
+    """Validate and compile rules in the CUSTOM_RULES format"""
+    if not isinstance(rules, dict):
+        raise RuleSetError(f"{source}: rules must be an object of rule families")
+
+    compiled_rules = {}
+    for family, config in rules.items():
+        if family not in RULE_FAMILIES:
+            raise RuleSetError(
+                f"{source}: unknown rule family {family!r} (expected one of {', '.join(RULE_FAMILIES)})"
+            )
+        if not isinstance(config, dict) or not isinstance(config.get("patterns"), list):
+            raise RuleSetError(f"{source}: {family} needs a list of patterns")
+        if not config.get("enabled", True):
+            continue
+        compiled = []
+        for pattern in config["patterns"]:
+            try:
+                compiled.append(re.compile(pattern, re.IGNORECASE))
+            except (re.error, TypeError) as e:
+                raise RuleSetError(f"{source}: {family} pattern {pattern!r} does not compile: {e}")
+        compiled_rules[family] = compiled
+
+    version = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:12]
+    return RuleSet(rules, compiled_rules, MultiPatternMatcher(compiled_rules), version, source)
+
+
+def _probes(compiled: Pattern, length: int) -> List[str]:
+    """
+    Inputs likely to make a pattern backtrack, each ending in a character
+    that spoils a match at the very end: long runs of one character or
+    literal, and the pattern's required literals interleaved with one of them
+    left out (or given only once, up front), so every construct between the
+    literals keeps finding candidates but the match never completes
+    """
+    probes = [char * length + "\x01" for char in _PROBE_CHARACTERS]
+    literals = required_literals(compiled.pattern, compiled.flags)
+    for literal in literals:
+        probes.append(literal * (length // len(literal)) + "\x01")
+    if len(literals) > 1:
+        for index, literal in enumerate(literals):
+            others = "".join(literals[:index] + literals[index + 1:])
+            run = others * ((length - len(literal)) // len(others))
+            probes.append(run + "\x01")
+            probes.append(literal + run + "\x01")
+    return probes
+
+
+def _projected(timings: List[float], length: int, target: int) -> float:
+    """
+    CPU time the probes would take at ``target`` characters, extrapolated
+    from their times at ``length`` and ``2 * length``: a pattern whose time
+    quadruples when the input doubles is assumed quadratic, and so on
+    """
+    short, long = timings
+    growth = long / short if short >= _GROWTH_MIN_SECONDS else 2.0
+    exponent = max(1.0, math.log2(max(growth, 1.0)))
+    return long * (target / (2 * length)) ** exponent
+
+
+def check_backtracking(rule_set: RuleSet, budget_ms: float = None, probe_length: int = None):
+    """
+    Raise RuleSetError if any pattern takes more than ``budget_ms`` of CPU
+    time over the adversarial probes, either at ``probe_length`` and twice
+    that, or extrapolated from how its time grows between the two to the
+    largest window the body inspection scans inline (BODY_BUFFER_SIZE plus
+    BODY_INSPECTION_WINDOW). The patterns run in a child interpreter that is
+    killed once the whole budget is spent, so a catastrophic pattern cannot
+    hang the caller.
+    """
+    budget = (budget_ms or settings.RULES_REGEX_TIME_BUDGET_MS) / 1000
+    length = probe_length or settings.RULES_REGEX_PROBE_LENGTH
+    window = settings.BODY_BUFFER_SIZE + settings.BODY_INSPECTION_WINDOW
+    entries = [
+        (family, compiled)
+        for family, patterns in rule_set.compiled_rules.items()
+        for compiled in patterns
+    ]
+    if not entries:
+        return
+
+    payload = json.dumps({
+        "budget": budget,
+        "patterns": [
+            (c.pattern, c.flags, [_probes(c, length), _probes(c, 2 * length)]) for _, c in entries
+        ],
+    })
+    try:
+        completed = subprocess.run(
+            [sys.executable, "-c", _PROBE_SCRIPT], input=payload, capture_output=True,
+            text=True, timeout=budget * 3 * len(entries) + 5
+        )
+        output, failed = completed.stdout, completed.returncode != 0
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout.decode() if isinstance(e.stdout, bytes) else (e.stdout or "")
+        failed = True
+
+    lines = [[float(value) for value in line.split()] for line in output.splitlines() if line.strip()]
+    for (family, compiled), timings in zip(entries, lines):
+        if max(timings) > budget:
+            raise RuleSetError(
+                f"{rule_set.source}: {family} pattern {compiled.pattern!r} took "
+                f"{max(timings) * 1000:.0f}ms on adversarial input (budget {budget * 1000:.0f}ms)"
+            )
+        projected = _projected(timings, length, window)
+        if projected > budget:
+            raise RuleSetError(
+                f"{rule_set.source}: {family} pattern {compiled.pattern!r} slows down superlinearly "
+                f"on adversarial input ({timings[0] * 1000:.1f}ms at {length} characters, "
+                f"{timings[1] * 1000:.1f}ms at {2 * length}); it would take about "
+                f"{projected * 1000:.0f}ms on a {window}-character body window (budget {budget * 1000:.0f}ms)"
+            )
+    if failed:
+        family, compiled = entries[min(len(lines), len(entries) - 1)]
+        raise RuleSetError(
+            f"{rule_set.source}: {family} pattern {compiled.pattern!r} did not finish "
+            f"on adversarial input within the time budget"
+        )
+
+
+def _rule_files(path: Path) -> List[Path]:
+    return sorted(path.glob("*.json")) if path.is_dir() else [path]
+
+
+def read_rules(path: str) -> Dict[str, Dict]:
+    """
+    Read rules from a JSON file, or from every *.json file in a directory.
+    Each file maps rule family names to {"enabled": ..., "patterns": [...]},
+    like CUSTOM_RULES. A family may only be defined in one file.
+    """
+    rules: Dict[str, Dict] = {}
+    for file in _rule_files(Path(path)):
+        try:
+            with open(file, "r") as f:
+                families = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise RuleSetError(f"{file}: {e}")
+        if not isinstance(families, dict):
+            raise RuleSetError(f"{file}: rules must be an object of rule families")
+        for family, config in families.items():
+            if family in rules:
+                raise RuleSetError(f"{file}: {family} is already defined in another rules file")
+            rules[family] = config
+    return rules
+
+
+def load_rule_set(path: str) -> RuleSet:
+    """Read, validate, compile and backtracking-check the rules at ``path``"""
+    rule_set = compile_rule_set(read_rules(path), source=path)
+    check_backtracking(rule_set)
+    return rule_set
+
+
+def initial_rule_set() -> RuleSet:
+    """
+    The rules a process starts with: those at RULES_PATH when it is set,
+    else CUSTOM_RULES. A rejected rule set is logged and counted like a
+    rejected reload, and CUSTOM_RULES are used until a valid one is written.
+    """
+    if settings.RULES_PATH:
+        try:
+            return load_rule_set(settings.RULES_PATH)
+        except RuleSetError as e:
+            RULE_SET_RELOADS.labels("rejected").inc()
+            logger.error(f"Rule set rejected, starting with CUSTOM_RULES: {e}")
+    return compile_rule_set(settings.CUSTOM_RULES)
+
+
+def record_loaded(previous: Optional[RuleSet], current: RuleSet):
+    """
+    Point the rule set version metric at the version this worker now runs
+    and log the IDs the rule metrics label its patterns with
+    """
+    if previous is not None:
+        RULE_SET_LOADED.labels(previous.version).set(0)
+    RULE_SET_LOADED.labels(current.version).set(1)
+    for family, patterns in current.compiled_rules.items():
+        for compiled in patterns:
+            logger.debug(f"Rule set {current.version}: {family} rule {rule_id(compiled.pattern)} is {compiled.pattern!r}")
+
+
+class RuleSetWatcher:
+    """
+    Reload the rules engine's rules when the files at ``path`` change.
+
+    A daemon thread polls the files' modification times and sizes every
+    ``interval`` seconds. A changed rule set is read, compiled and checked
+    for catastrophic backtracking on that thread, then handed to the engine
+    as a single reference swap; requests in flight keep the version they
+    started with. Rule sets that fail validation are logged and counted, and
+    the engine keeps its current rules.
+    """
+
+    def __init__(self, rules_engine, path: str, interval: float = None):
+        self.rules_engine = rules_engine
+        self.path = path
+        self.interval = interval or settings.RULES_RELOAD_INTERVAL
+        self._signature = self._read_signature()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="waf-rules-watcher", daemon=True)
+        self._thread.start()
+
+    def _read_signature(self) -> Tuple:
+        try:
+            return tuple(
+                (str(file), file.stat().st_mtime_ns, file.stat().st_size)
+                for file in _rule_files(Path(self.path))
+            )
+        except OSError:
+            return ()
+
+    def reload(self) -> bool:
+        """Load the rules now; returns whether a new version was swapped in"""
+        try:
+            rule_set = load_rule_set(self.path)
+        except RuleSetError as e:
+            RULE_SET_RELOADS.labels("rejected").inc()
+            logger.error(f"Rule set rejected, keeping version {self.rules_engine.version}: {e}")
+            return False
+
+        if rule_set.version == self.rules_engine.version:
+            return False
+        previous = self.rules_engine.version
+        self.rules_engine.swap_rule_set(rule_set)
+        RULE_SET_RELOADS.labels("loaded").inc()
+        logger.info(f"Rule set {previous} replaced by {rule_set.version} from {self.path}")
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            signature = self._read_signature()
+            if signature != self._signature:
+                self._signature = signature
+                self.reload()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(timeout=self.interval + 1)
@@ -1,7 +1,12 @@
-import re
+import random
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass
 from .config import settings
+from .normalizer import RequestNormalizer
+from .request_context import RequestContext, as_context
+from .metrics import RULE_EVAL_DURATION, RULE_HITS, RULE_SCANS_SKIPPED
+from .routes import route_table
+from .rule_sets import RULE_FAMILIES, RuleSet, initial_rule_set, record_loaded
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,87 +18,168 @@ class RuleMatch:
     matched_content: str
     severity: str
     confidence: float
+    stage: str = "request"  # "body" when found while the body streamed in
+
+HEADER_FAMILIES = ("xss_patterns", "sql_injection_patterns")
+FIELD_FAMILIES = ("xss_patterns", "sql_injection_patterns", "path_traversal_patterns")
 
 class RulesEngine:
-    def __init__(self):
-        self.rules = settings.CUSTOM_RULES
-        self._compile_rules()
-    
-    def _compile_rules(self):
-        """Pre-compile regex patterns for better performance"""
-        self.compiled_rules = {}
-        for rule_type, rule_config in self.rules.items():
-            if rule_config["enabled"]:
-                self.compiled_rules[rule_type] = [
-                    re.compile(pattern, re.IGNORECASE) 
-                    for pattern in rule_config["patterns"]
-                ]
-    
-    def _check_xss(self, content: str) -> List[RuleMatch]:
-        """Check for XSS attacks in content"""
+    """
+    Rule-based request inspection.
+
+    Rules come from RULES_PATH when it is set and from CUSTOM_RULES
+    otherwise. The compiled rules live in one immutable RuleSet; a reload
+    replaces that reference, so scans never take a lock and each request is
+    analyzed against a single version.
+    """
+
+    def __init__(self, rule_set: RuleSet = None):
+        self.normalizer = RequestNormalizer()
+        self.rule_set: RuleSet = None
+        self.swap_rule_set(rule_set if rule_set is not None else initial_rule_set())
+
+    def swap_rule_set(self, rule_set: RuleSet):
+        """Atomically switch to an already compiled rule set"""
+        previous, self.rule_set = self.rule_set, rule_set
+        record_loaded(previous, rule_set)
+
+    @property
+    def rules(self) -> Dict[str, Dict]:
+        return self.rule_set.rules
+
+    @property
+    def compiled_rules(self):
+        return self.rule_set.compiled_rules
+
+    @property
+    def version(self) -> str:
+        return self.rule_set.version
+
+    def _enabled_families(self, families: Tuple[str, ...], rule_set: RuleSet) -> Tuple[str, ...]:
+        """Filter rule families down to the ones switched on in settings"""
+        return tuple(
+            family for family in families
+            if getattr(settings, RULE_FAMILIES[family][3]) and family in rule_set.compiled_rules
+        )
+
+    def _scan(self, content: str, families: Tuple[str, ...], rule_set: RuleSet = None,
+              stage: str = "request") -> List[RuleMatch]:
+        """Scan content once for every pattern of the given rule families"""
+        rule_set = rule_set or self.rule_set
+        families = self._enabled_families(families, rule_set)
+        if not families:
+            return []
+
+        if random.random() < settings.RULE_TIMING_SAMPLE_RATE:
+            timings = []
+            hits = rule_set.matcher.scan(content, families, timings)
+            for family, rule, seconds in timings:
+                RULE_EVAL_DURATION.labels(family, rule).observe(seconds)
+        else:
+            hits = rule_set.matcher.scan(content, families)
+
         matches = []
-        if not settings.ENABLE_XSS_PROTECTION:
-            return matches
-            
-        for pattern in self.compiled_rules.get("xss_patterns", []):
-            if found := pattern.findall(content):
-                matches.append(RuleMatch(
-                    rule_name="XSS Detection",
-                    pattern=pattern.pattern,
-                    matched_content=found[0],
-                    severity="HIGH",
-                    confidence=0.9
-                ))
+        for hit in hits:
+            RULE_HITS.labels(hit.family, hit.rule_id).inc()
+            rule_name, severity, confidence, _ = RULE_FAMILIES[hit.family]
+            matches.append(RuleMatch(
+                rule_name=rule_name,
+                pattern=hit.pattern,
+                matched_content=hit.matched_content,
+                severity=severity,
+                confidence=confidence,
+                stage=stage
+            ))
         return matches
 
+    def _check_xss(self, content: str) -> List[RuleMatch]:
+        """Check for XSS attacks in content"""
+        return self._scan(content, ("xss_patterns",))
+
     def _check_sql_injection(self, content: str) -> List[RuleMatch]:
         """Check for SQL injection attempts"""
-        matches = []
-        if not settings.ENABLE_SQL_INJECTION_PROTECTION:
-            return matches
-            
-        for pattern in self.compiled_rules.get("sql_injection_patterns", []):
-            if found := pattern.findall(content):
-                matches.append(RuleMatch(
-                    rule_name="SQL Injection Detection",
-                    pattern=pattern.pattern,
-                    matched_content=found[0],
-                    severity="CRITICAL",
-                    confidence=0.95
-                ))
-        return matches
+        return self._scan(content, ("sql_injection_patterns",))
 
     def _check_path_traversal(self, content: str) -> List[RuleMatch]:
         """Check for path traversal attempts"""
-        matches = []
-        if not settings.ENABLE_PATH_TRAVERSAL_PROTECTION:
-            return matches
-            
-        for pattern in self.compiled_rules.get("path_traversal_patterns", []):
-            if found := pattern.findall(content):
-                matches.append(RuleMatch(
-                    rule_name="Path Traversal Detection",
-                    pattern=pattern.pattern,
-                    matched_content=found[0],
-                    severity="HIGH",
-                    confidence=0.85
-                ))
-        return matches
+        return self._scan(content, ("path_traversal_patterns",))
+
+    def scan_body(self, content: str, families: Tuple[str, ...] = FIELD_FAMILIES) -> List[RuleMatch]:
+        """Check a body (or a chunk of one) against the body rule families"""
+        return self._scan(self.normalizer.normalize(content), families, stage="body")
+
+    @staticmethod
+    def route_families(families: Tuple[str, ...], allowed: Optional[Tuple[str, ...]]) -> Tuple[str, ...]:
+        """Narrow rule families to the ones a route policy runs (None: all of them)"""
+        if allowed is None:
+            return families
+        return tuple(family for family in families if family in allowed)
 
-    def analyze_request(self, request_data: Dict) -> Tuple[bool, List[RuleMatch]]:
+    def _plan_scans(
+        self,
+        context: RequestContext,
+        scan_body: bool,
+        full_scan: bool,
+        allowed_families: Optional[Tuple[str, ...]] = None
+    ) -> List[Tuple[str, Tuple[str, ...], bool]]:
         """
-        Analyze an HTTP request for potential security threats
+        List the (field value, rule families, URL-decoded) scans a request
+        needs; query values were already URL-decoded by the server. Outside
+        full-scan mode, query params come first (short and most often the
+        attack carrier), then headers, shortest first, and the body last.
+        Every value of a repeated header or parameter is scanned. Fields
+        with no family left to run under the route policy are dropped.
+        """
+        header_families = self.route_families(HEADER_FAMILIES, allowed_families)
+        field_families = self.route_families(FIELD_FAMILIES, allowed_families)
+        headers = [value for _, value in context.header_items] if header_families else []
+        query_params = [value for _, value in context.query_items] if field_families else []
+        if not full_scan:
+            headers.sort(key=len)
+            query_params.sort(key=len)
+            scans = [(value, field_families, True) for value in query_params]
+            scans.extend((value, header_families, False) for value in headers)
+        else:
+            scans = [(value, header_families, False) for value in headers]
+            scans.extend((value, field_families, True) for value in query_params)
+
+        body = context.body
+        if scan_body and field_families and isinstance(body, str):
+            scans.append((body, field_families, False))
+        return scans
+
+    def analyze_request(
+        self,
+        request_data: Dict,
+        body_matches: Optional[List[RuleMatch]] = None
+    ) -> Tuple[bool, List[RuleMatch]]:
+        """
+        Analyze an HTTP request (a RequestContext or a request dict) for
+        potential security threats.
+        If the body was already inspected while streaming, pass its matches
+        as ``body_matches`` and the body field is not scanned again.
+        The route policy in ``request_data["route_policy"]`` (resolved from
+        the path when absent) decides whether and with which rule families
+        the request is scanned.
+
+        Unless RULES_EVALUATION_MODE is "full", scanning stops as soon as the
+        matches so far are enough to block, since further matches cannot
+        change the verdict. The number of scans skipped is stored in
+        ``request_data["rule_scans_skipped"]``.
         Returns: (is_threat, matches)
         """
         matches = []
-        
-        # Check URL path
-        path = request_data.get("path", "")
-        if path in settings.PATH_WHITELIST:
+        rule_set = self.rule_set
+        full_scan = settings.RULES_EVALUATION_MODE == "full"
+        context = as_context(request_data)
+
+        # Resolve the route policy, unless the middleware already did
+        policy = context.get("route_policy") or route_table().resolve(context.path)
+        if policy.skip:
             return False, []
             
         # Check request method
-        method = request_data.get("method", "").upper()
+        method = context.method.upper()
         if method not in settings.ALLOWED_HTTP_METHODS:
             matches.append(RuleMatch(
                 rule_name="Invalid HTTP Method",
@@ -102,39 +188,51 @@ class RulesEngine:
                 severity="MEDIUM",
                 confidence=1.0
             ))
-            
-        # Analyze headers
-        headers = request_data.get("headers", {})
-        for header_name, header_value in headers.items():
-            matches.extend(self._check_xss(header_value))
-            matches.extend(self._check_sql_injection(header_value))
-            
-        # Analyze query parameters
-        query_params = request_data.get("query_params", {})
-        for param_name, param_value in query_params.items():
-            matches.extend(self._check_xss(param_value))
-            matches.extend(self._check_sql_injection(param_value))
-            matches.extend(self._check_path_traversal(param_value))
-            
-        # Analyze body content
-        body = request_data.get("body", "")
-        if isinstance(body, str):
-            matches.extend(self._check_xss(body))
-            matches.extend(self._check_sql_injection(body))
-            matches.extend(self._check_path_traversal(body))
+
+        # Body matches found while streaming are free, so count them first
+        if body_matches:
+            matches.extend(body_matches)
+
+        scans = self._plan_scans(context, body_matches is None, full_scan, policy.rule_families)
+        performed = 0
+        if full_scan or not self.should_block_request(matches)[0]:
+            for value, families, url_decoded in scans:
+                performed += 1
+                found = self._scan(context.normalized(value, self.normalizer, url_decoded), families, rule_set)
+                if found:
+                    matches.extend(found)
+                    if not full_scan and self.should_block_request(matches)[0]:
+                        break
+
+        skipped = len(scans) - performed
+        request_data["rule_scans_skipped"] = skipped
+        RULE_SCANS_SKIPPED.observe(skipped)
             
         # Log findings
         if matches:
-            logger.warning(f"Security threats detected: {len(matches)} matches found")
-            for match in matches:
-                logger.info(f"Rule match: {match}")
+            logger.warning(
+                f"Security threats detected: {len(matches)} matches found, {skipped} scans skipped"
+            )
+            if full_scan:
+                for match in matches:
+                    logger.info(f"Rule match: {match}")
                 
         return bool(matches), matches
 
+    def anomaly_score(self, matches: List[RuleMatch]) -> int:
+        """Sum of the RULE_SEVERITY_SCORES of the matches"""
+        return sum(settings.RULE_SEVERITY_SCORES.get(m.severity, 0) for m in matches)
+
     def should_block_request(self, matches: List[RuleMatch]) -> Tuple[bool, Optional[str]]:
         """Determine if request should be blocked based on rule matches"""
         if not matches:
             return False, None
+
+        if settings.RULES_BLOCK_POLICY == "anomaly_score":
+            score = self.anomaly_score(matches)
+            if score >= settings.RULES_ANOMALY_THRESHOLD:
+                return True, f"Anomaly score {score} reached threshold {settings.RULES_ANOMALY_THRESHOLD}"
+            return False, None
             
         # Block if any critical severity matches
         critical_matches = [m for m in matches if m.severity == "CRITICAL"]
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .metrics import BODY_SCAN_OFFLOADS
+from .rules_engine import RulesEngine, RuleMatch
+from .rule_sets import compile_rule_set
+from .shared_state import untracked
+
+logger = logging.getLogger(__name__)
+
+# Reported instead of the body's matches when the pool cannot scan it and
+# BODY_SCAN_POOL_FAIL_OPEN is off; CRITICAL blocks under either block policy
+UNSCANNED_MATCH = RuleMatch(
+    rule_name="Body Inspection Unavailable",
+    pattern="",
+    matched_content="",
+    severity="CRITICAL",
+    confidence=1.0,
+    stage="body"
+)
+
+# Rules engine of a pool worker process, built once by _init_worker
+_engine: Optional[RulesEngine] = None
+
+
+def _init_worker():
+    global _engine
+    _engine = RulesEngine()
+
+
+def _warm() -> int:
+    return 0
+
+
+def _scan_shared(name: str, size: int, version: str, families: Tuple[str, ...],
+                 rules: Dict = None) -> Optional[List[RuleMatch]]:
+    """
+    Scan the UTF-8 text in shared memory block ``name`` (runs in a pool
+    worker). Returns None when the worker does not have rule set ``version``
+    yet and no ``rules`` were sent along; the parent then sends them.
+    """
+    if _engine.version != version:
+        if rules is None:
+            return None
+        # The parent reloaded its rules; backtracking was checked there already
+        _engine.swap_rule_set(compile_rule_set(rules))
+
+    # The parent registered the block with the resource tracker the workers
+    # share and unregisters it when it unlinks it; attaching must not
+    # register it a second time
+    with untracked():
+        block = shared_memory.SharedMemory(name=name)
+    try:
+        with block.buf[:size] as view:
+            text = str(view, "utf-8")
+    finally:
+        block.close()
+    return _engine.scan_body(text, families)
+
+
+class BodyScanPool:
+    """
+    Scan large body windows in a pool of worker processes.
+
+    Each worker builds its own RulesEngine at startup, and the pool is warmed
+    up front so no request pays for process start or rule compilation. The
+    parent copies the text once into a shared memory block and sends only
+    the block name and the rule set version; the worker decodes it there and
+    returns its matches. A worker that does not have that version yet asks
+    for it, and the rules are sent to it once and compiled there. A scan
+    that does not finish within ``timeout`` seconds, or fails, yields no
+    matches when ``fail_open`` and UNSCANNED_MATCH otherwise. The block is
+    released once the worker is done with it, even after a timeout.
+    """
+
+    def __init__(self, rules_engine: RulesEngine, workers: int = None, timeout: float = None,
+                 fail_open: bool = None):
+        self.rules_engine = rules_engine
+        self.workers = workers or settings.BODY_SCAN_POOL_WORKERS
+        self.timeout = timeout or settings.BODY_SCAN_POOL_TIMEOUT
+        self.fail_open = fail_open if fail_open is not None else settings.BODY_SCAN_POOL_FAIL_OPEN
+        # spawn: forking a worker that runs threads (log writer, watchers) is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        for _ in range(self.workers):
+            self._executor.submit(_warm)
+
+    def _failed(self, reason: str) -> List[RuleMatch]:
+        BODY_SCAN_OFFLOADS.labels(reason).inc()
+        return [] if self.fail_open else [UNSCANNED_MATCH]
+
+    async def scan(self, text: str, families: Tuple[str, ...]) -> List[RuleMatch]:
+        """Scan text with the current rules in a worker process"""
+        data = text.encode("utf-8")
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        block.buf[:len(data)] = data
+        rule_set = self.rules_engine.rule_set
+
+        async def scan_in_worker() -> List[RuleMatch]:
+            matches = await asyncio.wrap_future(
+                self._executor.submit(_scan_shared, block.name, len(data), rule_set.version, families)
+            )
+            if matches is None:
+                matches = await asyncio.wrap_future(self._executor.submit(
+                    _scan_shared, block.name, len(data), rule_set.version, families, rule_set.rules
+                ))
+            return matches
+
+        def release(task: asyncio.Task):
+            block.close()
+            block.unlink()
+            if not task.cancelled():
+                task.exception()  # retrieved here when the scan outlived its timeout
+
+        task = asyncio.ensure_future(scan_in_worker())
+        task.add_done_callback(release)
+
+        try:
+            # Shielded: after a timeout the worker still reads the block, which is released once it is done
+            matches = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Body scan of {len(data)} bytes timed out after {self.timeout}s")
+            return self._failed("timeout")
+        except Exception as e:
+            logger.error(f"Body scan failed: {str(e)}")
+            return self._failed("error")
+        BODY_SCAN_OFFLOADS.labels("scanned").inc()
+        return matches
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
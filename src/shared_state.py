@@ -0,0 +1,183 @@
+"""
+Fixed-size hash tables in shared memory, for state every worker on a host
+sees without a Redis round trip: rate-limit buckets, ML deny entries and
+verdict cache entries.
+
+A table lives in a named ``multiprocessing.shared_memory`` segment, so
+workers attach to it by name whether they were forked or spawned. It is
+split into stripes, each an open-addressing table of its own with linear
+probing, guarded by one byte-range lock on a lock file. A key goes to one
+stripe, so an operation takes one lock, and workers touching other stripes
+never wait. Every entry carries an expiry time; expired slots count as free
+and are reused by later writes, so nothing has to sweep the table. Probing
+stops after MAX_PROBES slots: a write that finds no free slot in reach is
+dropped and counted, and a read that finds no entry is a miss.
+
+Segments outlive the workers (a restart keeps the state) and are recreated
+when the configured layout no longer matches.
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+from .config import settings
+from .metrics import SHARED_STATE_FULL
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WAFSHM01"
+MAX_PROBES = 16
+_HEADER = struct.Struct("<8sIII")  # magic, stripes, slots per stripe, value size
+_HEADER_SIZE = 64
+_SLOT = struct.Struct("<Qd")  # key hash (0: never used), expiry (time.monotonic(), shared by every process)
+_EMPTY = 0
+
+T = TypeVar("T")
+
+
+def key_hash(key: bytes) -> int:
+    """64-bit hash of a key; never 0, which marks an unused slot"""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+@contextlib.contextmanager
+def untracked():
+    """
+    Keep segments away from the resource tracker, which would unlink one
+    when the first process that opened it exits (no track=False before 3.13)
+    """
+    register, unregister = resource_tracker.register, resource_tracker.unregister
+    resource_tracker.register = resource_tracker.unregister = lambda name, rtype: None
+    try:
+        yield
+    finally:
+        resource_tracker.register, resource_tracker.unregister = register, unregister
+
+
+def _attach(name: str, size: int, layout: bytes) -> shared_memory.SharedMemory:
+    """Create the segment, or attach to the one another worker created"""
+    with untracked():
+        for _ in range(2):
+            try:
+                segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+                segment.buf[:len(layout)] = layout
+            except FileExistsError:
+                segment = shared_memory.SharedMemory(name=name)
+                # The creator writes the header right after creating the segment
+                deadline = time.monotonic() + 1.0
+                while bytes(segment.buf[:len(MAGIC)]) != MAGIC and time.monotonic() < deadline:
+                    time.sleep(0.001)
+            if bytes(segment.buf[:len(layout)]) == layout and segment.size >= size:
+                return segment
+            logger.warning(f"Shared memory segment {name} has another layout; recreating it")
+            segment.close()
+            segment.unlink()
+    raise RuntimeError(f"Could not set up shared memory segment {name}")
+
+
+class SharedTable:
+    """
+    Key -> fixed-size value table with per-entry expiry, shared by every
+    process that opens the same ``name``.
+
+    Keys are bytes, stored as a 64-bit hash; values are ``value_size``
+    bytes. A table only grows its entries in place, so ``slots`` bounds its
+    memory for good.
+    """
+
+    def __init__(self, name: str, slots: int, value_size: int, stripes: int = None):
+        self.name = name
+        self.stripes = stripes or settings.SHARED_STATE_STRIPES
+        self.slots_per_stripe = max(1, slots // self.stripes)
+        self.value_size = value_size
+        self.slot_size = _SLOT.size + -(-value_size // 8) * 8
+        layout = _HEADER.pack(MAGIC, self.stripes, self.slots_per_stripe, value_size)
+        size = _HEADER_SIZE + self.stripes * self.slots_per_stripe * self.slot_size
+        self._segment = _attach(name, size, layout)
+        self._buf = self._segment.buf
+        self._lock_fd = os.open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _find(self, h: int, now: float) -> Tuple[Optional[int], bool]:
+        """Offset of the live entry for ``h``, else of a free slot in reach (or None). Returns: (offset, live)"""
+        slots = self.slots_per_stripe
+        first = _HEADER_SIZE + (h % self.stripes) * slots * self.slot_size
+        start = (h // self.stripes) % slots
+        free = None
+        for probe in range(min(MAX_PROBES, slots)):
+            offset = first + (start + probe) % slots * self.slot_size
+            key, expires = _SLOT.unpack_from(self._buf, offset)
+            if key == h:
+                return offset, expires >= now
+            if key == _EMPTY:
+                return (offset if free is None else free), False
+            if free is None and expires < now:
+                free = offset
+        return free, False
+
+    def _lock(self, h: int):
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, h % self.stripes)
+
+    def _unlock(self, h: int):
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, h % self.stripes)
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """The live value stored under ``key``, or None"""
+        h = key_hash(key)
+        self._lock(h)
+        try:
+            offset, live = self._find(h, time.monotonic())
+            if not live:
+                return None
+            start = offset + _SLOT.size
+            return bytes(self._buf[start:start + self.value_size])
+        finally:
+            self._unlock(h)
+
+    def put(self, key: bytes, value: bytes, ttl: float) -> bool:
+        """Store ``value`` for ``ttl`` seconds; False if the stripe had no free slot in reach"""
+        return self.update(key, ttl, lambda _: (value, True)) is not None
+
+    def update(self, key: bytes, ttl: float, fn: Callable[[Optional[bytes]], Tuple[bytes, T]]) -> Optional[T]:
+        """
+        Read-modify-write under the stripe lock. ``fn`` gets the live value
+        (or None) and returns (new value, result); the new value is stored
+        for ``ttl`` seconds and the result returned. Returns None, without
+        calling ``fn``, if the stripe had no free slot in reach.
+        """
+        h = key_hash(key)
+        self._lock(h)
+        try:
+            now = time.monotonic()
+            offset, live = self._find(h, now)
+            if offset is None:
+                SHARED_STATE_FULL.labels(self.name).inc()
+                return None
+            start = offset + _SLOT.size
+            value, result = fn(bytes(self._buf[start:start + self.value_size]) if live else None)
+            self._buf[start:start + len(value)] = value
+            _SLOT.pack_into(self._buf, offset, h, now + ttl)
+            return result
+        finally:
+            self._unlock(h)
+
+    def close(self):
+        self._buf = None
+        self._segment.close()
+        os.close(self._lock_fd)
+
+
+_tables: Dict[str, SharedTable] = {}
+
+
+def shared_table(kind: str, value_size: int) -> SharedTable:
+    """This process's handle on the host-wide table for ``kind`` ("rate_limit", "ml_deny", "verdicts")"""
+    table = _tables.get(kind)
+    if table is None:
+        table = _tables[kind] = SharedTable(f"{settings.SHARED_STATE_NAME}-{kind}", settings.SHARED_STATE_SLOTS, value_size)
+    return table
@@ -0,0 +1,134 @@
+import hashlib
+import struct
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+from .config import settings
+from .metrics import VERDICT_CACHE_EVICTIONS, VERDICT_CACHE_HITS, VERDICT_CACHE_MISSES
+from .request_context import as_context
+from .shared_state import SharedTable, shared_table
+
+# A cached verdict: None to allow, or (status code, response body) to block
+Verdict = Optional[Tuple[int, bytes]]
+
+
+class VerdictCache:
+    """
+    Bounded LRU/TTL cache of combined rules + ML verdicts.
+
+    Keys are a digest of everything the rules and the model look at: method,
+    path, query params, headers and the body. Client IP is not part of it,
+    since the IP only feeds the whitelist and rate limit checks, which run
+    before the cache. Entries belong to a generation (rules version, model
+    version); when the generation changes the cache is emptied.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation: Hashable = None
+        self._entries: "OrderedDict[bytes, Tuple[float, Verdict]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def make_key(self, request_data: Dict, body_chunks: Iterable[bytes]) -> bytes:
+        """Hash the decision-relevant fields of a request (a RequestContext or a request dict)"""
+        context = as_context(request_data)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((
+            context.method,
+            context.path,
+            sorted(context.query_items),
+            sorted(context.header_items),
+        )).encode())
+        for chunk in body_chunks:
+            digest.update(chunk)
+        return digest.digest()
+
+    def ensure_generation(self, generation: Hashable):
+        """Drop every entry if the rules or model changed since they were cached"""
+        if generation != self.generation:
+            if self._entries:
+                VERDICT_CACHE_EVICTIONS.labels(reason="invalidated").inc(len(self._entries))
+            self._entries.clear()
+            self.generation = generation
+
+    def get(self, key: bytes) -> Tuple[bool, Verdict]:
+        """Returns: (hit, verdict)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            VERDICT_CACHE_MISSES.inc()
+            return False, None
+
+        expires, verdict = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            VERDICT_CACHE_EVICTIONS.labels(reason="expired").inc()
+            VERDICT_CACHE_MISSES.inc()
+            return False, None
+
+        self._entries.move_to_end(key)
+        VERDICT_CACHE_HITS.inc()
+        return True, verdict
+
+    def put(self, key: bytes, verdict: Verdict):
+        self._entries[key] = (time.monotonic() + self.ttl, verdict)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            VERDICT_CACHE_EVICTIONS.labels(reason="lru").inc()
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Shared entry: rest of the key digest, generation tag, status code (0: allow), body length, body
+_SHARED_ENTRY = struct.Struct("<8sQHH")
+SHARED_VALUE_SIZE = 256
+MAX_SHARED_BODY = SHARED_VALUE_SIZE - _SHARED_ENTRY.size
+
+
+class SharedVerdictCache(VerdictCache):
+    """
+    VerdictCache in a shared-memory table, one for every worker on the host.
+
+    Entries are tagged with the generation they were cached under and an
+    entry from another generation is a miss, so a worker whose rules or
+    model changed stops seeing older verdicts without clearing anyone
+    else's. Entries expire after ``ttl``; the table size bounds the count.
+    Block responses with bodies over MAX_SHARED_BODY bytes are not cached.
+    """
+
+    def __init__(self, ttl: float, table: SharedTable = None):
+        super().__init__(settings.SHARED_STATE_SLOTS, ttl)
+        self.table = table or shared_table("verdicts", SHARED_VALUE_SIZE)
+        self._tag = 0
+
+    def ensure_generation(self, generation: Hashable):
+        if generation != self.generation:
+            self.generation = generation
+            self._tag = int.from_bytes(hashlib.blake2b(repr(generation).encode(), digest_size=8).digest(), "little")
+
+    def get(self, key: bytes) -> Tuple[bool, Verdict]:
+        value = self.table.get(key[:8])
+        if value is not None:
+            rest, tag, status_code, length = _SHARED_ENTRY.unpack_from(value)
+            if rest == key[8:] and tag == self._tag:
+                VERDICT_CACHE_HITS.inc()
+                body = value[_SHARED_ENTRY.size:_SHARED_ENTRY.size + length]
+                return True, ((status_code, body) if status_code else None)
+        VERDICT_CACHE_MISSES.inc()
+        return False, None
+
+    def put(self, key: bytes, verdict: Verdict):
+        status_code, body = verdict if verdict is not None else (0, b"")
+        if len(body) <= MAX_SHARED_BODY:
+            self.table.put(key[:8], _SHARED_ENTRY.pack(key[8:], self._tag, status_code, len(body)) + body, self.ttl)
+
+
+def create_verdict_cache() -> VerdictCache:
+    """Build the verdict cache selected by VERDICT_CACHE_BACKEND"""
+    if settings.VERDICT_CACHE_BACKEND == "shared_memory":
+        return SharedVerdictCache(settings.VERDICT_CACHE_TTL)
+    return VerdictCache(settings.VERDICT_CACHE_SIZE, settings.VERDICT_CACHE_TTL)
@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from src.alerts import AlertDispatcher
+
+WEBHOOK = "https://hooks.example.com/waf"
+
+
+def dropped(reason: str) -> float:
+    return REGISTRY.get_sample_value("waf_alerts_dropped_total", {"reason": reason}) or 0.0
+
+
+class Webhook:
+    """An httpx MockTransport that records posted texts, optionally slowly"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.texts = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.delay)
+        self.texts.append(request.read().decode())
+        return httpx.Response(200)
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+
+async def settle(seconds: float = 0.05):
+    await asyncio.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_repeats_are_folded_into_one_summary():
+    webhook = Webhook()
+    alerts = AlertDispatcher(WEBHOOK, window=0.1, max_per_minute=100, client=webhook.client())
+    for _ in range(5):
+        alerts.notify("198.51.100.7", "sqli", "blocked 198.51.100.7")
+    alerts.notify("198.51.100.8", "sqli", "blocked 198.51.100.8")
+    await settle()
+    assert len(webhook.texts) == 2
+
+    await settle(0.15)
+    assert len(webhook.texts) == 3
+    assert "repeated 4 more times" in webhook.texts[-1]
+    await alerts.close()
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_open_summaries():
+    webhook = Webhook()
+    alerts = AlertDispatcher(WEBHOOK, window=60, max_per_minute=100, client=webhook.client())
+    for _ in range(3):
+        alerts.notify("198.51.100.7", "xss", "blocked")
+    await settle()
+    await alerts.close()
+    assert len(webhook.texts) == 2
+    assert "repeated 2 more times" in webhook.texts[-1]
+
+
+@pytest.mark.asyncio
+async def test_outbound_messages_are_rate_limited():
+    webhook = Webhook()
+    alerts = AlertDispatcher(WEBHOOK, window=60, max_per_minute=3, client=webhook.client())
+    before = dropped("rate_limited")
+    for i in range(5):
+        alerts.notify(f"198.51.100.{i}", "sqli", f"blocked {i}")
+    await settle()
+    assert len(webhook.texts) == 3
+    assert dropped("rate_limited") - before == 2
+    await alerts.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_are_counted():
+    alerts = AlertDispatcher(WEBHOOK, queue_size=2, window=60, max_per_minute=100, client=Webhook().client())
+    before = dropped("queue_full")
+    for i in range(5):  # the worker has not run yet, so the queue fills
+        alerts.notify(f"198.51.100.{i}", "sqli", f"blocked {i}")
+    assert dropped("queue_full") - before == 3
+    await alerts.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_webhook_does_not_hold_up_later_alerts():
+    webhook = Webhook(delay=0.2)
+    alerts = AlertDispatcher(
+        WEBHOOK, window=60, max_per_minute=100, max_in_flight=2, timeout=1.0, client=webhook.client()
+    )
+    before = dropped("in_flight")
+    for i in range(3):
+        alerts.notify(f"198.51.100.{i}", "sqli", f"blocked {i}")
+    await settle()
+    # Two posts in flight at once; the third is dropped instead of queued behind them
+    assert dropped("in_flight") - before == 1
+    await settle(0.25)
+    assert len(webhook.texts) == 2
+    await alerts.close()
+
+
+@pytest.mark.asyncio
+async def test_post_past_the_timeout_is_dropped():
+    webhook = Webhook(delay=1.0)
+    alerts = AlertDispatcher(WEBHOOK, window=60, max_per_minute=100, timeout=0.05, client=webhook.client())
+    before = dropped("timeout")
+    alerts.notify("198.51.100.7", "sqli", "blocked")
+    await settle(0.15)
+    assert dropped("timeout") - before == 1
+    assert webhook.texts == []
+    await alerts.close()
+
+
+@pytest.mark.asyncio
+async def test_close_handles_alerts_still_queued():
+    webhook = Webhook()
+    alerts = AlertDispatcher(WEBHOOK, window=60, max_per_minute=100, client=webhook.client())
+    for _ in range(3):  # the worker has not run yet
+        alerts.notify("198.51.100.7", "sqli", "blocked")
+    alerts.notify("198.51.100.8", "xss", "blocked too")
+    await alerts.close()
+    assert sorted(webhook.texts) == sorted([
+        '{"text":"blocked"}', '{"text":"blocked too"}',
+        '{"text":"blocked (repeated 2 more times in 60s)"}',
+    ])
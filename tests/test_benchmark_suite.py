@@ -0,0 +1,11 @@
+from benchmarks import corpus, suite
+
+
+def test_rules_stage_finishes_on_the_default_corpus():
+    # Request 102 is an attack followed by a 64KB body; a backtracking rule
+    # used to keep the suite on it for hours
+    requests = list(corpus.generate(2000))
+    large = [request for request in requests if len(request["body"]) > 60000]
+    assert large
+    latencies = suite.bench_rules(large)
+    assert max(latencies) < 0.25
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from src.config import settings
+from src.logger import RequestLogger
+from src.request_context import RequestContext
+
+
+@pytest.fixture
+def request_logger(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "LOG_FORMAT", "json")
+    monkeypatch.setattr(settings, "ACCESS_LOG_SAMPLE_RATE", 1.0)
+    request_logger = RequestLogger()
+    yield request_logger
+    request_logger.close()
+
+
+def make_context() -> RequestContext:
+    scope = {
+        "method": "POST", "path": "/login", "client": ("198.51.100.7", 40000),
+        "headers": [(b"authorization", b"Bearer secret"), (b"accept", b"text/html"), (b"accept", b"*/*")],
+        "query_string": b"next=%2Fhome&tag=a&tag=b",
+    }
+    return RequestContext.from_scope(scope)
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_logs_the_request_as_it_was_when_logged(request_logger, tmp_path):
+    context = make_context()
+    context["rule_scans_skipped"] = 2
+    request_logger.log_blocked_request(context, 403, "Rule match")
+    # A late block updates the live context after the first record was queued
+    context["rule_scans_skipped"] = 0
+    context["body"] = "password=hunter2"
+    context.headers["accept"] = "changed"
+    request_logger.close()
+
+    [record] = read_records(tmp_path / "error.log")
+    assert record["rule_scans_skipped"] == 2
+    assert record["headers"] == {"authorization": "[REDACTED]", "accept": "text/html, */*"}
+    assert record["query_params"] == {"next": "/home", "tag": ["a", "b"]}
+    assert record["status_code"] == 403 and record["reason"] == "Rule match"
+
+
+def test_logs_plain_request_dicts(request_logger, tmp_path):
+    request_data = {
+        "method": "GET", "path": "/", "client_ip": "198.51.100.7",
+        "headers": {"cookie": "session=1"}, "query_params": {"q": "x"},
+    }
+    request_logger.log_request(request_data, 200, 0.004)
+    request_data["headers"]["cookie"] = "session=2"
+    request_logger.close()
+
+    [record] = read_records(tmp_path / "access.log")
+    assert record["headers"] == {"cookie": "[REDACTED]"}
+    assert record["query_params"] == {"q": "x"}
+    assert record["response_time"] == "0.004s"
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from src.featurizer import HashingFeaturizer
+from src.ml_runtime import export_artifact, load_artifact
+
+NUM_BUCKETS = 500
+MAX_LENGTH = 64
+
+REQUESTS = [
+    {"method": "GET", "path": "/search", "headers": {"user-agent": "test"}, "query_params": {"q": "shoes"}, "body": ""},
+    {"method": "GET", "path": "/search", "headers": {}, "query_params": {"q": "' OR 1=1 --"}, "body": ""},
+    {"method": "POST", "path": "/comment", "headers": {"content-type": "text/plain"}, "query_params": {},
+     "body": "<script>alert(document.cookie)</script>"},
+    {"method": "GET", "path": "/files/../../etc/passwd", "headers": {}, "query_params": {}, "body": ""},
+]
+
+
+def build_model() -> "tf.keras.Model":
+    """A small model with every layer type of WAFMLModel's CNN-LSTM"""
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(MAX_LENGTH,)),
+        tf.keras.layers.Embedding(input_dim=NUM_BUCKETS, output_dim=8),
+        tf.keras.layers.Conv1D(8, 5, activation="relu"),
+        tf.keras.layers.MaxPooling1D(2),
+        tf.keras.layers.Conv1D(4, 3, activation="relu"),
+        tf.keras.layers.MaxPooling1D(2),
+        tf.keras.layers.LSTM(6, return_sequences=True),
+        tf.keras.layers.LSTM(4),
+        tf.keras.layers.Dense(8, activation="relu"),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    model.compile(optimizer="adam", loss="binary_crossentropy")
+    return model
+
+
+@pytest.fixture(scope="module")
+def trained(tmp_path_factory):
+    tf.keras.utils.set_random_seed(0)
+    featurizer = HashingFeaturizer(num_buckets=NUM_BUCKETS, max_length=MAX_LENGTH, token_slots=8)
+    model = build_model()
+    # A few epochs move the weights away from their initial values
+    inputs = featurizer.transform_requests(REQUESTS * 8)
+    model.fit(inputs, np.array([0, 1, 1, 1] * 8), epochs=3, verbose=0)
+    path = str(tmp_path_factory.mktemp("artifact") / "model.npz")
+    export_artifact(model, featurizer.to_json(), path)
+    return model, path
+
+
+def test_exported_model_matches_keras_on_requests(trained):
+    model, path = trained
+    compact, featurizer = load_artifact(path)
+    inputs = featurizer.transform_requests(REQUESTS)
+    np.testing.assert_allclose(compact.predict(inputs), model.predict(inputs, verbose=0), atol=1e-5)
+
+
+def test_exported_model_matches_keras_on_random_ids(trained):
+    model, path = trained
+    compact, _ = load_artifact(path)
+    inputs = np.random.default_rng(1).integers(0, NUM_BUCKETS, size=(32, MAX_LENGTH))
+    np.testing.assert_allclose(compact.predict_on_batch(inputs), model.predict(inputs, verbose=0), atol=1e-5)
+
+
+def test_export_refuses_unsupported_layers(tmp_path):
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(MAX_LENGTH,)),
+        tf.keras.layers.Embedding(input_dim=NUM_BUCKETS, output_dim=8),
+        tf.keras.layers.GRU(4),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    with pytest.raises(ValueError, match="Unsupported layer"):
+        export_artifact(model, HashingFeaturizer().to_json(), str(tmp_path / "model.npz"))
@@ -0,0 +1,123 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis runs the token bucket's Lua script with it
+
+from src import rate_limiter
+from src.rate_limiter import AsyncRateLimiter, HybridRateLimiter
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis_client():
+    # Each test gets its own server; FakeRedis() instances otherwise share the default one
+    return fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+@pytest.mark.asyncio
+async def test_burst_then_limited(redis_client, clock):
+    limiter = AsyncRateLimiter(redis_client, rate=60, burst=5)
+    results = [await limiter.is_rate_limited("198.51.100.7") for _ in range(7)]
+    assert results == [False] * 5 + [True] * 2
+
+
+@pytest.mark.asyncio
+async def test_buckets_are_per_ip(redis_client, clock):
+    limiter = AsyncRateLimiter(redis_client, rate=60, burst=1)
+    assert not await limiter.is_rate_limited("198.51.100.7")
+    assert await limiter.is_rate_limited("198.51.100.7")
+    assert not await limiter.is_rate_limited("198.51.100.8")
+
+
+@pytest.mark.asyncio
+async def test_refill_at_rate(redis_client, clock):
+    limiter = AsyncRateLimiter(redis_client, rate=60, burst=2)  # one token per second
+    for _ in range(2):
+        assert not await limiter.is_rate_limited("198.51.100.7")
+    assert await limiter.is_rate_limited("198.51.100.7")
+
+    clock.now += 0.5
+    assert await limiter.is_rate_limited("198.51.100.7")
+    clock.now += 0.5
+    assert not await limiter.is_rate_limited("198.51.100.7")
+    assert await limiter.is_rate_limited("198.51.100.7")
+
+
+@pytest.mark.asyncio
+async def test_refill_is_capped_at_burst(redis_client, clock):
+    limiter = AsyncRateLimiter(redis_client, rate=60, burst=3)
+    for _ in range(3):
+        await limiter.is_rate_limited("198.51.100.7")
+
+    clock.now += 3600
+    results = [await limiter.is_rate_limited("198.51.100.7") for _ in range(4)]
+    assert results == [False] * 3 + [True]
+
+
+@pytest.mark.asyncio
+async def test_fails_open_on_redis_error(clock):
+    server = fakeredis.FakeServer()
+    server.connected = False
+    limiter = AsyncRateLimiter(fakeredis.aioredis.FakeRedis(server=server), rate=60, burst=1)
+    assert [await limiter.is_rate_limited("198.51.100.7") for _ in range(3)] == [False] * 3
+
+
+def recorded_syncs(limiter: HybridRateLimiter):
+    """The IPs of each pipeline ``limiter`` sends"""
+    rounds = []
+    sync = limiter._sync
+
+    async def record(entries):
+        rounds.append(sorted(ip for ip, _ in entries))
+        await sync(entries)
+
+    limiter._sync = record
+    return rounds
+
+
+@pytest.mark.asyncio
+async def test_hybrid_syncs_only_changed_ips(redis_client, clock):
+    limiter = HybridRateLimiter(redis_client, limit=100, window_seconds=60, max_unsynced=100)
+    limiter._sync_task = object()  # drive sync() by hand
+    rounds = recorded_syncs(limiter)
+    for ip in ("198.51.100.7", "198.51.100.8"):
+        await limiter.is_rate_limited(ip)
+    await limiter.sync()
+    await limiter.is_rate_limited("198.51.100.8")
+    await limiter.sync()
+    await limiter.sync()
+    assert rounds == [["198.51.100.7", "198.51.100.8"], ["198.51.100.8"]]
+    assert await redis_client.get(limiter._key("198.51.100.8", int(clock.now // 60))) == b"2"
+
+
+@pytest.mark.asyncio
+async def test_hybrid_sync_is_batched(redis_client, clock):
+    limiter = HybridRateLimiter(redis_client, limit=100, window_seconds=60, max_unsynced=100, sync_batch=2)
+    limiter._sync_task = object()
+    rounds = recorded_syncs(limiter)
+    for i in range(5):
+        await limiter.is_rate_limited(f"198.51.100.{i}")
+    await limiter.sync()
+    assert [len(batch) for batch in rounds] == [2, 2, 1]
+    assert sorted(sum(rounds, [])) == sorted(f"198.51.100.{i}" for i in range(5))
+
+
+def test_hybrid_mode_warns_that_it_ignores_burst(redis_client, monkeypatch, caplog):
+    monkeypatch.setattr(rate_limiter.settings, "RATE_LIMIT_MODE", "hybrid")
+    limiter = rate_limiter.create_rate_limiter(redis_client, rate=10, burst=5)
+    assert isinstance(limiter, HybridRateLimiter) and limiter.limit == 10
+    assert "ignoring burst=5" in caplog.text
@@ -0,0 +1,25 @@
+import pytest
+
+from src.config import settings
+from src.routes import RoutePolicy, build_route_table
+
+
+def test_rule_families_become_a_tuple():
+    policy = RoutePolicy.from_config({"rule_families": ["xss_patterns", "sql_injection_patterns"]})
+    assert policy.rule_families == ("xss_patterns", "sql_injection_patterns")
+
+
+def test_unknown_rule_family_is_rejected():
+    with pytest.raises(ValueError, match="sql_injection"):
+        RoutePolicy.from_config({"rule_families": ["sql_injection"]})
+
+
+def test_bare_string_is_rejected():
+    with pytest.raises(ValueError, match="list of rule families"):
+        RoutePolicy.from_config({"rule_families": "xss_patterns"})
+
+
+def test_route_table_names_the_bad_route(monkeypatch):
+    monkeypatch.setattr(settings, "ROUTE_POLICIES", {"/api/**": {"rule_families": ["xss"]}})
+    with pytest.raises(ValueError, match=r"ROUTE_POLICIES\['/api/\*\*'\]"):
+        build_route_table()
@@ -0,0 +1,32 @@
+import pytest
+
+from src.config import settings
+from src.rule_sets import RuleSetError, check_backtracking, compile_rule_set
+
+
+def sqli_rules(*patterns):
+    return compile_rule_set({"sql_injection_patterns": {"patterns": list(patterns)}})
+
+
+def test_default_rules_pass_the_backtracking_check():
+    check_backtracking(compile_rule_set(settings.CUSTOM_RULES))
+
+
+def test_interleaved_literals_expose_a_cubic_pattern():
+    # Each literal repeated on its own fails fast; "'" + "or=" * n does not
+    with pytest.raises(RuleSetError, match="OR"):
+        check_backtracking(sqli_rules(r"(?i)'.*?OR.*?=.*?'"), probe_length=512)
+
+
+def test_quadratic_pattern_is_rejected_by_its_growth():
+    with pytest.raises(RuleSetError, match="superlinearly"):
+        check_backtracking(sqli_rules(r"(?i)select.*?from"), probe_length=512)
+
+
+def test_linear_pattern_passes():
+    check_backtracking(sqli_rules(r"(?i)UNION\s+SELECT", r"(?i)'\s*OR\b[^=]{0,64}="), probe_length=512)
+
+
+def test_unknown_family_is_rejected():
+    with pytest.raises(RuleSetError, match="unknown rule family"):
+        compile_rule_set({"sql_injection": {"patterns": ["x"]}})